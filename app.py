@@ -1,20 +1,21 @@
+import time
+_SCRIPT_T0 = time.perf_counter()  # 本次執行的起點：匯入耗時與首次畫面都從這裡算
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
-from datetime import datetime, timedelta 
-import time
-import os
-import io 
-from fpdf import FPDF 
-
-# Word 處理套件
-from docx import Document
-from docx.shared import Mm, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_ALIGN_VERTICAL
-from docx.enum.section import WD_ORIENT
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+import numpy as np
+from datetime import datetime, timedelta, timezone
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from search_index import SEARCH_FIELDS, InventorySearchIndex
+from availability import ReservationStore, window_bounds
+from images import IMAGE_TYPES, upload_with_thumbnail
+from documents import DocumentCache
+from bulk_io import ImportFormatError, import_equipment, spool_csv_export
+from realtime_feed import InventoryFeed
+from data_access import LazyClient, QueryPool, make_http_client, pool_connections, query_workers, with_retries, READ_RETRY_ERRORS, WRITE_RETRY_ERRORS, WRITE_WORKERS, EXPECTED_SESSIONS
+from metrics import Metrics, serve_prometheus
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # ==========================================
 # 1. 頁面設定
@@ -30,87 +31,550 @@ PAGE_BG_COLOR = "#F5F5F5"
 LOGO_URL = "https://obmikwclquacitrwzdfc.supabase.co/storage/v1/object/public/logos/logo.png"
 
 CATEGORY_OPTIONS = ["手工具", "一般器材", "廚具", "清潔用品", "文具用品", "其他"]
-FONT_FILE = "TaipeiSansTCBeta-Regular.ttf"
+STATUS_OPTIONS = ["在庫", "維修中", "報廢"]
+PAGE_SIZE_OPTIONS = [12, 30, 60]  # 每頁卡片數 (3 欄排版，取 3 的倍數)
+
+def get_setting(key, default):
+    try: return st.secrets.get(key, default)
+    except Exception: return default
+
+# --- 觀測 (呼叫次數 / 延遲 / 資料量，管理員頁底的「診斷」面板) ---
+def _session_key():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+@st.cache_resource
+def get_metrics():
+    # METRICS_LOG：每次 rerun 結束寫一行 JSON log；METRICS_PORT：另開 http://<host>:<port>/metrics 給 Prometheus 抓
+    m = Metrics(run_key=_session_key, log_runs=bool(get_setting("METRICS_LOG", False)))
+    port = get_setting("METRICS_PORT", None)
+    if port:
+        try: serve_prometheus(m, int(port))
+        except OSError as e: st.warning(f"metrics endpoint 無法啟動: {e}")
+    return m
+
+metrics = get_metrics()
+_startup = {"imports": time.perf_counter() - _SCRIPT_T0, "painted": False}  # 只在完整執行時重建；fragment 重跑沿用上一次的
+metrics.record("startup.imports", _startup["imports"])
+
+def mark_first_paint():
+    # 每次完整執行記一次「從 script 開始到庫存區第一個元素」的時間；每個 session 的第一次另存一份給診斷面板與 benchmarks/bench_startup.py
+    if _startup["painted"]: return
+    _startup["painted"] = True; elapsed = time.perf_counter() - _SCRIPT_T0
+    metrics.record("startup.first_paint", elapsed)
+    if 'startup_timing' not in st.session_state:
+        st.session_state.startup_timing = {"imports_ms": _startup["imports"] * 1000, "first_paint_ms": elapsed * 1000}
 
 # --- Supabase 連線 ---
+# DATA_BACKEND = "local"：改用 local_backend.py 的 SQLite 替身 (離線開發 / CI / benchmarks/load_test.py)，
+# LOCAL_DB 為資料庫檔案 (預設只在記憶體)，LOCAL_SEED 為空資料庫時填入的測試器材數，LOCAL_LATENCY_MS 模擬每個請求的往返時間
+DATA_BACKEND = get_setting("DATA_BACKEND", "supabase")
+SESSIONS = int(get_setting("EXPECTED_SESSIONS", EXPECTED_SESSIONS))  # 讀取執行緒池與 HTTP 連線池依此估大小
+
 @st.cache_resource
 def init_connection():
+    if DATA_BACKEND == "local":
+        from local_backend import LocalSupabase
+        db = LocalSupabase.shared(get_setting("LOCAL_DB", ":memory:"), latency=float(get_setting("LOCAL_LATENCY_MS", 0)) / 1000)
+        db.seed_equipment(int(get_setting("LOCAL_SEED", 60)))
+        return db
     try:
         url = st.secrets["SUPABASE"]["URL"]
         key = st.secrets["SUPABASE"]["KEY"]
-        return create_client(url, key)
+        # 共用一個 keep-alive 連線池 (並行查詢的執行緒也走它)，逾時設定在 httpx client 上
+        from supabase import create_client, ClientOptions
+        return create_client(url, key, options=ClientOptions(httpx_client=make_http_client(connections=pool_connections(SESSIONS), event_hooks=metrics.http_hooks())))
     except Exception as e:
         st.error(f"Supabase 連線失敗: {e}")
         return None
 
-supabase: Client = init_connection()
+# 第一次查詢時才建立 (supabase 套件的匯入也延到那時)，頁首與標題不必等它
+supabase = LazyClient(init_connection)
+
+def execute(query, write=False):
+    # 所有 Supabase 請求都經過這裡：讀取遇到傳輸錯誤 (斷線/逾時) 自動重試；寫入只在連線未建立時重試，避免重複寫入
+    return with_retries(query.execute, WRITE_RETRY_ERRORS if write else READ_RETRY_ERRORS)
+
+def _script_context():
+    # 工作執行緒也掛上目前的 ScriptRunContext，裡面才能用 st.cache_resource 等 API
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(threading.current_thread(), ctx)
+
+# 彼此獨立的查詢同時送出 (QueryPool.gather / submit)，等待時間取決於最慢的一個
+@st.cache_resource
+def get_query_pool(): return QueryPool(query_workers(SESSIONS), capture_context=_script_context)
+
+# 背景寫入 (start_write) 用自己的池子，排隊的寫入不會拖慢所有 session 的讀取
+@st.cache_resource
+def get_write_pool(): return QueryPool(WRITE_WORKERS, capture_context=_script_context, name="write")
+
+# "server"：分類/搜尋/分頁都交給 Supabase；"local"：整張表快取在本機，用記憶體索引搜尋
+INVENTORY_SEARCH_MODE = get_setting("INVENTORY_SEARCH_MODE", "server")
 
 # --- 圖片上傳 ---
+@metrics.timed()
 def upload_image(file):
-    if not file: return None
+    # 回傳 (原圖網址, 縮圖網址)；縮圖失敗時縮圖網址為 None，上傳失敗回傳 (None, None) 並顯示警告
+    if not file: return None, None
     try:
-        bucket_name = st.secrets["SUPABASE"]["BUCKET"]
-        file_ext = file.name.split('.')[-1]
-        file_name = f"{int(time.time())}_{file.name}"
-        supabase.storage.from_(bucket_name).upload(file_name, file.getvalue(), file_options={"content-type": file.type})
-        return supabase.storage.from_(bucket_name).get_public_url(file_name)
-    except Exception as e: return None
+        bucket = supabase.storage.from_(st.secrets["SUPABASE"]["BUCKET"] if DATA_BACKEND != "local" else "equipment")
+        return upload_with_thumbnail(bucket, file.getvalue(), file.name, file.type, pool=get_query_pool())
+    except Exception as e: st.warning(f"照片上傳失敗：{e}"); return None, None
+
+# ==========================================
+# 庫存快取 (跨 session 共用，寫入時遞增版本號)
+# ==========================================
+INVENTORY_TTL = 60  # 秒；其他程序的寫入最多延遲這麼久才會看到 (過期後走增量同步，成本很低)
+FULL_SYNC_INTERVAL = 3600  # 秒；定期整表重抓一次，避免增量同步的漏網之魚累積
+DELTA_OVERLAP = 120  # 秒；增量同步從上次同步點往回重抓這麼久，補上 updated_at 較早但較晚提交的交易
+QUERY_CACHE_SIZE = 256  # 分頁等小查詢的快取筆數上限
+
+class InventoryCache:
+    # 回傳的 DataFrame 為所有 session 共用，呼叫端請勿原地修改
+    def __init__(self, ttl=INVENTORY_TTL, full_sync_interval=FULL_SYNC_INTERVAL):
+        self.ttl = ttl; self.full_sync_interval = full_sync_interval; self.version = 0
+        self.hits = 0; self.misses = 0; self.delta_syncs = 0; self.last_rows = 0
+        self.live = False; self.pushes = 0  # live：Realtime 訂閱中，快取由推播修補，不必靠 TTL 過期重抓
+        self._df = None; self._df_version = -1; self._loaded_at = 0.0; self._full_at = 0.0
+        self._queries = OrderedDict()  # key -> (loaded_at, value)，版本號變動時整批清掉
+        self._derived = {}  # name -> (來源 df, 由它算出的結構)，df 換新才重算
+        self._inflight = {}  # key -> Future；同一個 key 同時只有一個執行緒在載入，其他人等它的結果 (整表 df 的 key 為 None)
+        self._pending = []  # 整表載入期間收到的本機修補 / 推播，載入完成後補套到新 df
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        # 持鎖呼叫：回傳 (future, 是否由自己載入)
+        future = self._inflight.get(key)
+        if future is not None: return future, False
+        future = self._inflight[key] = Future()
+        return future, True
+
+    def get(self, loader, delta_loader=None):
+        # loader() -> df；delta_loader(舊 df) -> (新 df, 這次搬了幾筆)。載入不持鎖 (delta_loader 會用查詢池並行查)，
+        # 推播與本機修補照常進來，記在 _pending 等載入完補上
+        with self._lock:
+            now = time.monotonic()
+            if self._df is not None and self._df_version == self.version and now - self._loaded_at < self._ttl():
+                self.hits += 1; return self._df
+            self.misses += 1
+            future, owner = self._join(None)
+            if owner:
+                base = self._df if delta_loader is not None and self._df is not None and now - self._full_at < self.full_sync_interval else None
+                version = self.version; self._pending = []
+        if not owner: return future.result()
+        try:
+            if base is not None: df, rows = delta_loader(base)
+            else: df = loader(); rows = len(df)
+        except BaseException as e:
+            with self._lock: del self._inflight[None]; self._pending = []
+            future.set_exception(e); raise
+        with self._lock:
+            for patcher in self._pending:
+                patched = patcher(df)
+                if patched is None: version = -1; break  # 無法修補：這份 df 下次 get 就重新同步
+                df = patched
+            self._df = df; self.last_rows = rows; self._loaded_at = now
+            if base is not None: self.delta_syncs += 1
+            else: self._full_at = now
+            self._df_version = version  # 載入期間有寫入 (invalidate) 的話版本已變，下次 get 再同步一次
+            del self._inflight[None]; self._pending = []
+        future.set_result(df)
+        return df
+
+    def get_query(self, key, loader):
+        with self._lock:
+            now = time.monotonic()
+            entry = self._queries.get(key)
+            if entry is not None and now - entry[0] < self._ttl():
+                self._queries.move_to_end(key); self.hits += 1; return entry[1]
+            self.misses += 1; version = self.version; pushes = self.pushes
+            future, owner = self._join(key)
+        if not owner: return future.result()
+        # 查詢本身不持鎖，同一頁的摘要與分頁查詢才能並行；期間若有寫入或推播就不存這份結果
+        try: value = loader()
+        except BaseException as e:
+            with self._lock: del self._inflight[key]
+            future.set_exception(e); raise
+        with self._lock:
+            if self.version == version and self.pushes == pushes:
+                self._queries[key] = (now, value); self._queries.move_to_end(key)
+                while len(self._queries) > QUERY_CACHE_SIZE: self._queries.popitem(last=False)
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    def get_derived(self, name, df, builder):
+        # 由快取 df 衍生的唯讀結構 (搜尋索引等)，每個庫存版本只算一次
+        with self._lock:
+            entry = self._derived.get(name)
+            if entry is not None and entry[0] is df: return entry[1]
+            value = builder(df); self._derived[name] = (df, value)
+            return value
+
+    def invalidate(self):
+        with self._lock: self.version += 1; self._queries.clear()
+
+    def _ttl(self): return self.full_sync_interval if self.live else self.ttl
+
+    def set_live(self, live):
+        # 訂閱成功 (含斷線重連) 時整批作廢：斷線期間的異動可能漏接
+        with self._lock:
+            self.live = live
+            if live: self.version += 1; self._queries.clear()
+
+    def apply_local(self, changes):
+        # 本機寫入的樂觀更新：changes = {uid: 欄位更新 dict (值可為 Series -> Series 的函式)，None 表示刪除}。
+        # 快取 df 與已快取的分頁結果一起修補，寫入在背景送出；完成時寫入函式會 invalidate，下次 rerun 以伺服器資料為準
+        with self._lock:
+            if self._df is not None: self._df = patch_equipment_rows(self._df, changes)
+            if None in self._inflight: self._pending.append(lambda df: patch_equipment_rows(df, changes))
+            for key, (loaded_at, value) in list(self._queries.items()):
+                if key[0] == "page": self._queries[key] = (loaded_at, (patch_equipment_rows(value[0], changes), value[1]))
+
+    def apply_push(self, patcher):
+        # Realtime 推來的單筆異動：patcher(舊 df) -> 新 df，直接換掉快取的 df (不重新下載整張表)；patcher 回傳 None 表示無法修補，整批作廢。
+        # 換成新物件而非原地修改，其他 session 手上的舊 df 不受影響；伺服器端查詢 (分頁/摘要) 只有幾十列，作廢後重查
+        with self._lock:
+            self.pushes += 1; self._queries.clear()
+            if self._df is not None and self._df_version == self.version:
+                patched = patcher(self._df)
+                if patched is None: self.version += 1
+                else: self._df = patched
+            if None in self._inflight: self._pending.append(patcher)
+
+    def stats(self):
+        age = time.monotonic() - self._loaded_at if self._df is not None else None
+        return {"version": self.version, "hits": self.hits, "misses": self.misses, "delta_syncs": self.delta_syncs, "last_rows": self.last_rows, "age": age, "live": self.live, "pushes": self.pushes}
+
+@st.cache_resource
+def get_inventory_cache(): return InventoryCache()
+
+# 借用單 PDF/Word 快取：同一份內容 (清單 + 借用人資訊) 只產生一次，所有 session 共用
+@st.cache_resource
+def get_document_cache(): return DocumentCache(int(get_setting("DOCUMENT_CACHE_MB", 64)) * 1024 * 1024, timed=metrics.call)
 
 # ==========================================
 # 資料庫 CRUD 與 邏輯函式
 # ==========================================
-def load_data():
-    response = supabase.table("equipment").select("*").order("id", desc=True).execute()
-    df = pd.DataFrame(response.data)
+def now_utc_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def _normalize_equipment(df):
     if 'borrowed' not in df.columns and not df.empty: df['borrowed'] = 0
     return df
 
+def fetch_equipment():
+    response = execute(supabase.table("equipment").select("*").order("id", desc=True))
+    return _normalize_equipment(pd.DataFrame(response.data))
+
+def _last_sync_point(df, overlap=DELTA_OVERLAP):
+    # 已見過的最大 updated_at 再往回 overlap 秒：updated_at 在交易開始時蓋章，比別列晚提交的列可能帶著較早的時間
+    if df.empty or 'updated_at' not in df.columns: return None
+    ts = pd.to_datetime(df['updated_at'], utc=True, errors='coerce', format='ISO8601').max()
+    return None if pd.isna(ts) else (ts - pd.Timedelta(seconds=overlap)).isoformat()
+
+def fetch_equipment_delta(df):
+    # 抓 updated_at 不早於同步點 (含重疊區間) 的列，依 uid 覆蓋舊列；重疊區間重抓到的未變更列覆蓋後內容相同
+    # (超過 DELTA_OVERLAP 才提交的長交易靠 FULL_SYNC_INTERVAL 整表重抓補上)
+    since = _last_sync_point(df)
+    if since is None: new_df = fetch_equipment(); return new_df, len(new_df)
+    # 異動列與筆數 (刪除偵測用，head 請求不帶資料) 同時查
+    res = get_query_pool().gather({
+        "changed": lambda: execute(supabase.table("equipment").select("*").gte("updated_at", since)).data,
+        "count": lambda: execute(supabase.table("equipment").select("uid", count="exact", head=True)).count,
+    })
+    changed = pd.DataFrame(res["changed"])
+    if not changed.empty:
+        changed = changed.drop_duplicates("uid", keep="last")
+        df = pd.concat([df[~df['uid'].isin(changed['uid'])], _normalize_equipment(changed)], ignore_index=True)
+    # 筆數對不上才抓 uid 清單
+    server_count = res["count"]
+    if server_count is not None and server_count != len(df):
+        live_uids = {r['uid'] for r in execute(supabase.table("equipment").select("uid")).data}
+        df = df[df['uid'].isin(live_uids)]
+    return df.sort_values("id", ascending=False).reset_index(drop=True), len(changed)
+
+def patch_equipment_rows(df, changes):
+    if df.empty: return df
+    deleted = [uid for uid, upd in changes.items() if upd is None]
+    df = df[~df['uid'].isin(deleted)].reset_index(drop=True) if deleted else df.copy()
+    for uid, upd in changes.items():
+        if not upd: continue
+        mask = df['uid'] == uid
+        for col, value in upd.items():
+            if col in df.columns: df.loc[mask, col] = value(df.loc[mask, col]) if callable(value) else value
+    return df
+
+def apply_equipment_change(df, event, record, old_record):
+    # 與 fetch_equipment_delta 相同的依 uid 覆蓋；DELETE 的 old_record 只帶主鍵 id。
+    # 快取是沒有欄位的空表 (資料表為空時載入) 或推播缺主鍵時無從修補，回傳 None 讓快取作廢重抓
+    if df.empty or 'id' not in df.columns or 'uid' not in df.columns: return None
+    if event == "DELETE": return df[df['id'] != old_record.get('id')].reset_index(drop=True)
+    if not record or record.get('id') is None or record.get('uid') is None: return None
+    changed = _normalize_equipment(pd.DataFrame([record]))
+    df = pd.concat([df[(df['uid'] != record['uid']) & (df['id'] != record['id'])], changed], ignore_index=True)
+    return df.sort_values("id", ascending=False).reset_index(drop=True)
+
+# 庫存即時推播：整個程序共用一條 Realtime 連線，異動直接修補 InventoryCache
+LIVE_REFRESH_SECONDS = 1  # 借用者畫面每秒比對一次快取的推播計數 (不查資料庫、不重畫)
+
+@st.cache_resource
+def get_inventory_feed():
+    if DATA_BACKEND == "local" or not get_setting("REALTIME_ENABLED", True): return None
+    try: url = st.secrets["SUPABASE"]["URL"]; key = st.secrets["SUPABASE"]["KEY"]
+    except Exception: return None
+    cache = get_inventory_cache(); store = get_reservation_store()
+    def on_change(table, event, record, old_record):
+        if table == "equipment": cache.apply_push(lambda df: apply_equipment_change(df, event, record, old_record))
+        elif table == "borrow_records": store.apply_change(event, record, old_record)  # 含未來的預約 (不會動到 equipment)
+    def on_live(live): cache.set_live(live); store.set_live(live)
+    return InventoryFeed(url, key, on_change=on_change, on_live=on_live).start()
+
+@metrics.timed()
+def load_data(incremental=True):
+    return get_inventory_cache().get(fetch_equipment, fetch_equipment_delta if incremental else None)
+
+# 卡片只需要這些欄位 (不含 updated_at 等)
+CARD_COLUMNS = "id, uid, name, category, status, location, quantity, borrowed, image_url, thumbnail_url"
+
+def _ilike_filter_value(text):
+    # 使用者輸入當字面字串比對：跳脫 LIKE 萬用字元，再用雙引號包起來避免 , ( ) 破壞 or= 語法。
+    # PostgREST 會把值裡所有的 * 換成 %，跳脫不了；改成單字元萬用字元 _ (仍比對得到字面的 *，搜尋說明裡有寫)
+    pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('*', '_')
+    quoted = f"*{pattern}*".replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{quoted}"'
+
+SEARCH_HELP = ("比對編號、名稱與位置 (不分大小寫)，輸入的字照字面比對；唯一例外是「*」，會比對任一個字元 (例如 A*1 也會找到 AB1)"
+               if INVENTORY_SEARCH_MODE == "server" else "比對編號、名稱與位置 (不分大小寫、全形半形)，輸入的字照字面比對")
+
+def fetch_equipment_page(page, page_size, category=None, search=None, status=None):
+    q = supabase.table("equipment").select(CARD_COLUMNS, count="exact")
+    if category: q = q.eq("category", category)
+    if status: q = q.eq("availability", status)
+    if search:
+        v = _ilike_filter_value(search)
+        q = q.or_(",".join(f"{field}.ilike.{v}" for field in SEARCH_FIELDS))  # 與本機模式的搜尋索引同樣查 uid / name / location
+    start = page * page_size
+    res = execute(q.order("id", desc=True).range(start, start + page_size - 1))
+    return _normalize_equipment(pd.DataFrame(res.data)), (res.count or 0)
+
+@metrics.timed()
+def load_equipment_page(page, page_size, category=None, search=None, status=None):
+    # 回傳 (這一頁的 df, 符合條件的總筆數)；分類、狀態與搜尋都在資料庫端完成
+    key = ("page", category, search, status, page, page_size)
+    return get_inventory_cache().get_query(key, lambda: fetch_equipment_page(page, page_size, category, search, status))
+
+@metrics.timed()
+def search_local_inventory(df, category, query, page, page_size, status=None):
+    # 本機模式：用快取 df 的搜尋索引篩選並排序，再切出這一頁
+    cache = get_inventory_cache()
+    filtered = df
+    if query: filtered = df.iloc[list(cache.get_derived("search_index", df, InventorySearchIndex).search(query))]
+    if category: filtered = filtered[filtered['category'] == category]
+    if status: filtered = filtered[cache.get_derived("status_buckets", df, compute_status_buckets).loc[filtered.index] == status]
+    return filtered.iloc[page * page_size:(page + 1) * page_size], len(filtered)
+
+@metrics.timed()
+def load_inventory_summary():
+    # 每個庫存版本只算一次：本機模式由快取 df 聚合，伺服器模式讀 equipment_summary 檢視表 (幾十列)
+    cache = get_inventory_cache()
+    if INVENTORY_SEARCH_MODE == "local": return cache.get_derived("summary", load_data(), summarize_equipment)
+    return cache.get_query(("summary",), lambda: InventorySummary(execute(supabase.table("equipment_summary").select("*")).data))
+
+@metrics.timed()
 def add_equipment_to_db(data):
-    supabase.table("equipment").insert(data).execute()
+    execute(supabase.table("equipment").insert(data), write=True)
+    get_inventory_cache().invalidate()
 
+@metrics.timed()
 def update_equipment_in_db(uid, updates):
-    supabase.table("equipment").update(updates).eq("uid", uid).execute()
+    updates = {**updates, "updated_at": now_utc_iso()}
+    execute(supabase.table("equipment").update(updates).eq("uid", uid), write=True)
+    get_inventory_cache().invalidate()
 
+@metrics.timed()
 def delete_equipment_from_db(uid):
-    supabase.table("equipment").delete().eq("uid", uid).execute()
+    execute(supabase.table("equipment").delete().eq("uid", uid), write=True)
+    get_inventory_cache().invalidate()
 
-def add_borrow_record(uid, name, borrower, contact, qty, borrow_date_obj):
-    current_time = datetime.now().time()
-    dt_combined = datetime.combine(borrow_date_obj, current_time)
-    
-    data = {
-        "equipment_uid": uid, "equipment_name": name,
-        "borrower_name": borrower, "contact_info": contact,
-        "borrow_qty": qty, "is_returned": False,
-        "borrow_date": dt_combined.isoformat()
-    }
-    supabase.table("borrow_records").insert(data).execute()
+class CheckoutError(Exception):
+    # 伺服器端庫存檢查失敗 (整張單都沒有寫入)
+    def __init__(self, uids):
+        self.uids = uids
+        super().__init__(f"庫存不足或不可借用: {', '.join(uids)}")
+
+@metrics.timed()
+def checkout_order(items, borrower, contact, borrow_date_obj, return_date_obj):
+    # 一次 RPC 完成整張借用單：鎖定器材列、檢查 [借出, 預計歸還) 期間的可借數量、批次寫入 borrow_records；
+    # borrowed 是「目前借出」，借出時間已到才遞增 (未來的預約由 start_due_borrows 到時計入)
+    dt_combined = datetime.combine(borrow_date_obj, datetime.now().time())
+    due = datetime.combine(return_date_obj, datetime.max.time().replace(microsecond=0))  # 佔用到歸還日當天結束
+    payload = [{"uid": str(item['uid']), "qty": int(item['borrow_qty'])} for item in items]
+    try:
+        res = execute(supabase.rpc("checkout_order", {
+            "p_borrower": borrower, "p_contact": contact,
+            "p_borrow_date": dt_combined.isoformat(), "p_due_date": due.isoformat(), "p_items": payload
+        }), write=True)
+    except Exception as e:
+        get_reservation_store().invalidate()  # 庫存不足表示本程序的期間資料落後；其他錯誤不確定是否已寫入
+        msg = getattr(e, 'message', None) or str(e)
+        if "insufficient_stock:" in msg: raise CheckoutError(msg.split("insufficient_stock:", 1)[1].strip().split(",")) from e
+        raise
+    finally:
+        get_inventory_cache().invalidate()
+    get_reservation_store().upsert(res.data)  # RPC 回傳寫入的整列，直接補進期間索引
+    return res.data
+
+def fetch_reservations():
+    # 所有未歸還紀錄的期間，一個 RPC 回傳欄位陣列 (migration 20261017001300)
+    return execute(supabase.rpc("active_reservations", {})).data
+
+@st.cache_resource
+def get_reservation_store():
+    # 與庫存快取分開：器材編輯、庫存推播不會清掉它；借還結果與 borrow_records 推播直接修補，重抓為 single-flight
+    return ReservationStore(fetch_reservations, ttl=INVENTORY_TTL, live_ttl=FULL_SYNC_INTERVAL)
+
+@metrics.timed()
+def load_reservation_index():
+    # 日期區間可借數量的索引 (availability.py)
+    return get_reservation_store().index()
 
+@metrics.timed()
 def load_active_borrows():
-    res = supabase.table("borrow_records").select("*").eq("is_returned", False).order("borrow_date", desc=True).execute()
+    # active_borrow_records 檢視表 = 未歸還紀錄 + 器材分類 (資料庫端 join)，歸還頁不必再載入整張器材表
+    res = execute(supabase.table("active_borrow_records").select("*").order("borrow_date", desc=True))
     return pd.DataFrame(res.data)
 
-def return_equipment_transaction(record_id, uid, qty_to_return):
-    eq_res = supabase.table("equipment").select("borrowed").eq("uid", uid).execute()
-    if eq_res.data:
-        current = eq_res.data[0]['borrowed']
-        new_borrowed = max(0, current - qty_to_return)
-        supabase.table("equipment").update({"borrowed": new_borrowed}).eq("uid", uid).execute()
-        supabase.table("borrow_records").update({"is_returned": True, "return_date": datetime.utcnow().isoformat()}).eq("id", record_id).execute()
-        return True
-    return False
+DUE_CHECK_SECONDS = 60  # 預約開始的檢查間隔；資料庫有 pg_cron 時每分鐘自己跑，這裡是沒有 pg_cron 時的保險
+
+@metrics.timed()
+def start_due_borrows():
+    # 借出時間已到的預約計入 equipment.borrowed，有補上就作廢庫存快取
+    started = execute(supabase.rpc("start_due_borrows", {}), write=True).data
+    if started: get_inventory_cache().invalidate()
+    return started
+
+@st.cache_resource
+def get_due_check(): return {"at": 0.0, "lock": threading.Lock()}
+
+def schedule_due_borrows():
+    # 整個程序每 DUE_CHECK_SECONDS 秒最多送一次，在寫入池背景執行，不擋這次的畫面
+    check = get_due_check(); now = time.monotonic()
+    with check["lock"]:
+        if now - check["at"] < DUE_CHECK_SECONDS: return
+        check["at"] = now
+    get_write_pool().submit(start_due_borrows)
+
+@metrics.timed()
+def return_equipment_batch(items):
+    # items: [(record_id, uid, qty), ...]，一次 RPC 完成所有扣減與結案
+    # 回傳 [{"record_id", "ok", "reason"}, ...]；reason: not_found / already_returned / mismatch
+    if not items: return []
+    payload = [{"record_id": int(rid), "uid": str(uid), "qty": int(qty)} for rid, uid, qty in items]
+    store = get_reservation_store()
+    try: res = execute(supabase.rpc("return_borrow_records", {"p_items": payload}), write=True)
+    except Exception: store.invalidate(); raise
+    finally: get_inventory_cache().invalidate()
+    # 已結案 / 不存在的紀錄都不再佔用期間；mismatch 表示本程序看到的紀錄已被改過，整份重抓
+    store.remove([r['record_id'] for r in res.data if r['ok'] or r['reason'] in ("not_found", "already_returned")])
+    if any(r['reason'] == "mismatch" for r in res.data): store.invalidate()
+    return res.data
+
+@metrics.timed()
+def import_equipment_batch(records):
+    # 批次匯入的一塊 (最多 IMPORT_CHUNK_ROWS 列)，一次 RPC 以 uid upsert
+    # 回傳 [{"equipment_uid", "action"}, ...]；action: inserted / updated / quantity_below_borrowed
+    try: res = execute(supabase.rpc("import_equipment", {"p_rows": records}), write=True)
+    finally: get_inventory_cache().invalidate()
+    return res.data or []
+
+@metrics.timed()
+def fetch_export_page(table, after_id, limit):
+    # 匯出用 keyset 分頁：id 大於上一頁最後一筆，不用 offset (越後面越慢)
+    return execute(supabase.table(table).select("*").gt("id", after_id).order("id").limit(limit)).data
+
+def export_table_csv(table):
+    return spool_csv_export(lambda after_id, limit: fetch_export_page(table, after_id, limit))
 
-def get_taiwan_time_str():
-    return (datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M')
+# --- 借用歷史 (borrow_history = borrow_records + 已歸檔紀錄，見 20261017001000_borrow_history.sql) ---
+HISTORY_PAGE_SIZE = 50
+HISTORY_COLUMNS = "id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, due_date, return_date, archived"
+
+def fetch_history_page(page_size, after=None, borrower=None, uid=None, date_from=None, date_to=None):
+    # keyset 分頁：after = 上一頁最後一列的 (borrow_date, id)，依 (borrow_date, id) 由新到舊接著抓；
+    # 不算總筆數 (union view 的 count=exact 要掃完兩張表)，多抓一列判斷有沒有下一頁
+    q = supabase.table("borrow_history").select(HISTORY_COLUMNS)
+    if borrower: q = q.eq("borrower_name", borrower)
+    if uid: q = q.eq("equipment_uid", uid)
+    if date_from: q = q.gte("borrow_date", date_from)
+    if date_to: q = q.lt("borrow_date", date_to)
+    if after: q = q.lte("borrow_date", after[0]).or_(f'borrow_date.lt."{after[0]}",id.lt.{int(after[1])}')
+    rows = execute(q.order("borrow_date", desc=True).order("id", desc=True).limit(page_size + 1)).data
+    return pd.DataFrame(rows[:page_size]), len(rows) > page_size
+
+@metrics.timed()
+def load_borrow_history(page_size, after=None, borrower=None, uid=None, date_from=None, date_to=None):
+    # 回傳 (這一頁的 df, 是否有下一頁)；借還寫入會 invalidate 庫存快取，這裡的結果跟著作廢 (一頁只抓 page_size + 1 列)
+    key = ("history", borrower, uid, date_from, date_to, after, page_size)
+    return get_inventory_cache().get_query(key, lambda: fetch_history_page(page_size, after, borrower, uid, date_from, date_to))
+
+USAGE_STATS_TTL = 300  # 秒；使用統計是整段歷史的聚合，幾分鐘的延遲無妨
+
+@st.cache_resource
+def get_stats_cache():
+    # 使用統計自己的快取：只靠 TTL 過期，借還寫入不清掉它 (每次寫入都重算聚合太貴)
+    return InventoryCache(ttl=USAGE_STATS_TTL)
+
+@metrics.timed()
+def load_usage_stats(borrower=None, uid=None, date_from=None, date_to=None):
+    # 每項器材的借用次數 / 數量 / 平均借期，由 borrow_usage_stats RPC 在資料庫端聚合
+    params = {"p_borrower": borrower, "p_uid": uid, "p_from": date_from, "p_to": date_to}
+    return get_stats_cache().get_query(("usage", borrower, uid, date_from, date_to),
+                                       lambda: pd.DataFrame(execute(supabase.rpc("borrow_usage_stats", params)).data))
 
 def get_today_str():
     return (datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d')
 
+# 庫存狀態分組 (指標、狀態篩選共用)；與資料庫 equipment.availability 產生欄位的規則一致
+STATUS_BUCKETS = ["足額", "部分", "已借完", "維修中", "報廢"]
+STATUS_BUCKET_LABELS = {"足額": "✅ 足額在庫", "部分": "⚠️ 部分在庫", "已借完": "🔴 已借完", "維修中": "🔧 維修中", "報廢": "🗑️ 報廢"}
+
+def compute_status_buckets(df):
+    # 向量化版的 get_status_display 分組，回傳與 df 同 index 的 Series
+    borrowed = df['borrowed'].fillna(0); avail = df['quantity'] - borrowed
+    bucket = pd.Series(np.where(avail <= 0, "已借完", np.where(borrowed > 0, "部分", "足額")), index=df.index)
+    return bucket.where(~df['status'].isin(['維修中', '報廢']), df['status'])
+
+class InventorySummary:
+    # 由 (category, availability) 分組聚合列建成：總數、各分類筆數、各狀態筆數
+    def __init__(self, groups):
+        self.item_count = 0; self.quantity = 0; self.borrowed = 0
+        self.by_category = {}; self.by_status = dict.fromkeys(STATUS_BUCKETS, 0)
+        for g in groups:
+            n = int(g['item_count'])
+            self.item_count += n; self.quantity += int(g['quantity'] or 0); self.borrowed += int(g['borrowed'] or 0)
+            self.by_category[g['category']] = self.by_category.get(g['category'], 0) + n
+            self.by_status[g['availability']] = self.by_status.get(g['availability'], 0) + n
+
+    @property
+    def available(self): return self.quantity - self.borrowed
+
+def summarize_equipment(df):
+    if df.empty: return InventorySummary([])
+    grouped = df.assign(availability=compute_status_buckets(df)).groupby(['category', 'availability'], dropna=False)
+    agg = grouped.agg(item_count=('uid', 'size'), quantity=('quantity', 'sum'), borrowed=('borrowed', 'sum')).reset_index()
+    return InventorySummary(agg.to_dict('records'))
+
 def get_status_display(row):
     manual = row.get('status', '在庫')
     if manual in ['維修中', '報廢']: return manual, "grey"
     
     total = row.get('quantity', 1)
+    if pd.notna(row.get('free')):  # 借用者畫面：所選借用期間內的可借數量
+        free = int(row['free'])
+        if free <= 0: return "🔴 此期間已借完", "red"
+        elif free < total: return f"⚠️ 此期間剩 {free}", "orange"
+        else: return f"✅ 此期間可借 ({free}/{total})", "green"
     borrowed = row.get('borrowed', 0)
     avail = total - borrowed
     
@@ -118,141 +582,27 @@ def get_status_display(row):
     elif borrowed > 0: return f"⚠️ 部分在庫 (剩 {avail})", "orange"
     else: return f"✅ 足額在庫 ({avail}/{total})", "green"
 
-# ==========================================
-# PDF 生成模組
-# ==========================================
-class PDFReport(FPDF):
-    def __init__(self):
-        super().__init__(orientation='L', unit='mm', format='A4')
-        self.set_auto_page_break(auto=False) 
-    
-    def set_meta_info(self, borrower, contact, b_date, r_date):
-        self.meta_borrower = borrower
-        self.meta_contact = contact
-        self.meta_b_date = b_date
-        self.meta_r_date = r_date
-
-    def header(self):
-        if os.path.exists(FONT_FILE):
-            try: self.add_font('ChineseFont', '', FONT_FILE); self.set_font('ChineseFont', '', 12)
-            except: self.set_font("Helvetica", size=12)
-        
-        self.set_font_size(24); self.cell(0, 15, txt="團隊器材借用 / 清點單", ln=1, align='C')
-        self.set_font_size(10); self.cell(0, 8, txt=f"製表日期: {get_taiwan_time_str()}", ln=1, align='R')
-        
-        if hasattr(self, 'meta_borrower'):
-            self.set_font_size(12)
-            info_text = f"借用人：{self.meta_borrower}   |   聯絡方式：{self.meta_contact}   |   租借期間：{self.meta_b_date} 至 {self.meta_r_date}"
-            self.cell(0, 8, txt=info_text, ln=1, align='L')
-        
-        self.line(10, self.get_y(), 287, self.get_y()); self.ln(2)
-        
-        self.set_font_size(12); self.set_fill_color(232, 139, 0); self.set_text_color(255, 255, 255); self.set_line_width(0.3)
-        headers = ["分類項目", "編號", "器材名稱", "借用數量", "營前清點", "離營清點", "營後清點"]
-        col_w = [35, 30, 80, 20, 37, 37, 37] 
-        for i, h in enumerate(headers): self.cell(col_w[i], 10, h, border=1, align='C', fill=True)
-        self.ln(); self.set_text_color(0, 0, 0) 
-
-    def footer(self):
-        self.set_y(-25)
-        if os.path.exists(FONT_FILE): self.set_font('ChineseFont', '', 12)
-        self.cell(90, 10, "器材負責人：__________________", align='L')
-        self.cell(90, 10, "活動負責人：__________________", align='C')
-        self.cell(90, 10, "指導老師：__________________", align='R')
-
-def create_pdf(cart_data, text_display_map, borrower, contact, b_date, r_date):
-    pdf = PDFReport()
-    pdf.set_meta_info(borrower, contact, str(b_date), str(r_date))
-    pdf.add_page()
-    
-    if os.path.exists(FONT_FILE): pdf.set_font('ChineseFont', '', 11)
-    else: pdf.set_font("Helvetica", size=11)
-    col_w = [35, 30, 80, 20, 37, 37, 37] 
-    total_rows = len(cart_data); fill = False; pdf.set_fill_color(245, 245, 245)
-    for i in range(total_rows):
-        if pdf.get_y() > 170: pdf.add_page(); force_new = True 
-        else: force_new = False
-        item = cart_data[i]; cat = item['category']
-        draw_top = (i == 0 or cart_data[i-1]['category'] != cat or force_new)
-        draw_bottom = (i == total_rows - 1 or cart_data[i+1]['category'] != cat or (pdf.get_y() + 10 > 170))
-        cat_border = 'LR' + ('T' if draw_top else '') + ('B' if draw_bottom else '')
-        cat_disp = cat if (text_display_map.get(i) or force_new) else ""
-        pdf.cell(col_w[0], 10, cat_disp, border=cat_border, align='C', fill=False)
-        pdf.cell(col_w[1], 10, str(item['uid']), border=1, align='C', fill=fill)
-        name = str(item['name']); 
-        if pdf.get_string_width(name) > col_w[2]-2: name = name[:14]+"..."
-        pdf.cell(col_w[2], 10, name, border=1, align='C', fill=fill)
-        pdf.cell(col_w[3], 10, str(item['borrow_qty']), border=1, align='C', fill=fill)
-        for _ in range(3): pdf.cell(col_w[4], 10, "", border=1, align='C', fill=fill)
-        pdf.ln(); fill = not fill 
-    return pdf.output()
-
-# ==========================================
-# Word 生成模組
-# ==========================================
-def set_cell_bg(cell, color_hex):
-    shading_elm = OxmlElement('w:shd')
-    shading_elm.set(qn('w:val'), 'clear'); shading_elm.set(qn('w:color'), 'auto'); shading_elm.set(qn('w:fill'), color_hex)
-    cell._tc.get_or_add_tcPr().append(shading_elm)
-
-def create_word(cart_data, borrower, contact, b_date, r_date):
-    doc = Document(); section = doc.sections[0]; section.orientation = WD_ORIENT.LANDSCAPE
-    section.page_width = Mm(297); section.page_height = Mm(210)
-    section.left_margin = Mm(12); section.right_margin = Mm(12)
-    
-    heading = doc.add_paragraph("團隊器材借用 / 清點單"); heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = heading.runs[0]; run.font.size = Pt(24); run.bold = True
-    run.font.name = "Microsoft JhengHei"; run.element.rPr.rFonts.set(qn('w:eastAsia'), 'Microsoft JhengHei')
-    
-    info_para = doc.add_paragraph()
-    info_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
-    info_run = info_para.add_run(f"借用人：{borrower}    聯絡方式：{contact}    租借期間：{b_date} ~ {r_date}")
-    info_run.font.size = Pt(12); info_run.font.name = "Microsoft JhengHei"; info_run.element.rPr.rFonts.set(qn('w:eastAsia'), 'Microsoft JhengHei')
-
-    date_para = doc.add_paragraph(f"製表日期: {get_taiwan_time_str()}"); date_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    
-    table = doc.add_table(rows=1, cols=7); table.style = 'Table Grid'; table.autofit = False 
-    headers = ["分類項目", "編號", "器材名稱", "借用數量", "營前清點", "離營清點", "營後清點"]
-    widths = [12, 10, 30, 8, 13, 13, 13]; total_width_mm = 273 
-    hdr_row = table.rows[0]
-    for i, text in enumerate(headers):
-        cell = hdr_row.cells[i]; cell.text = text; set_cell_bg(cell, "E88B00")
-        para = cell.paragraphs[0]; para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        run = para.runs[0]; run.font.color.rgb = RGBColor(255, 255, 255); run.font.bold = True
-        run.font.size = Pt(12); run.font.name = "Microsoft JhengHei"; run.element.rPr.rFonts.set(qn('w:eastAsia'), 'Microsoft JhengHei')
-        cell.width = Mm(total_width_mm * widths[i] / 100)
-    for idx, item in enumerate(cart_data):
-        row_cells = table.add_row().cells
-        row_cells[0].text = item['category']; row_cells[1].text = str(item['uid'])
-        row_cells[2].text = str(item['name']); row_cells[3].text = str(item['borrow_qty'])
-        for i, cell in enumerate(row_cells):
-            cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER; cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            cell.width = Mm(total_width_mm * widths[i] / 100)
-            run = cell.paragraphs[0].runs[0] if cell.paragraphs[0].runs else cell.paragraphs[0].add_run()
-            run.font.name = "Microsoft JhengHei"; run.element.rPr.rFonts.set(qn('w:eastAsia'), 'Microsoft JhengHei')
-    col_idx = 0; start_row = 1 
-    while start_row < len(table.rows):
-        cat_text = table.rows[start_row].cells[col_idx].text; end_row = start_row + 1
-        while end_row < len(table.rows) and table.rows[end_row].cells[col_idx].text == cat_text:
-            table.rows[end_row].cells[col_idx].text = ""; end_row += 1
-        if end_row > start_row + 1: table.rows[start_row].cells[col_idx].merge(table.rows[end_row - 1].cells[col_idx])
-        start_row = end_row
-    doc.add_paragraph("\n"); sig_table = doc.add_table(rows=1, cols=3); sig_table.autofit = True; sig_table.width = Mm(273)
-    sig_cells = sig_table.rows[0].cells
-    sig_cells[0].text = "器材負責人：__________________"; sig_cells[1].text = "活動負責人：__________________"
-    sig_cells[2].text = "指導老師：__________________"
-    for cell in sig_cells: cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-    sig_cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.LEFT; sig_cells[2].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    f = io.BytesIO(); doc.save(f); f.seek(0); return f
-
 # ==========================================
 # 介面定義
 # ==========================================
 if 'cart' not in st.session_state: st.session_state.cart = {}
+if 'cart_gen' not in st.session_state: st.session_state.cart_gen = 0  # 勾選框 key 的一部分；清空清單時遞增，所有勾選框以新 key 重建
 if 'latest_order' not in st.session_state: st.session_state.latest_order = None 
 if 'latest_meta' not in st.session_state: st.session_state.latest_meta = {} 
 if 'is_admin' not in st.session_state: st.session_state.is_admin = False
 if 'current_page' not in st.session_state: st.session_state.current_page = "home"
+if 'inv_page' not in st.session_state: st.session_state.inv_page = 0
+if 'inv_page_size' not in st.session_state: st.session_state.inv_page_size = PAGE_SIZE_OPTIONS[1]
+if 'history_cursors' not in st.session_state: st.session_state.history_cursors = [None]  # 歷史頁每一頁的起點 (上一頁最後一列的 borrow_date, id)
+if 'borrow_window' not in st.session_state: st.session_state.borrow_window = (datetime.today().date(), datetime.today().date() + timedelta(days=7))  # 借用者選的期間 (卡片與借用清單共用)
+if any(d < datetime.today().date() for d in st.session_state.borrow_window or ()):  # 跨過午夜仍開著的 session：期間推到今天，不低於 date_input 的 min_value
+    st.session_state.borrow_window = tuple(max(d, datetime.today().date()) for d in st.session_state.borrow_window)
+if 'toasts' not in st.session_state: st.session_state.toasts = []  # 下一次 rerun 才顯示的提示 (取代 toast + sleep + rerun)
+if 'pending_writes' not in st.session_state: st.session_state.pending_writes = []  # 背景送出、尚未對帳的寫入
+if 'pending_returns' not in st.session_state: st.session_state.pending_returns = set()  # 已按歸還、伺服器還沒確認的借用紀錄 id
+if 'doc_errors' not in st.session_state: st.session_state.doc_errors = {}  # 單據產生失敗的訊息 (下載鈕 key -> 訊息)，顯示一次就清掉
+if 'cart_open' not in st.session_state: st.session_state.cart_open = False  # 借用清單對話框開著 (即時推播先不整頁重跑)
+if 'run_counts' not in st.session_state: st.session_state.run_counts = {}  # 這個 session 每種起因的執行次數 (診斷面板)
 
 st.markdown(f"""
 <style>
@@ -266,25 +616,90 @@ st.markdown(f"""
 </style>
 """, unsafe_allow_html=True)
 
+def rerun(reason):
+    # 取代直接呼叫 st.rerun()：記下原因，下一次執行時算進 run_counts
+    st.session_state.rerun_reason = reason; st.rerun()
+
+def begin_session_run():
+    # 這次執行的起因：rerun() 留下的原因，否則為首次載入 (start) 或一般元件互動 (widget)
+    trigger = st.session_state.pop('rerun_reason', None) or ("widget" if st.session_state.run_counts else "start")
+    st.session_state.run_counts[trigger] = st.session_state.run_counts.get(trigger, 0) + 1
+    return trigger
+
+# --- 寫入：樂觀更新 + 背景送出 ---
+def queue_toast(msg): st.session_state.toasts.append(msg)
+
+def flush_toasts():
+    for msg in st.session_state.toasts: st.toast(msg)
+    st.session_state.toasts = []
+
+def start_write(label, fn, check=None, return_ids=()):
+    # 畫面先用樂觀更新的結果，fn 在背景執行；check(結果) 回傳要提示的問題 (或 None)，在 reconcile_writes() 對帳時呼叫
+    future = get_write_pool().submit(fn)
+    st.session_state.pending_writes.append({"label": label, "future": future, "check": check, "return_ids": {int(i) for i in return_ids}})
+    st.session_state.pending_returns |= {int(i) for i in return_ids}
+
+def reconcile_writes():
+    pending = []
+    for w in st.session_state.pending_writes:
+        if not w["future"].done(): pending.append(w); continue
+        try: problem = w["check"](w["future"].result()) if w["check"] else None
+        except Exception as e:
+            problem = f"{w['label']}失敗：{e}"; get_inventory_cache().invalidate()  # 樂觀更新作廢，重新同步
+        if problem: queue_toast(f"⚠️ {problem}")
+        st.session_state.pending_returns -= w["return_ids"]
+    st.session_state.pending_writes = pending
+
+def start_return(items, label, counted=None):
+    # items: [(record_id, uid, qty), ...]；先在快取扣回 borrowed、把紀錄從歸還頁隱藏，再背景呼叫批次歸還 RPC
+    # counted：各筆是否已計入 borrowed (尚未開始的預約沒有，取消時不扣)，預設全部
+    per_uid = {}
+    for (_, uid, qty), c in zip(items, [True] * len(items) if counted is None else counted):
+        if c: per_uid[uid] = per_uid.get(uid, 0) + int(qty)
+    get_inventory_cache().apply_local({uid: {"borrowed": lambda s, q=q: (s - q).clip(lower=0)} for uid, q in per_uid.items()})
+    def check(results):
+        failed = [r for r in results if not r['ok']]
+        return f"{len(failed)} 項未歸還 (可能已被他人處理)" if failed else None
+    start_write(label, lambda: return_equipment_batch(items), check, [rid for rid, _, _ in items])
+
+@st.fragment(run_every=1)
+def pending_writes_watcher():
+    # 只在有背景寫入未對帳時畫出：每秒看一次，有完成的就整頁 rerun，以伺服器結果為準並顯示失敗提示
+    if any(w["future"].done() for w in st.session_state.pending_writes): rerun("write_reconciled")
+
 def go_to(page): st.session_state.current_page = page
+def clear_cart():
+    # 不必逐一重設 check_ 勾選框：換一組 key，舊的勾選框狀態沒人使用後由 Streamlit 自動清掉
+    st.session_state.cart = {}; st.session_state.cart_gen += 1
+
+def toggle_cart(uid, key):
+    # 勾選框的 on_change：只改 cart，不呼叫 rerun；勾選框在 render_card_grid fragment 裡，只重跑卡片區
+    if st.session_state[key]: st.session_state.cart.setdefault(uid, 1)
+    else: st.session_state.cart.pop(uid, None)
+    st.session_state.run_counts["cart_toggle"] = st.session_state.run_counts.get("cart_toggle", 0) + 1
+
 def perform_logout(): 
-    st.session_state.is_admin = False; st.session_state.cart = {}; st.session_state.latest_order = None; st.session_state.latest_meta = {}
-    for k in list(st.session_state.keys()): 
-        if k.startswith("check_"): del st.session_state[k]
-    go_to("home")
+    st.session_state.is_admin = False; st.session_state.latest_order = None; st.session_state.latest_meta = {}
+    clear_cart(); go_to("home")
 def perform_login():
     if st.session_state.password_input == st.secrets["ADMIN_PASSWORD"]: st.session_state.is_admin = True; go_to("home")
     else: st.error("密碼錯誤")
 
 def render_header():
     st.markdown(f"""<div id="my-fixed-header"><img src="{LOGO_URL}" style="height: 50px;"></div>""", unsafe_allow_html=True)
-    st.markdown("""<style>.header-buttons { position: fixed; top: 20px; right: 30px; z-index: 9999999; }</style>""", unsafe_allow_html=True)
-    with st.container():
-        st.markdown('<div class="header-buttons">', unsafe_allow_html=True)
-        if not st.session_state.is_admin:
-            cnt = len(st.session_state.cart)
-            if st.button(f"📋 借用清單 ({cnt})", type="primary"): show_cart_modal(load_data())
-        st.markdown('</div>', unsafe_allow_html=True)
+
+def render_cart_button():
+    # 借用清單按鈕 (含件數) 放在卡片區的 fragment 裡，勾選後件數跟著卡片一起更新，不必整頁重跑
+    cnt = len(st.session_state.cart)
+    if st.button(f"📋 借用清單 ({cnt})", type="primary", key="open_cart"): show_cart_modal()
+
+def render_document_button(label, loader, key, fail_prefix, **kwargs):
+    # 單據下載鈕：按下時 on_click 先在 script 執行緒產生 (失敗就在按鈕下顯示錯誤)，隨後的下載請求直接取快取
+    def prepare():
+        try: loader()
+        except Exception as e: st.session_state.doc_errors[key] = f"{fail_prefix} 失敗: {e}"
+    st.download_button(label, data=loader, key=key, on_click=prepare, **kwargs)
+    if key in st.session_state.doc_errors: st.error(st.session_state.doc_errors.pop(key))
 
 # 下載橫幅
 def render_success_banner():
@@ -294,80 +709,103 @@ def render_success_banner():
             
             final_list = st.session_state.latest_order
             meta = st.session_state.latest_meta
-            name = meta.get('name', ''); contact = meta.get('contact', ''); b_date = meta.get('b_date', ''); r_date = meta.get('r_date', '')
+            doc_meta = {k: meta.get(k, '') for k in ('name', 'contact', 'b_date', 'r_date')}
             today_date = get_today_str(); file_prefix = f"equipment_list_{today_date}"
+            docs = get_document_cache()
             
-            text_map = {}
-            s_idx = 0; t_rows = len(final_list)
-            for i in range(t_rows + 1):
-                if i == t_rows or final_list[i]['category'] != final_list[s_idx]['category']:
-                    text_map[s_idx + (i - s_idx)//2] = final_list[s_idx]['category']
-                    s_idx = i
-            
+            # 單據在按下下載時才產生 (之後同內容直接取快取)，rerun 不再重做 PDF/Word
             c1, c2, c3 = st.columns([1, 1, 1])
             with c1:
-                try:
-                    pdf_data = create_pdf(final_list, text_map, name, contact, b_date, r_date)
-                    st.download_button("📄 下載 PDF", data=bytes(pdf_data), file_name=f"{file_prefix}.pdf", mime="application/pdf", type="primary", use_container_width=True)
-                except Exception as e: st.error(f"PDF 失敗: {e}")
+                render_document_button("📄 下載 PDF", docs.loader('pdf', final_list, doc_meta), "dl_pdf_latest", "PDF", file_name=f"{file_prefix}.pdf", mime="application/pdf", type="primary", use_container_width=True)
             with c2:
-                try:
-                    word_data = create_word(final_list, name, contact, b_date, r_date)
-                    st.download_button("📝 下載 Word", data=word_data, file_name=f"{file_prefix}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True)
-                except Exception as e: st.error(f"Word 失敗: {e}")
+                render_document_button("📝 下載 Word", docs.loader('docx', final_list, doc_meta), "dl_word_latest", "Word", file_name=f"{file_prefix}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True)
             with c3:
                 if st.button("❌ 關閉此訊息", use_container_width=True):
-                    st.session_state.latest_order = None; st.rerun()
+                    st.session_state.latest_order = None; rerun("banner_closed")
 
 @st.dialog("⚙️ 編輯/管理器材", width="small")
 def show_edit_modal(item):
     st.caption(f"正在編輯：{item['name']} (#{item['uid']})")
-    if item['image_url']: st.image(item['image_url'], width=100)
+    preview = item.get('thumbnail_url') or item['image_url']
+    if preview: st.image(preview, width=100)
     with st.form("edit_form"):
         new_name = st.text_input("名稱", value=item['name'])
         c1, c2 = st.columns(2)
         try: cat_idx = CATEGORY_OPTIONS.index(item['category'])
         except: cat_idx = 0
         new_cat = c1.selectbox("分類", CATEGORY_OPTIONS, index=cat_idx)
-        status_opts = ["在庫", "維修中", "報廢"]
-        try: status_idx = status_opts.index(item['status'])
+        try: status_idx = STATUS_OPTIONS.index(item['status'])
         except: status_idx = 0
-        new_status = c2.selectbox("狀態", status_opts, index=status_idx)
+        new_status = c2.selectbox("狀態", STATUS_OPTIONS, index=status_idx)
         c3, c4 = st.columns(2)
-        new_qty = c3.number_input("總數量", min_value=1, value=item.get('quantity', 1))
-        new_borrowed = c4.number_input("已借出", min_value=0, max_value=new_qty, value=item.get('borrowed', 0))
+        # 已借出由借用 / 歸還自動維護，這裡只顯示；總數不能小於目前借出的數量
+        borrowed = int(item.get('borrowed', 0) or 0)
+        new_qty = c3.number_input("總數量", min_value=max(1, borrowed), value=max(int(item.get('quantity', 1)), borrowed, 1))
+        c4.number_input("目前借出", value=borrowed, disabled=True)
         new_loc = st.text_input("位置", value=item['location'] or "")
-        new_file = st.file_uploader("更換照片", type=['jpg','png'])
+        new_file = st.file_uploader("更換照片", type=IMAGE_TYPES)
         col_up, col_del = st.columns(2)
         submitted = col_up.form_submit_button("💾 儲存更新", type="primary", use_container_width=True)
         delete = col_del.checkbox("刪除此器材")
         if submitted:
+            uid = item['uid']
             if delete:
-                delete_equipment_from_db(item['uid']); st.toast("🗑️ 已刪除"); time.sleep(1); st.rerun()
+                get_inventory_cache().apply_local({uid: None})
+                start_write(f"刪除 {item['name']} ", lambda: delete_equipment_from_db(uid))
+                queue_toast("🗑️ 已刪除"); rerun("equipment_deleted")
             else:
-                url = upload_image(new_file) if new_file else item['image_url']
-                updates = {"name": new_name, "category": new_cat, "status": new_status, "quantity": new_qty, "borrowed": new_borrowed, "location": new_loc, "image_url": url, "updated_at": datetime.now().strftime("%Y-%m-%d")}
-                update_equipment_in_db(item['uid'], updates); st.toast("✅ 更新成功！"); time.sleep(1); st.rerun()
+                url, thumb_url = upload_image(new_file) if new_file else (item['image_url'], item.get('thumbnail_url'))
+                updates = {"name": new_name, "category": new_cat, "status": new_status, "quantity": new_qty, "location": new_loc, "image_url": url, "thumbnail_url": thumb_url}
+                get_inventory_cache().apply_local({uid: updates})
+                start_write(f"更新 {item['name']} ", lambda: update_equipment_in_db(uid, updates))
+                queue_toast("✅ 更新成功！"); rerun("equipment_updated")
 
 @st.dialog("➕ 新增器材", width="small")
 def show_add_modal():
     st.caption("填寫資訊")
     with st.form("add_form", clear_on_submit=True):
         name = st.text_input("名稱"); uid = st.text_input("編號")
-        c1, c2 = st.columns(2); cat = c1.selectbox("分類", CATEGORY_OPTIONS); status = c2.selectbox("狀態", ["在庫", "維修中", "報廢"])
+        c1, c2 = st.columns(2); cat = c1.selectbox("分類", CATEGORY_OPTIONS); status = c2.selectbox("狀態", STATUS_OPTIONS)
         c3, c4 = st.columns(2); qty = c3.number_input("總數", 1); loc = c4.text_input("位置")
-        file = st.file_uploader("照片")
+        file = st.file_uploader("照片", type=IMAGE_TYPES)
         if st.form_submit_button("新增", type="primary", use_container_width=True):
-            url = upload_image(file)
-            add_equipment_to_db({"uid": uid, "name": name, "category": cat, "status": status, "location": loc, "quantity": qty, "borrowed": 0, "image_url": url, "updated_at": datetime.now().strftime("%Y-%m-%d")})
-            st.rerun()
+            url, thumb_url = upload_image(file)
+            add_equipment_to_db({"uid": uid, "name": name, "category": cat, "status": status, "location": loc, "quantity": qty, "borrowed": 0, "image_url": url, "thumbnail_url": thumb_url, "updated_at": now_utc_iso()})
+            rerun("equipment_added")
+
+@st.dialog("📥 批次匯入 / 匯出", width="large")
+def show_bulk_modal():
+    st.markdown("**匯入器材** (CSV 或 Excel)")
+    st.caption("第一列為標題：編號、名稱、分類、狀態、位置、總數 (或 uid, name, category, status, location, quantity)。已存在的編號會更新資料，借出數量與照片不變。CSV 請存成 UTF-8。")
+    file = st.file_uploader("選擇檔案", type=["csv", "xlsx"], key="bulk_file")
+    if file is not None and st.button("開始匯入", type="primary", use_container_width=True):
+        progress = st.empty()
+        try:
+            report = import_equipment(file, file.name, import_equipment_batch, CATEGORY_OPTIONS, STATUS_OPTIONS,
+                                      on_progress=lambda r: progress.caption(f"已處理 {r.rows} 列 (寫入 {r.written}，錯誤 {len(r.errors)})"))
+        except ImportFormatError as e: st.error(str(e)); return
+        except Exception as e: st.error(f"匯入失敗: {e}"); return
+        progress.empty()
+        st.success(f"完成：共 {report.rows} 列，新增 {report.inserted}、更新 {report.updated} (分 {report.batches} 批寫入)")
+        if report.errors:
+            st.warning(f"{len(report.errors)} 列未匯入：")
+            st.dataframe(pd.DataFrame(report.errors).rename(columns={"row": "列號", "uid": "編號", "error": "原因"}), hide_index=True, use_container_width=True)
+
+    st.markdown("---")
+    st.markdown("**匯出資料** (CSV)")
+    today_date = get_today_str()
+    e1, e2 = st.columns(2)
+    e1.download_button("📦 器材清單", data=lambda: export_table_csv("equipment"), file_name=f"equipment_{today_date}.csv", mime="text/csv", use_container_width=True)
+    e2.download_button("📋 借用紀錄", data=lambda: export_table_csv("borrow_records"), file_name=f"borrow_records_{today_date}.csv", mime="text/csv", use_container_width=True)
 
-@st.dialog("📋 借用清單確認", width="large")
-def show_cart_modal(df):
+@st.dialog("📋 借用清單確認", width="large", on_dismiss="rerun")
+def show_cart_modal():
+    st.session_state.cart_open = True  # 關閉 (按 X 也會整頁 rerun) 後由主流程清掉
     if not st.session_state.cart:
         st.info("清單目前是空的。"); 
-        if st.button("關閉"): st.rerun()
+        if st.button("關閉"): rerun("dialog_closed")
         return
+    df = load_data()  # 每次對話框重跑都重新取 (推播修補後的) 快取，剩餘數量不會停在開啟當下
 
     st.info("💡 請填寫借用人資訊，並確認數量。")
     with st.container(border=True):
@@ -375,19 +813,21 @@ def show_cart_modal(df):
         borrower_name = c_name.text_input("借用人姓名 (必填)", placeholder="王小明")
         contact_info = c_contact.text_input("聯絡方式 (電話/系級)", placeholder="0912-345-678")
         c_date1, c_date2 = st.columns(2)
-        borrow_date = c_date1.date_input("租借日期", value=datetime.today())
-        return_date = c_date2.date_input("預計歸還日期", value=datetime.today() + timedelta(days=7))
+        w_start, w_end = current_borrow_window()
+        borrow_date = c_date1.date_input("租借日期", value=w_start)
+        return_date = c_date2.date_input("預計歸還日期", value=max(w_end, borrow_date), min_value=borrow_date)
 
     cart_uids = list(st.session_state.cart.keys())
     cart_rows = df[df['uid'].isin(cart_uids)].copy().sort_values(by=['category', 'uid'])
+    cart_rows['free'] = load_reservation_index().free(cart_rows, *window_bounds(borrow_date, return_date))  # 這段期間的可借數量
     final_borrow_list = []
-    
+
     for i, row in cart_rows.iterrows():
         c1, c2, c3, c4 = st.columns([2, 3, 2, 2])
         with c1: st.write(f"**{row['category']}**")
         with c2: st.write(f"{row['name']}")
-        avail = row['quantity'] - row.get('borrowed', 0)
-        with c3: st.caption(f"剩餘: {avail}")
+        avail = int(row['free'])
+        with c3: st.caption(f"此期間可借: {avail}")
         with c4:
             max_val = max(1, avail) 
             borrow_qty = st.number_input("數量", 1, max_val, st.session_state.cart.get(row['uid'], 1), key=f"qty_{row['uid']}", label_visibility="collapsed")
@@ -397,38 +837,35 @@ def show_cart_modal(df):
 
     st.markdown("---")
     if st.button("✅ 確認借用 (送出申請)", type="primary", use_container_width=True):
+        short = [item['uid'] for item in final_borrow_list if item['borrow_qty'] > item['free']]
         if not borrower_name: st.error("⚠️ 請填寫借用人姓名！")
+        elif short: st.error(f"⚠️ 以下器材在 {borrow_date} ~ {return_date} 期間數量不足，請調整數量或日期：{', '.join(short)}")
         else:
             try:
-                for item in final_borrow_list:
-                    new_borrowed = item.get('borrowed', 0) + item['borrow_qty']
-                    update_equipment_in_db(item['uid'], {'borrowed': new_borrowed})
-                    add_borrow_record(item['uid'], item['name'], borrower_name, contact_info, item['borrow_qty'], borrow_date)
-                
-                st.session_state.latest_order = final_borrow_list
+                records = checkout_order(final_borrow_list, borrower_name, contact_info, borrow_date, return_date)
+                record_ids = {r['equipment_uid']: r['id'] for r in records or []}  # 借用單的鍵含紀錄 id
+                st.session_state.latest_order = [{**item, 'id': record_ids.get(str(item['uid']))} for item in final_borrow_list]
                 st.session_state.latest_meta = {"name": borrower_name, "contact": contact_info, "b_date": borrow_date, "r_date": return_date}
-                st.session_state.cart = {}
-                for key in st.session_state.keys():
-                    if key.startswith("check_"): st.session_state[key] = False
-                st.rerun() 
+                clear_cart(); rerun("checkout")
+            except CheckoutError as e: st.error(f"⚠️ 以下器材已被借走或庫存不足，整張單未送出，請調整數量後再試：{', '.join(e.uids)}")
             except Exception as e: st.error(f"系統錯誤: {e}")
 
     if st.button("🗑️ 清空清單", use_container_width=True):
-        st.session_state.cart = {}
-        for key in list(st.session_state.keys()):
-            if key.startswith("check_"): st.session_state[key] = False
-        st.rerun()
+        clear_cart(); rerun("cart_cleared")
 
-def admin_return_page():
+def admin_return_page(borrows_future=None):
+    # borrows_future：主流程在畫庫存分頁前就先送出的 load_active_borrows 查詢
     st.markdown("### 📋 借還紀錄 / 歸還管理")
-    active_borrows = load_active_borrows()
+    active_borrows = get_query_pool().result(borrows_future) if borrows_future is not None else load_active_borrows()
+    if st.session_state.pending_returns and not active_borrows.empty:  # 已按歸還、背景還在處理的紀錄先不顯示
+        active_borrows = active_borrows[~active_borrows['id'].isin(st.session_state.pending_returns)]
     if active_borrows.empty: st.info("目前沒有未歸還的器材。")
     else:
-        all_equipment = load_data()
+        docs = get_document_cache()
+        export_all_box = st.container(); sections = []  # 全部匯出按鈕放在最上方，迴圈跑完才知道每個人的清單
         
-        borrowers = active_borrows['borrower_name'].unique()
-        for person in borrowers:
-            person_items = active_borrows[active_borrows['borrower_name'] == person]
+        # 一次分組 (保留依借出日排序後的出現順序)，不再每位借用人各掃一次整張表
+        for person, person_items in active_borrows.groupby('borrower_name', sort=False):
             with st.expander(f"👤 {person} (共借 {len(person_items)} 項)", expanded=True):
                 col_info, col_btn = st.columns([3, 1])
                 with col_info:
@@ -436,59 +873,30 @@ def admin_return_page():
                     st.caption(f"📞 聯絡方式: {contact}")
                 with col_btn:
                     if st.button(f"⚡ 一鍵歸還全部", key=f"ret_all_{person}"):
-                        success_count = 0
-                        for idx, row in person_items.iterrows():
-                            if return_equipment_transaction(row['id'], row['equipment_uid'], row['borrow_qty']):
-                                success_count += 1
-                        if success_count > 0:
-                            st.toast(f"✅ 已歸還 {success_count} 項！"); time.sleep(1); st.rerun()
-                        else: st.error("歸還失敗")
-
-                # 補印單據區
-                export_list = []
-                b_date_list = []
-                for _, row in person_items.iterrows():
-                    # VLOOKUP category
-                    eq_info = all_equipment[all_equipment['uid'] == row['equipment_uid']]
-                    cat = eq_info.iloc[0]['category'] if not eq_info.empty else "其他"
-                    
-                    export_list.append({
-                        "category": cat,
-                        "uid": row['equipment_uid'],
-                        "name": row['equipment_name'],
-                        "borrow_qty": row['borrow_qty']
-                    })
-                    b_date_list.append(row['borrow_date'])
+                        start_return(list(zip(person_items['id'], person_items['equipment_uid'], person_items['borrow_qty'])), f"{person} 的歸還",
+                                     person_items['counted'] if 'counted' in person_items else None)
+                        queue_toast(f"✅ 已歸還 {len(person_items)} 項！"); rerun("return")
+
+                # 補印單據區 (分類已由 active_borrow_records 帶回)
+                export_list = (person_items[['id', 'category', 'equipment_uid', 'equipment_name', 'borrow_qty', 'is_returned']]
+                               .rename(columns={'equipment_uid': 'uid', 'equipment_name': 'name'})
+                               .sort_values(['category', 'uid']).to_dict('records'))
                 
                 # 計算日期範圍 (取最早借出日)
-                if b_date_list:
-                    min_date = min(b_date_list)
-                    start_dt = datetime.fromisoformat(min_date).date()
-                    end_dt = start_dt + timedelta(days=7) # 預設借7天
-                else:
-                    start_dt = datetime.today().date(); end_dt = start_dt
+                start_dt = datetime.fromisoformat(person_items['borrow_date'].min()).date()
+                due = person_items['due_date'].dropna().max() if 'due_date' in person_items else None
+                end_dt = datetime.fromisoformat(due).date() if isinstance(due, str) else start_dt + timedelta(days=7) # 舊紀錄沒有預計歸還日：預設借7天
                 
-                export_list = sorted(export_list, key=lambda x: (x['category'], x['uid']))
-                text_map = {}
-                s_idx = 0; t_rows = len(export_list)
-                for i in range(t_rows + 1):
-                    if i == t_rows or export_list[i]['category'] != export_list[s_idx]['category']:
-                        text_map[s_idx + (i - s_idx)//2] = export_list[s_idx]['category']
-                        s_idx = i
+                doc_meta = {'name': person, 'contact': contact, 'b_date': start_dt, 'r_date': end_dt}
                 
                 bd1, bd2 = st.columns(2)
                 today_date = get_today_str(); f_name = f"reprint_{person}_{today_date}"
+                sections.append((f_name.replace("/", "_").replace("\\", "_"), export_list, doc_meta))
                 
                 with bd1:
-                    try:
-                        pdf_data = create_pdf(export_list, text_map, person, contact, start_dt, end_dt)
-                        st.download_button("📄 下載 PDF", data=bytes(pdf_data), file_name=f"{f_name}.pdf", mime="application/pdf", key=f"dl_pdf_{person}", use_container_width=True)
-                    except: pass
+                    render_document_button("📄 下載 PDF", docs.loader('pdf', export_list, doc_meta), f"dl_pdf_{person}", "PDF", file_name=f"{f_name}.pdf", mime="application/pdf", use_container_width=True)
                 with bd2:
-                    try:
-                        word_data = create_word(export_list, person, contact, start_dt, end_dt)
-                        st.download_button("📝 下載 Word", data=word_data, file_name=f"{f_name}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", key=f"dl_word_{person}", use_container_width=True)
-                    except: pass
+                    render_document_button("📝 下載 Word", docs.loader('docx', export_list, doc_meta), f"dl_word_{person}", "Word", file_name=f"{f_name}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True)
 
                 st.markdown("---")
                 for i, row in person_items.iterrows():
@@ -502,31 +910,138 @@ def admin_return_page():
                         st.caption(f"🕒 {tw_dt.strftime('%m-%d %H:%M')}")
                     with c4:
                         if st.button("↩️ 歸還", key=f"ret_{row['id']}", type="primary", use_container_width=True):
-                            if return_equipment_transaction(row['id'], row['equipment_uid'], row['borrow_qty']):
-                                st.toast(f"✅ {row['equipment_name']} 已歸還！"); time.sleep(0.5); st.rerun()
-                            else: st.error("歸還失敗")
+                            start_return([(row['id'], row['equipment_uid'], row['borrow_qty'])], f"{row['equipment_name']} 的歸還", [row.get('counted', True)])
+                            queue_toast(f"✅ {row['equipment_name']} 已歸還！"); rerun("return")
+
+        with export_all_box:
+            # 所有借用人一次匯出：PDF 合併成一份 (每人一個書籤)，Word 每人一份打包成 ZIP
+            ea1, ea2 = st.columns(2); today_date = get_today_str()
+            with ea1: render_document_button(f"📄 全部匯出 PDF ({len(sections)} 人)", docs.bundle_loader('pdf', sections), "dl_all_pdf", "PDF", file_name=f"reprint_all_{today_date}.pdf", mime="application/pdf", use_container_width=True)
+            with ea2: render_document_button(f"🗂️ 全部匯出 Word ZIP ({len(sections)} 人)", docs.bundle_loader('zip', sections), "dl_all_zip", "Word", file_name=f"reprint_all_{today_date}.zip", mime="application/zip", use_container_width=True)
+
+HISTORY_TABLE_COLUMNS = {"borrow_date": "借出時間", "borrower_name": "借用人", "equipment_uid": "編號", "equipment_name": "器材", "borrow_qty": "數量", "state": "狀態", "due_date": "預計歸還", "return_date": "歸還時間"}
+USAGE_TABLE_COLUMNS = {"equipment_uid": "編號", "equipment_name": "器材", "borrow_count": "借用次數", "total_qty": "借出總數", "borrower_count": "借用人數", "active_qty": "借用中", "avg_days": "平均借期 (天)", "last_borrowed": "最近借出"}
+
+def _tw_time_str(series):
+    # 與歸還頁相同：資料庫時間當 UTC，顯示台灣時間
+    ts = pd.to_datetime(series, utc=True, errors='coerce', format='ISO8601') + pd.Timedelta(hours=8)
+    return ts.dt.strftime('%Y-%m-%d %H:%M').fillna("")
+
+def history_table(df):
+    df = df.assign(state=df['is_returned'].map({True: "已歸還", False: "借用中"}).where(~df['archived'], "已歸還 (已歸檔)"),
+                   borrow_date=_tw_time_str(df['borrow_date']), return_date=_tw_time_str(df['return_date']),
+                   due_date=pd.to_datetime(df['due_date'], errors='coerce', format='ISO8601').dt.strftime('%Y-%m-%d').fillna(""))
+    return df[list(HISTORY_TABLE_COLUMNS)].rename(columns=HISTORY_TABLE_COLUMNS)
+
+def history_next_page(cursor): st.session_state.history_cursors.append(cursor)
+def history_prev_page(): st.session_state.history_cursors.pop()
+
+@st.fragment
+def render_history_page():
+    # 借用歷史 (含已歸檔)：篩選、分頁與統計都在資料庫端；篩選與翻頁只重跑這個 fragment
+    st.markdown("### 🗂️ 借用歷史")
+    c_borrower, c_uid, c_dates = st.columns([2, 2, 3])
+    borrower = c_borrower.text_input("借用人 (完整姓名)", key="history_borrower").strip() or None
+    uid = c_uid.text_input("器材編號", key="history_uid").strip() or None
+    dates = c_dates.date_input("借出日期", value=(), key="history_dates")
+    date_from = dates[0].isoformat() if len(dates) > 0 else None
+    date_to = (dates[-1] + timedelta(days=1)).isoformat() if len(dates) > 1 else None  # 含結束當天
+    filters = (borrower, uid, date_from, date_to)
+    if st.session_state.get("history_filters") != filters:
+        st.session_state.history_filters = filters; st.session_state.history_cursors = [None]
+
+    cursors = st.session_state.history_cursors; page = len(cursors) - 1
+    res = get_query_pool().gather({
+        "page": lambda: load_borrow_history(HISTORY_PAGE_SIZE, cursors[-1], *filters),
+        "usage": lambda: load_usage_stats(*filters),
+    })
+    (history_df, has_next), usage = res["page"], res["usage"]
+
+    st.markdown("**📊 使用統計** (依借用次數，含已歸檔紀錄)")
+    if usage.empty: st.caption("沒有符合條件的紀錄。")
+    else:
+        usage = usage.assign(last_borrowed=_tw_time_str(usage['last_borrowed']))
+        st.dataframe(usage[list(USAGE_TABLE_COLUMNS)].rename(columns=USAGE_TABLE_COLUMNS), hide_index=True, use_container_width=True)
+
+    st.markdown("**📜 借用紀錄**")
+    if history_df.empty and page == 0: st.info("沒有符合條件的借用紀錄。"); return
+    if history_df.empty: st.info("這一頁已沒有紀錄 (可能剛被歸檔)，請回上一頁。")
+    else: st.dataframe(history_table(history_df), hide_index=True, use_container_width=True)
+    last = history_df.iloc[-1] if not history_df.empty else None
+    c_prev, c_info, c_next = st.columns([1, 2, 1], vertical_alignment="center")
+    c_prev.button("◀ 上一頁", key="history_prev", on_click=history_prev_page, disabled=page <= 0, use_container_width=True)
+    c_info.markdown(f"<div style='text-align:center'>第 {page + 1} 頁 (每頁 {HISTORY_PAGE_SIZE} 筆)</div>", unsafe_allow_html=True)
+    c_next.button("下一頁 ▶", key="history_next", on_click=history_next_page, args=(None if last is None else (last['borrow_date'], int(last['id'])),),
+                  disabled=not has_next, use_container_width=True)
+
+def render_equipment_card(row):
+    with st.container(border=True):
+        img = row.get('thumbnail_url') or row['image_url'] or "https://cdn-icons-png.flaticon.com/512/4992/4992482.png"
+        st.markdown(f'<div style="height:200px;overflow:hidden;border-radius:4px;display:flex;justify-content:center;background:#f0f2f6;margin-bottom:12px;"><img src="{img}" loading="lazy" style="height:100%;width:100%;object-fit:cover;"></div>', unsafe_allow_html=True)
+        st.markdown(f"#### {row['name']}")
+        
+        stat_txt, stat_col = get_status_display(row)
+        st.caption(f"#{row['uid']} | 📍 {row['location']}")
+        st.markdown(f':{stat_col}[**{stat_txt}**]')
+        st.markdown("---")
+        
+        # 🔥🔥🔥 修復 Duplicate Key 錯誤：使用 row['id'] 作為 key 🔥🔥🔥
+        if st.session_state.is_admin:
+            if st.button("⚙️ 管理", key=f"btn_{row['id']}", use_container_width=True): show_edit_modal(row)
+        else:
+            avail = row['free'] if pd.notna(row.get('free')) else row['quantity'] - row.get('borrowed', 0)
+            dis = (avail <= 0) or (row.get('status') in ['維修中', '報廢'])
+            key = f"check_{st.session_state.cart_gen}_{row['id']}"
+            st.checkbox("加入借用清單", key=key, value=row['uid'] in st.session_state.cart, disabled=dis, on_change=toggle_cart, args=(row['uid'], key))
+
+def current_borrow_window():
+    # (開始日, 結束日)；日期區間選到一半 (只有開始日) 時先當借一天
+    window = tuple(st.session_state.borrow_window or ())
+    if not window: today = datetime.today().date(); return today, today + timedelta(days=7)
+    return window[0], window[-1]
+
+def set_inv_page(page): st.session_state.inv_page = page
+
+def render_pagination(total_count):
+    page_size = st.session_state.inv_page_size
+    n_pages = max(1, -(-total_count // page_size))
+    page = min(st.session_state.inv_page, n_pages - 1)
+    st.write("")
+    c_prev, c_info, c_next, c_size = st.columns([1, 2, 1, 1], vertical_alignment="center")
+    c_prev.button("◀ 上一頁", on_click=set_inv_page, args=(page - 1,), disabled=page <= 0, use_container_width=True)
+    c_info.markdown(f"<div style='text-align:center'>第 {page + 1} / {n_pages} 頁 (共 {total_count} 項)</div>", unsafe_allow_html=True)
+    c_next.button("下一頁 ▶", on_click=set_inv_page, args=(page + 1,), disabled=page >= n_pages - 1, use_container_width=True)
+    c_size.selectbox("每頁", PAGE_SIZE_OPTIONS, key="inv_page_size", label_visibility="collapsed", format_func=lambda n: f"每頁 {n} 項")
 
 def render_inventory_view():
     render_success_banner() 
     
-    df = load_data()
+    # 伺服器模式：摘要與這一頁同時查。頁面條件先沿用上一次的篩選 (多數 rerun 不變)，條件變了才另外再查
+    prefetch = None
+    if INVENTORY_SEARCH_MODE != "local" and st.session_state.get('inv_filter_sig') is not None:
+        p_cat, p_status, p_search, p_size = st.session_state.inv_filter_sig
+        prefetch_args = (st.session_state.inv_page, p_size, None if p_cat == "全部顯示" else p_cat, p_search or None, p_status)
+        prefetch = get_query_pool().submit(load_equipment_page, *prefetch_args)
+    summary = load_inventory_summary()
     
-    if not df.empty:
-        total = df['quantity'].sum(); borrowed = df['borrowed'].sum()
+    if summary.item_count:
         m1, m2, m3, m4 = st.columns(4)
-        m1.metric("📦 器材種類", len(df)); m2.metric("📊 庫存總數", int(total))
-        m3.metric("✅ 剩餘可用", int(total - borrowed)); m4.metric("👤 目前借出", int(borrowed))
+        m1.metric("📦 器材種類", summary.item_count); m2.metric("📊 庫存總數", summary.quantity)
+        m3.metric("✅ 剩餘可用", summary.available); m4.metric("👤 目前借出", summary.borrowed)
+    mark_first_paint()
 
     st.write("")
-    search_query = st.text_input("🔍 搜尋...", label_visibility="collapsed")
+    search_query = st.text_input("🔍 搜尋...", label_visibility="collapsed", help=SEARCH_HELP)
+    if not st.session_state.is_admin:
+        st.date_input("📅 借用期間 (卡片顯示這段期間可借的數量)", key="borrow_window", min_value=datetime.today().date())
     st.write("")
 
-    if not df.empty:
+    if summary.item_count:
         # 🔥🔥🔥 計算分類數量並顯示 🔥🔥🔥
-        cat_counts = df['category'].value_counts()
+        cat_counts = summary.by_category
         display_options = []; option_map = {}
         
-        total_items = len(df)
+        total_items = summary.item_count
         label_all = f"全部顯示 ({total_items})"
         display_options.append(label_all)
         option_map[label_all] = "全部顯示"
@@ -540,71 +1055,126 @@ def render_inventory_view():
         selected_pill = st.pills("分類", display_options, default=label_all)
         real_selected_cat = option_map.get(selected_pill, "全部顯示")
 
-        # 篩選
-        filtered = df
-        if real_selected_cat != "全部顯示": filtered = df[df['category'] == real_selected_cat]
-        if search_query: 
-            filtered = filtered[
-                filtered['name'].str.contains(search_query, case=False) | 
-                filtered['uid'].str.contains(search_query, case=False)
-            ]
-        
-        if not filtered.empty:
-            st.write("")
-            cols = st.columns(3)
-            for i, (idx, row) in enumerate(filtered.iterrows()):
-                with cols[i % 3]:
-                    with st.container(border=True):
-                        img = row['image_url'] if row['image_url'] else "https://cdn-icons-png.flaticon.com/512/4992/4992482.png"
-                        st.markdown(f'<div style="height:200px;overflow:hidden;border-radius:4px;display:flex;justify-content:center;background:#f0f2f6;margin-bottom:12px;"><img src="{img}" style="height:100%;width:100%;object-fit:cover;"></div>', unsafe_allow_html=True)
-                        st.markdown(f"#### {row['name']}")
-                        
-                        stat_txt, stat_col = get_status_display(row)
-                        st.caption(f"#{row['uid']} | 📍 {row['location']}")
-                        st.markdown(f':{stat_col}[**{stat_txt}**]')
-                        st.markdown("---")
-                        
-                        # 🔥🔥🔥 修復 Duplicate Key 錯誤：使用 row['id'] 作為 key 🔥🔥🔥
-                        if st.session_state.is_admin:
-                            if st.button("⚙️ 管理", key=f"btn_{row['id']}", use_container_width=True): show_edit_modal(row)
-                        else:
-                            avail = row['quantity'] - row.get('borrowed', 0)
-                            dis = (avail <= 0) or (row.get('status') in ['維修中', '報廢'])
-                            sel = row['uid'] in st.session_state.cart
-                            if st.checkbox("加入借用清單", key=f"check_{row['id']}", value=sel, disabled=dis):
-                                if not sel: st.session_state.cart[row['uid']] = 1; st.rerun()
-                            elif sel:
-                                del st.session_state.cart[row['uid']]; st.rerun()
-        else: st.info("無資料")
-    else: st.info("無資料")
+        status_map = {f"{STATUS_BUCKET_LABELS[b]} ({summary.by_status.get(b, 0)})": b for b in STATUS_BUCKETS}
+        selected_status = status_map.get(st.pills("狀態", list(status_map.keys())))
+
+        # 篩選條件變了就回到第一頁
+        search_query = search_query.strip()
+        filter_sig = (real_selected_cat, selected_status, search_query, st.session_state.inv_page_size)
+        if st.session_state.get('inv_filter_sig') != filter_sig:
+            st.session_state.inv_filter_sig = filter_sig; st.session_state.inv_page = 0
+        page = st.session_state.inv_page; page_size = st.session_state.inv_page_size
+
+        # 只抓目前這一頁
+        cat_filter = None if real_selected_cat == "全部顯示" else real_selected_cat
+        if INVENTORY_SEARCH_MODE == "local": page_df, total_count = search_local_inventory(load_data(), cat_filter, search_query, page, page_size, selected_status)
+        else:
+            page_args = (page, page_size, cat_filter, search_query or None, selected_status)
+            if prefetch is not None and page_args == prefetch_args: page_df, total_count = get_query_pool().result(prefetch)
+            else: page_df, total_count = load_equipment_page(*page_args)
+        if page_df.empty and page > 0:  # 資料變少導致頁碼超出範圍
+            st.session_state.inv_page = 0; rerun("page_reset")
+        if not st.session_state.is_admin and not page_df.empty:
+            page_df = page_df.assign(free=load_reservation_index().free(page_df, *window_bounds(*current_borrow_window())))
+
+        render_card_grid(page_df)
+        if not page_df.empty: render_pagination(total_count)
+    else: render_card_grid(pd.DataFrame())
+
+@st.fragment
+def render_card_grid(page_df):
+    # 卡片區 + 借用清單按鈕。勾選框的變動只重跑這個 fragment：用同一份 page_df 重畫，不查資料庫、不重畫摘要/篩選/頁首
+    if not st.session_state.is_admin: render_cart_button()
+    if page_df.empty: st.info("無資料"); return
+    st.write("")
+    cols = st.columns(3)
+    with metrics.span("render_cards"):
+        for i, (idx, row) in enumerate(page_df.iterrows()):
+            with cols[i % 3]:
+                render_equipment_card(row)
+
+CALL_COLUMNS = {"calls": "次數", "errors": "錯誤", "total_ms": "總計 ms", "avg_ms": "平均 ms", "max_ms": "最慢 ms", "rows": "列數", "bytes": "位元組"}
+
+def calls_frame(stats):
+    df = pd.DataFrame.from_dict(stats, orient="index")
+    if df.empty: return df
+    df["total_ms"] = df["seconds"] * 1000; df["avg_ms"] = df["total_ms"] / df["calls"]; df["max_ms"] = df["max_seconds"] * 1000
+    return df[list(CALL_COLUMNS)].sort_values("total_ms", ascending=False).round(1).rename(columns=CALL_COLUMNS)
+
+def render_diagnostics_panel():
+    # 管理員專用：本 session 的執行次數、上一次執行的呼叫明細 (http 開頭為實際的 Supabase 請求)、整個程序的累計
+    with st.expander("🩺 診斷"):
+        counts = sorted(st.session_state.run_counts.items(), key=lambda kv: -kv[1])
+        st.caption("本 session 執行次數：" + "、".join(f"{k} {v}" for k, v in counts))
+        if 'startup_timing' in st.session_state:
+            t = st.session_state.startup_timing
+            st.caption(f"本 session 首次執行：匯入 {t['imports_ms']:.0f} ms，庫存區首次畫面 {t['first_paint_ms']:.0f} ms")
+        last = metrics.last_run(_session_key())
+        if last is not None:
+            st.markdown(f"**上一次執行** ({last.trigger} → {last.outcome})：{last.seconds * 1000:.0f} ms")
+            st.dataframe(calls_frame({n: c.as_dict() for n, c in last.calls.items()}), use_container_width=True)
+        snap = metrics.snapshot(); runs = sum(snap['runs'].values())
+        st.markdown(f"**程序累計**：{runs} 次執行，平均 {snap['run_seconds'] / max(runs, 1) * 1000:.0f} ms ({', '.join(f'{k} {v}' for k, v in snap['runs'].items())})")
+        st.dataframe(calls_frame(snap['totals']), use_container_width=True)
+        st.download_button("⬇️ 匯出 (Prometheus 文字格式)", data=metrics.prometheus_text, file_name="metrics.txt", mime="text/plain")
+
+def live_state():
+    # 即時畫面比對用：庫存快取的 (版本號, 推播數) 與期間索引的 (重抓, 修補) 次數
+    cache = get_inventory_cache(); store = get_reservation_store()
+    return cache.version, cache.pushes, store.loads, store.patches
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_inventory_watcher(seen):
+    # 借用者畫面在 Realtime 連線中時：每秒只比對 live_state() 與這一頁畫出時的 seen，沒變就什麼都不做。
+    # 有新推播才整頁 rerun，其他人剛借走 / 預約的器材一秒內反映在卡片與指標上；借用清單對話框開著時先不重跑 (會把它關掉)，關閉後補上
+    if live_state() != seen and not st.session_state.cart_open: rerun("live_push")
 
 # ==========================================
 # 主執行邏輯
 # ==========================================
-if st.session_state.current_page == "login":
-    render_header(); _, c, _ = st.columns([1,5,1])
-    with c:
-        with st.container(border=True):
-            st.markdown("<h2 style='text-align:center'>🔐 管理員登入</h2>", unsafe_allow_html=True)
-            st.text_input("密碼", type="password", key="password_input")
-            b1, b2 = st.columns(2)
-            b1.button("取消", on_click=lambda: go_to("home"), use_container_width=True)
-            b2.button("登入", type="primary", on_click=perform_login, use_container_width=True)
-else:
-    render_header()
-    c_title, c_actions = st.columns([3, 1], vertical_alignment="bottom")
-    with c_title: st.title("團隊器材中心")
-    with c_actions:
+# 整次執行包在 metrics.run() 裡：耗時、起因與期間的所有呼叫記成一筆 (st.rerun() 中斷也照記)
+with metrics.run(begin_session_run()):
+    feed = get_inventory_feed()
+    reconcile_writes(); flush_toasts(); schedule_due_borrows()
+    st.session_state.cart_open = False  # 整頁執行時對話框只會在這次重新開啟
+    if st.session_state.pending_writes: pending_writes_watcher()
+    if st.session_state.current_page == "login":
+        render_header(); _, c, _ = st.columns([1,5,1])
+        with c:
+            with st.container(border=True):
+                st.markdown("<h2 style='text-align:center'>🔐 管理員登入</h2>", unsafe_allow_html=True)
+                st.text_input("密碼", type="password", key="password_input")
+                b1, b2 = st.columns(2)
+                b1.button("取消", on_click=lambda: go_to("home"), use_container_width=True)
+                b2.button("登入", type="primary", on_click=perform_login, use_container_width=True)
+    else:
+        render_header()
+        c_title, c_actions = st.columns([3, 1], vertical_alignment="bottom")
+        with c_title: st.title("團隊器材中心")
+        with c_actions:
+            if st.session_state.is_admin:
+                b1, b2, b3 = st.columns(3, gap="small")
+                b1.button("➕ 新增", on_click=show_add_modal, use_container_width=True)
+                b2.button("📥 匯入", on_click=show_bulk_modal, use_container_width=True)
+                b3.button("登出", on_click=perform_logout, type="primary", use_container_width=True)
+            else:
+                st.button("🔐 管理員登入", on_click=lambda: go_to("login"), type="primary", use_container_width=True)
+
         if st.session_state.is_admin:
-            b1, b2 = st.columns(2, gap="small")
-            b1.button("➕ 新增", on_click=show_add_modal, use_container_width=True)
-            b2.button("登出", on_click=perform_logout, type="primary", use_container_width=True)
+            borrows_future = get_query_pool().submit(load_active_borrows)  # 與庫存分頁的查詢同時進行
+            tab1, tab2, tab3 = st.tabs(["📦 器材庫存管理", "📋 借還紀錄 / 歸還", "🗂️ 借用歷史"])
+            with tab1, metrics.span("render_inventory_view"): render_inventory_view()
+            with tab2, metrics.span("admin_return_page"): admin_return_page(borrows_future)
+            with tab3, metrics.span("render_history_page"): render_history_page()
+            cs = get_inventory_cache().stats()
+            st.caption(f"庫存快取 v{cs['version']}：命中 {cs['hits']} / 未命中 {cs['misses']} (增量同步 {cs['delta_syncs']} 次，上次搬移 {cs['last_rows']} 筆)；即時推播 {'連線中' if cs['live'] else '未連線'}，已套用 {cs['pushes']} 筆")
+            rs = get_reservation_store().stats()
+            st.caption(f"期間索引：未歸還 {rs['records']} 筆，整份載入 {rs['loads']} 次、修補 {rs['patches']} 次、重建 {rs['builds']} 次")
+            ds = get_document_cache().stats()
+            st.caption(f"單據快取 {ds['docs']} 份 / {ds['bytes'] / 1024 / 1024:.1f} MB：命中 {ds['hits']} / 產生 {ds['misses']} (淘汰 {ds['evictions']}、失敗 {ds['failures']})")
+            render_diagnostics_panel()
+        elif feed is not None and feed.live:
+            seen = live_state()  # 畫之前記下，畫的期間進來的推播也會觸發重畫
+            render_inventory_view(); live_inventory_watcher(seen)
         else:
-            st.button("🔐 管理員登入", on_click=lambda: go_to("login"), type="primary", use_container_width=True)
-
-    if st.session_state.is_admin:
-        tab1, tab2 = st.tabs(["📦 器材庫存管理", "📋 借還紀錄 / 歸還"])
-        with tab1: render_inventory_view()
-        with tab2: admin_return_page()
-    else:
-        render_inventory_view()
+            render_inventory_view()
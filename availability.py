@@ -0,0 +1,218 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 日期區間可借數量 (借出 / 預約的時段索引)
+# ==========================================
+# 每筆未歸還的借用紀錄是一段 [借出時間, 預計歸還) 區間。依 uid 把區間的起訖點排成階梯函數
+# (每個斷點之後同時被借走的數量)，所有 uid 首尾相接存成一組 numpy 陣列，鍵為 (uid 序號 << 32 | 時間)；
+# 階梯高度另建 sparse table，區間最大值 O(1)。「A~B 之間最多同時借出幾個」= 兩次 searchsorted + 一次查表，
+# 整份型錄一次向量化算完。時間一律以 epoch 秒計，沒有時區的時間當 UTC (與畫面顯示的換算一致)。
+# 索引建好後唯讀，可以跨 session 共用。ReservationStore 保存未歸還紀錄的欄位陣列，借還與推播直接修補陣列再重建索引，
+# 不必整份重抓。
+
+DEFAULT_LOAN_DAYS = 7  # 沒有 due_date 的舊紀錄視為借 7 天 (與借用單的預設歸還日相同)
+OVERDUE_HOLD = timedelta(days=1)  # 逾期未還：視為至少佔用到明天
+UNAVAILABLE_STATUS = ("維修中", "報廢")
+INDEX_MAX_AGE = 3600  # 秒；逾期未還的佔用算到「建索引時 + 1 天」，陣列沒變也至少每小時重建一次索引 (不重抓)
+_TIME_BITS = 32
+
+def to_epoch_seconds(values):
+    # 字串 / datetime / date 的序列 -> int64 epoch 秒；無法解析的為 -1
+    ts = pd.to_datetime(pd.Series(list(values), dtype=object), utc=True, errors='coerce', format='ISO8601')
+    secs = ts.dt.tz_convert(None).to_numpy(dtype='datetime64[ns]').view(np.int64) // 10**9
+    return np.where(ts.isna().to_numpy(), -1, secs).astype(np.int64)
+
+def _seconds(value):
+    if isinstance(value, (int, np.integer)): return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime): value = datetime.combine(value, datetime.min.time())
+    return int(to_epoch_seconds([value])[0])
+
+def window_bounds(start_date, end_date):
+    # 以日期選的期間 (含結束當天) -> [開始日 00:00, 結束日隔天 00:00) 的 epoch 秒
+    return _seconds(start_date), _seconds(end_date + timedelta(days=1))
+
+def loan_intervals(records, now=None):
+    # records: [{"equipment_uid", "borrow_qty", "borrow_date", "due_date"}, ...] (未歸還的紀錄)
+    # 回傳 (uids, 起, 訖, 數量)；逾期未還的訖點延到 now + OVERDUE_HOLD
+    df = pd.DataFrame(list(records), columns=["equipment_uid", "borrow_qty", "borrow_date", "due_date"])
+    qtys = pd.to_numeric(df["borrow_qty"], errors='coerce').fillna(0).astype(np.int64).to_numpy()
+    return epoch_intervals(df["equipment_uid"].astype(str).to_numpy(), to_epoch_seconds(df["borrow_date"]), to_epoch_seconds(df["due_date"]), qtys, now)
+
+def epoch_intervals(uids, starts, dues, qtys, now=None):
+    # 已是 epoch 秒的欄位 (dues < 0 表示沒有預計歸還日) -> (uids, 起, 訖, 數量)，規則同 loan_intervals
+    starts = np.asarray(starts, dtype=np.int64); dues = np.asarray(dues, dtype=np.int64)
+    ends = np.where(dues < 0, starts + DEFAULT_LOAN_DAYS * 86400, dues)
+    ends = np.maximum(ends, _seconds((now or datetime.utcnow()) + OVERDUE_HOLD))
+    return np.asarray(uids, dtype=object), starts, ends, np.asarray(qtys, dtype=np.int64)
+
+class ReservationIndex:
+    def __init__(self, uids, starts, ends, qtys):
+        uids = np.asarray(uids, dtype=object); starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64); qtys = np.asarray(qtys, dtype=np.int64)
+        keep = (qtys > 0) & (starts >= 0) & (ends > starts)
+        self.intervals = int(keep.sum())
+        self.uids, codes = np.unique(uids[keep].astype(str), return_inverse=True)
+        self._codes = {u: i for i, u in enumerate(self.uids)}
+        n = len(self.uids)
+        # 起點 +qty、訖點 -qty；每個 uid 在時間 0 放一個高度 0 的哨兵，早於所有斷點的查詢也落在自己的段內。
+        # 每個 uid 的增減合計為 0，所以整串累加就是各自的階梯高度
+        codes = codes.astype(np.int64)
+        keys = np.concatenate([(codes << _TIME_BITS) | starts[keep], (codes << _TIME_BITS) | ends[keep], np.arange(n, dtype=np.int64) << _TIME_BITS])
+        deltas = np.concatenate([qtys[keep], -qtys[keep], np.zeros(n, dtype=np.int64)])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        levels = np.cumsum(np.bincount(inverse, weights=deltas, minlength=len(self._keys))).round().astype(np.int32)
+        # sparse table：第 k 列是從 i 起 2^k 個斷點的最大高度
+        table = [levels]
+        while (1 << len(table)) <= len(levels):
+            prev = table[-1]; half = 1 << (len(table) - 1)
+            table.append(np.maximum(prev[:-half], prev[half:]))
+        self._table = table
+
+    @classmethod
+    def from_records(cls, records, now=None):
+        return cls(*loan_intervals(records, now))
+
+    def __len__(self): return self.intervals
+
+    def _peak(self, codes, start, end):
+        if len(codes) == 0: return np.zeros(0, dtype=np.int64)
+        lo = np.searchsorted(self._keys, (codes << _TIME_BITS) | start, side="right") - 1
+        hi = np.maximum(np.searchsorted(self._keys, (codes << _TIME_BITS) | end, side="left"), lo + 1)
+        k = np.log2(hi - lo).astype(np.int64)
+        out = np.zeros(len(codes), dtype=np.int64)
+        for level in np.unique(k):  # 最多 log2(斷點數) 組
+            m = k == level; row = self._table[level]
+            out[m] = np.maximum(row[lo[m]], row[hi[m] - (1 << level)])
+        return out
+
+    def booked(self, start, end, uids=None):
+        # [start, end) 之間同一時刻最多被借走的數量 (pd.Series，index 為 uid)；uids=None 表示所有有紀錄的器材
+        start, end = _seconds(start), _seconds(end)
+        if uids is None:
+            return pd.Series(self._peak(np.arange(len(self.uids), dtype=np.int64), start, end), index=self.uids, dtype=np.int64)
+        uids = [str(u) for u in uids]
+        known = np.array([u in self._codes for u in uids], dtype=bool)
+        out = np.zeros(len(uids), dtype=np.int64)
+        out[known] = self._peak(np.array([self._codes[u] for u, ok in zip(uids, known) if ok], dtype=np.int64), start, end)
+        return pd.Series(out, index=uids, dtype=np.int64)
+
+    def free(self, equipment, start, end):
+        # equipment: 含 uid / quantity / status 的 df；回傳與它同 index 的可借數量 (維修中、報廢為 0)
+        if equipment.empty: return pd.Series(dtype=np.int64)
+        booked = self.booked(start, end, equipment['uid']).to_numpy()
+        free = np.maximum(equipment['quantity'].fillna(0).astype(np.int64).to_numpy() - booked, 0)
+        if 'status' in equipment.columns: free = np.where(equipment['status'].isin(UNAVAILABLE_STATUS), 0, free)
+        return pd.Series(free, index=equipment.index, dtype=np.int64)
+
+    def fully_free(self, equipment, start, end):
+        # 整段期間全數可借的器材 (例如營隊期間能整批帶走的)
+        return equipment[self.free(equipment, start, end) == equipment['quantity'].fillna(0).astype(np.int64)]
+
+    def shortages(self, order, quantities, start, end, statuses=None):
+        # order: {uid: 要借的數量}；quantities: {uid: 總數}。回傳期間內不夠借的 uid (排序)
+        uids = sorted(order); booked = self.booked(start, end, uids)
+        statuses = statuses or {}
+        return [u for u in uids if u not in quantities or statuses.get(u) in UNAVAILABLE_STATUS
+                or quantities[u] - booked[u] < order[u]]
+
+# ==========================================
+# 未歸還紀錄的共用快取
+# ==========================================
+STORE_COLUMNS = ["uid", "start", "due", "qty"]  # index 為借用紀錄 id
+
+def reservation_frame(columns):
+    # active_reservations RPC 回傳的欄位陣列 {"id", "uid", "start", "due", "qty"} -> DataFrame (不逐列轉 dict)
+    return pd.DataFrame({"uid": pd.Series(columns["uid"], dtype=object).astype(str).to_numpy(),
+                         "start": np.asarray(columns["start"], dtype=np.int64), "due": np.asarray(columns["due"], dtype=np.int64),
+                         "qty": np.asarray(columns["qty"], dtype=np.int64)},
+                        index=pd.Index(np.asarray(columns["id"], dtype=np.int64), name="id"))
+
+def records_frame(records):
+    # borrow_records 的列 (checkout 回傳、推播) -> 同上的 DataFrame；已歸還的列不放進來
+    df = pd.DataFrame(list(records), columns=["id", "equipment_uid", "borrow_qty", "borrow_date", "due_date", "is_returned"])
+    df = df[~df["is_returned"].fillna(False).astype(bool)]
+    return reservation_frame({"id": df["id"].astype(np.int64), "uid": df["equipment_uid"], "start": to_epoch_seconds(df["borrow_date"]),
+                              "due": to_epoch_seconds(df["due_date"]), "qty": pd.to_numeric(df["borrow_qty"], errors='coerce').fillna(0)})
+
+class ReservationStore:
+    # fetch() -> active_reservations 的欄位陣列。只有借用紀錄的異動會動到這份快取 (器材編輯、庫存推播不會)：
+    # 本程序的借出 / 歸還與 borrow_records 推播直接修補陣列；整份重抓只在第一次、過期 (ttl；推播連線中用 live_ttl)
+    # 或 invalidate() 之後，而且同時只有一個執行緒在抓，其他 session 先用舊的索引 (還沒有任何資料時才等它抓完)。
+    def __init__(self, fetch, ttl=60, live_ttl=3600):
+        self.fetch = fetch; self.ttl = ttl; self.live_ttl = live_ttl; self.live = False
+        self.loads = 0; self.patches = 0; self.builds = 0
+        self._frame = None; self._loaded_at = 0.0; self._index = None; self._built_at = 0.0
+        self._loading = None; self._pending = []  # 重抓期間收到的修補，抓完後補套上去
+        self._lock = threading.Lock()
+
+    def index(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                stale = self._frame is None or now - self._loaded_at >= (self.live_ttl if self.live else self.ttl)
+                if not stale or (self._loading is not None and self._frame is not None):
+                    return self._current_index(now)
+                loading = self._loading
+                if loading is None:
+                    self._loading = done = threading.Event(); self._pending = []; break
+            loading.wait()  # 第一次載入：等別人抓完 (對方失敗就換自己抓)
+        try:
+            frame = reservation_frame(self.fetch())
+        except Exception:
+            with self._lock: self._loading = None
+            done.set(); raise
+        with self._lock:
+            for op in self._pending: frame = op(frame)
+            self._frame = frame; self._loaded_at = time.monotonic(); self._index = None; self.loads += 1
+            self._loading = None; self._pending = []
+            index = self._current_index(self._loaded_at)
+        done.set()
+        return index
+
+    def _current_index(self, now):
+        # 持鎖呼叫；陣列有變或索引太舊才重建 (10 萬筆約幾十 ms)
+        if self._index is None or now - self._built_at >= INDEX_MAX_AGE:
+            f = self._frame
+            self._index = ReservationIndex(*epoch_intervals(f["uid"].to_numpy(), f["start"].to_numpy(), f["due"].to_numpy(), f["qty"].to_numpy()))
+            self._built_at = now; self.builds += 1
+        return self._index
+
+    def _patch(self, op):
+        with self._lock:
+            if self._loading is not None: self._pending.append(op)
+            if self._frame is not None: self._frame = op(self._frame); self._index = None
+            self.patches += 1
+
+    def upsert(self, records):
+        # 新增 / 異動的借用紀錄 (整列)；已歸還的視同移除
+        records = list(records)
+        if not records: return
+        ids = [int(r["id"]) for r in records]; active = records_frame(records)
+        self._patch(lambda f: pd.concat([f.drop(ids, errors="ignore"), active]))
+
+    def remove(self, ids):
+        ids = [int(i) for i in ids]
+        if ids: self._patch(lambda f: f.drop(ids, errors="ignore"))
+
+    def apply_change(self, event, record, old_record):
+        # borrow_records 推播：DELETE 只帶主鍵 id
+        if event == "DELETE": self.remove([old_record["id"]] if old_record.get("id") is not None else [])
+        elif record: self.upsert([record])
+
+    def invalidate(self):
+        with self._lock: self._loaded_at = 0.0
+
+    def set_live(self, live):
+        # 訂閱成功 (含重連) 時視為可能漏接，下次重抓
+        with self._lock:
+            self.live = live
+            if live: self._loaded_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {"records": 0 if self._frame is None else len(self._frame), "loads": self.loads, "patches": self.patches, "builds": self.builds}
@@ -0,0 +1,107 @@
+"""量測日期區間可借數量的索引：建索引、整份型錄查一個期間、借用單 (幾項器材) 的檢查。
+
+對照組是逐 uid 掃過所有重疊紀錄、在每個起點加總的寫法 (等同把紀錄拉進 pandas 再算)。
+另外在 LocalSupabase (模擬往返 --latency-ms) 量 app 實際的載入路徑：舊的每 1000 列一頁 + from_records，
+對照 active_reservations 一個 RPC + ReservationStore 建索引，以及借出一筆後直接修補的成本。
+用法：python benchmarks/bench_availability.py [--items 5000] [--reservations 100000] [--repeat 20] [--latency-ms 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from availability import ReservationIndex, ReservationStore, window_bounds  # noqa: E402
+from local_backend import LocalSupabase  # noqa: E402
+
+def make_data(items, reservations, seed=0):
+    rng = np.random.default_rng(seed)
+    equipment = pd.DataFrame({"uid": [f"A{i:05d}" for i in range(items)], "quantity": rng.integers(1, 20, items), "status": "在庫"})
+    t0 = int(pd.Timestamp("2026-01-01", tz="UTC").timestamp())
+    starts = t0 + rng.integers(0, 365 * 24, reservations) * 3600
+    return equipment, equipment["uid"].to_numpy()[rng.integers(0, items, reservations)], starts, starts + rng.integers(1, 21, reservations) * 86400, rng.integers(1, 4, reservations)
+
+def naive_booked(uids, starts, ends, qtys, start, end):
+    # 對照組：篩出重疊的紀錄，每個 uid 在每個起點算一次同時借出量
+    df = pd.DataFrame({"uid": uids, "s": starts, "e": ends, "q": qtys})
+    df = df[(df.s < end) & (df.e > start)]
+    out = {}
+    for uid, g in df.groupby("uid"):
+        s, e, q = g.s.to_numpy(), g.e.to_numpy(), g.q.to_numpy()
+        points = np.append(s[s > start], start)
+        out[uid] = int(max(q[(s <= t) & (e > t)].sum() for t in points))
+    return out
+
+def seed_backend(path, uids, starts, ends, qtys, latency):
+    db = LocalSupabase(path)
+    iso = lambda secs: pd.to_datetime(secs, unit="s").strftime("%Y-%m-%dT%H:%M:%S")
+    rows = list(zip(uids.tolist(), uids.tolist(), qtys.tolist(), iso(starts), iso(ends)))
+    with db._transaction() as conn:
+        conn.executemany("insert into borrow_records (equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, due_date, counted) "
+                         "values (?, ?, 'bench', '', ?, 0, ?, ?, 0)", rows)
+    db.latency = latency
+    return db
+
+def paged_index(db, page_rows=1000):
+    # 舊路徑：borrow_records 依 id keyset 分頁抓完，再逐列解析成索引
+    rows = []; after_id = 0
+    while True:
+        page = db.table("borrow_records").select("id, equipment_uid, borrow_qty, borrow_date, due_date").eq("is_returned", False).gt("id", after_id).order("id").limit(page_rows).execute().data
+        rows.extend(page)
+        if len(page) < page_rows: return ReservationIndex.from_records(rows)
+        after_id = page[-1]['id']
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); result = fn(); times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--reservations", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    equipment, uids, starts, ends, qtys = make_data(args.items, args.reservations)
+    build_ms, index = timed(lambda: ReservationIndex(uids, starts, ends, qtys), 3)
+    start, end = window_bounds(date(2026, 7, 1), date(2026, 7, 7))  # 一週的營隊期間
+    print(f"器材 {args.items} 項、借用 / 預約 {args.reservations} 筆")
+    print(f"建索引                  {build_ms:>9.1f} ms")
+    ms, _ = timed(lambda: index.booked(start, end), args.repeat)
+    print(f"整份型錄 booked()       {ms:>9.2f} ms")
+    ms, free = timed(lambda: index.free(equipment, start, end), args.repeat)
+    print(f"整份型錄 free()         {ms:>9.2f} ms  (全數可借 {(free == equipment['quantity']).sum()} 項)")
+    cart = equipment.sample(5, random_state=1)
+    order = dict.fromkeys(cart["uid"], 1); quantities = dict(zip(cart["uid"], cart["quantity"]))
+    ms, _ = timed(lambda: index.shortages(order, quantities, start, end), args.repeat)
+    print(f"借用單檢查 (5 項)       {ms:>9.3f} ms")
+    ms, expected = timed(lambda: naive_booked(uids, starts, ends, qtys, start, end), 1)
+    print(f"對照：逐 uid 掃描       {ms:>9.1f} ms")
+    got = index.booked(start, end)
+    assert all(got[u] == v for u, v in expected.items()), "結果與對照組不一致"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = seed_backend(os.path.join(tmp, "bench.db"), uids, starts, ends, qtys, args.latency_ms / 1000)
+        print(f"載入路徑 (LocalSupabase，模擬往返 {args.latency_ms:.0f} ms)")
+        ms, paged = timed(lambda: paged_index(db), 3)
+        print(f"  分頁 + from_records   {ms:>9.1f} ms  ({db.calls['select borrow_records'] // 3} 個請求)")
+        fetch = lambda: db.rpc("active_reservations", {}).execute().data
+        ms, store_index = timed(lambda: ReservationStore(fetch).index(), 3)
+        print(f"  RPC + ReservationStore {ms:>9.1f} ms  (1 個請求)")
+        assert (paged.booked(start, end) == store_index.booked(start, end)).all(), "兩條載入路徑結果不一致"
+        store = ReservationStore(fetch); store.index()
+        record = {"id": 10**9, "equipment_uid": uids[0], "borrow_qty": 1, "borrow_date": "2026-07-02T09:00:00", "due_date": "2026-07-05T00:00:00", "is_returned": False}
+        ms, _ = timed(lambda: (store.upsert([record]), store.index()), args.repeat)
+        print(f"  借出一筆後修補 + 重建  {ms:>9.1f} ms  (0 個請求)")
+
+if __name__ == "__main__":
+    main()
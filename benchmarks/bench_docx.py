@@ -0,0 +1,37 @@
+"""量測 create_word 隨列數的成長 (250 / 500 / 1000 / 2000 列)，確認是線性。
+
+用法：python benchmarks/bench_docx.py [--repeat N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import word_report  # noqa: E402
+from bench_pdf import make_cart  # noqa: E402
+
+ROWS = [250, 500, 1000, 2000]
+
+def measure(cart, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        word_report.create_word(cart, "王小明", "0912-345-678", "2026-10-17", "2026-10-24")
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    measure(make_cart(10), 1)  # 暖機：載入 docx 範本
+    print(f"{'列數':>6}{'ms':>10}{'ms/列':>10}")
+    for n in ROWS:
+        ms = measure(make_cart(n), args.repeat)
+        print(f"{n:>6}{ms:>10.1f}{ms / n:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""量測 create_pdf 每份文件的成本 (10 / 100 / 1000 列)。
+
+「冷」= 每份都重新解析字型 (舊行為)，「熱」= 使用程序內的字型快取。
+用法：python benchmarks/bench_pdf.py [--font 字型檔路徑] [--repeat N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import documents  # noqa: E402
+import pdf_report  # noqa: E402
+
+CATEGORIES = ["手工具", "一般器材", "廚具", "清潔用品", "文具用品", "其他"]
+ROWS = [10, 100, 1000]
+
+def make_cart(n):
+    per_cat = max(1, n // len(CATEGORIES))
+    return [{"category": CATEGORIES[min(i // per_cat, len(CATEGORIES) - 1)], "uid": f"A{i:04d}", "name": f"不鏽鋼湯鍋 {i} 號", "borrow_qty": i % 5 + 1} for i in range(n)]
+
+def measure(cart, text_map, repeat, cold):
+    times = []
+    for _ in range(repeat):
+        if cold: pdf_report._font_cache = None
+        t0 = time.perf_counter()
+        pdf_report.create_pdf(cart, text_map, "王小明", "0912-345-678", "2026-10-17", "2026-10-24")
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--font", default=pdf_report.FONT_FILE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    pdf_report.FONT_FILE = args.font
+    if not os.path.exists(args.font): print(f"⚠️ 找不到字型 {args.font}，改用 Helvetica (中文會失敗)")
+
+    t0 = time.perf_counter(); pdf_report.get_cjk_font(); print(f"首次解析字型 {(time.perf_counter() - t0) * 1000:.0f} ms")
+    print(f"{'列數':>6}{'冷(ms)':>10}{'熱(ms)':>10}{'頁數':>6}")
+    for n in ROWS:
+        cart = make_cart(n); text_map = documents.category_label_rows(cart)
+        cold = measure(cart, text_map, args.repeat, cold=True)
+        warm = measure(cart, text_map, args.repeat, cold=False)
+        pages = pdf_report.create_pdf(cart, text_map, "", "", "", "").count(b"/Type /Page\n")
+        print(f"{n:>6}{cold:>10.1f}{warm:>10.1f}{pages:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""比較本機搜尋索引與原本 pandas str.contains 全表掃描。
+
+用法：python benchmarks/bench_search.py [筆數]
+"""
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from search_index import InventorySearchIndex  # noqa: E402
+
+NOUNS = ["鍋", "鏟", "碗", "刀", "繩", "帳篷", "睡袋", "手電筒", "延長線", "水桶", "抹布", "剪刀", "膠帶", "瓦斯爐", "營燈"]
+ADJ = ["大", "小", "不鏽鋼", "鋁製", "摺疊", "備用", "新", "舊", "紅色", "藍色"]
+LOCATIONS = ["倉庫A", "倉庫B", "社辦", "器材室", "二樓櫃子"]
+QUERIES = ["鍋", "不鏽鋼鍋", "帳篷", "a0123", "A01", "營燈", "倉庫B", "(", "zzz-not-found"]
+
+def make_inventory(n, seed=0):
+    rnd = random.Random(seed)
+    return pd.DataFrame({
+        "uid": [f"A{i:05d}" for i in range(n)],
+        "name": [f"{rnd.choice(ADJ)}{rnd.choice(NOUNS)}{rnd.randint(1, 99)}號" for _ in range(n)],
+        "location": [rnd.choice(LOCATIONS) for _ in range(n)],
+    })
+
+def pandas_scan(df, q, regex):
+    return df[df['name'].str.contains(q, case=False, regex=regex) | df['uid'].str.contains(q, case=False, regex=regex)]
+
+def timeit(fn, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def main(n):
+    df = make_inventory(n)
+    t0 = time.perf_counter(); index = InventorySearchIndex(df); build_ms = (time.perf_counter() - t0) * 1000
+    print(f"{n} 筆，建索引 {build_ms:.0f} ms")
+    print(f"{'查詢':<16}{'命中':>8}{'索引(ms)':>12}{'pandas literal(ms)':>20}{'pandas regex(ms)':>18}")
+    for q in QUERIES:
+        hits = len(index._search(q))
+        t_index = timeit(lambda: index._search(q))
+        t_literal = timeit(lambda: pandas_scan(df, q, False), repeat=5)
+        try: t_regex = f"{timeit(lambda: pandas_scan(df, q, True), repeat=5):.2f}"
+        except Exception as e: t_regex = type(e).__name__
+        print(f"{q:<16}{hits:>8}{t_index:>12.3f}{t_literal:>20.2f}{t_regex:>18}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,67 @@
+"""量測冷啟動：各模組的匯入成本，以及 app.py 第一次執行到庫存區首次畫面 (render_inventory_view 第一個元素) 的時間。
+
+每次量測都開新的 Python 程序 (模組都還沒載入，等同容器剛啟動)，取中位數。
+「啟動時匯入」是 app.py 頂層會載入的；「延後匯入」是用到才載入的 (第一次查詢、產生單據、批次匯入)。
+第二部分用 streamlit.testing 的 AppTest 執行 app.py，需要可連線的 Supabase (讀 --secrets，預設 .streamlit/secrets.toml)；
+沒有設定檔時只跑第一部分。
+用法：python benchmarks/bench_startup.py [--repeat N] [--secrets 路徑]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EAGER = ["pandas", "numpy", "httpx", "search_index", "images", "documents", "bulk_io", "realtime_feed", "data_access", "metrics", "availability"]
+LAZY = ["supabase", "realtime", "fpdf", "docx", "openpyxl"]
+
+# streamlit 本身由伺服器先載入，不算在 script 的匯入時間裡
+IMPORT_SNIPPET = """
+import importlib, time, streamlit
+t0 = time.perf_counter(); importlib.import_module({mod!r}); print((time.perf_counter() - t0) * 1000)
+"""
+
+APP_SNIPPET = """
+import json, time, tomllib
+from streamlit.testing.v1 import AppTest
+with open({secrets!r}, "rb") as f: secrets = tomllib.load(f)
+at = AppTest.from_file({app!r}, default_timeout=120)
+for k, v in secrets.items(): at.secrets[k] = v
+t0 = time.perf_counter(); at.run(); wall = (time.perf_counter() - t0) * 1000
+timing = at.session_state["startup_timing"] if "startup_timing" in at.session_state else {{}}
+print(json.dumps({{"wall_ms": wall, "exception": [str(e.value) for e in at.exception], **timing}}))
+"""
+
+def run_python(code):
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.strip().splitlines()[-1]
+
+def import_ms(mod, repeat):
+    return statistics.median(float(run_python(IMPORT_SNIPPET.format(mod=mod))) for _ in range(repeat))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--secrets", default=os.path.join(ROOT, ".streamlit", "secrets.toml"))
+    args = parser.parse_args()
+
+    print(f"{'模組':<16}{'匯入(ms)':>10}")
+    for title, mods in (("啟動時匯入", EAGER), ("延後匯入", LAZY)):
+        print(f"-- {title}")
+        for mod in mods: print(f"{mod:<16}{import_ms(mod, args.repeat):>10.1f}")
+
+    if not os.path.exists(args.secrets):
+        print(f"⚠️ 找不到 {args.secrets}，略過首次畫面量測"); return
+    runs = [json.loads(run_python(APP_SNIPPET.format(secrets=args.secrets, app=os.path.join(ROOT, "app.py")))) for _ in range(args.repeat)]
+    errors = [e for r in runs for e in r["exception"]]
+    if errors: print(f"⚠️ app.py 執行出錯：{errors[0]}")
+    painted = [r for r in runs if "first_paint_ms" in r]
+    if not painted: print("⚠️ 沒有畫出庫存區 (未記到 first_paint)"); return
+    print(f"app.py 匯入        {statistics.median(r['imports_ms'] for r in painted):>8.0f} ms")
+    print(f"庫存區首次畫面    {statistics.median(r['first_paint_ms'] for r in painted):>8.0f} ms")
+    print(f"整次執行          {statistics.median(r['wall_ms'] for r in painted):>8.0f} ms")
+
+if __name__ == "__main__":
+    main()
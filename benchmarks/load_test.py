@@ -0,0 +1,130 @@
+"""多 session 壓力測試：N 個借用者 + M 個管理員同時操作，完全離線 (DATA_BACKEND=local，SQLite 替身)。
+
+借用者：瀏覽 → 勾選 1~3 項 → 送出借用單 (庫存不足時清空清單重來)；管理員：登入 → 瀏覽 → 一鍵歸還某位借用人。
+每個 session 是一個 streamlit.testing 的 AppTest，各自跑在獨立的程序裡 (AppTest 會改動程序層級的全域狀態，
+同一程序內無法並行)，所有程序共用同一個 SQLite 檔案，因此 checkout / 歸還的 RPC 會真的互相搶鎖。
+注意：正式環境是一個 Streamlit 程序服務所有 session、共用庫存快取；這裡每個程序各有一份快取，命中率偏保守。
+
+回報：每次 rerun (AppTest.run，含 st.rerun() 連鎖) 的 p50 / p99、每次 rerun 的查詢數、借用成功 / 被拒次數，
+以及超借事件 (同一時段借出超過總數、borrowed 小於 0 或大於總數，或與已開始的未歸還紀錄合計不符的器材)。有超借或 script 例外時以代碼 1 結束。
+用法：python benchmarks/load_test.py [--borrowers 8] [--admins 2] [--iterations 5] [--items 60] [--latency-ms 20]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+APP = os.path.join(ROOT, "app.py")
+ADMIN_PASSWORD = "load-test"
+
+def percentile(values, p):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+class Session:
+    def __init__(self, secrets, rng):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP, default_timeout=120)
+        for k, v in secrets.items(): self.at.secrets[k] = v
+        self.rng = rng; self.rerun_ms = []; self.exceptions = []; self.stats = Counter()
+
+    def run(self):
+        t0 = time.perf_counter(); self.at.run(); self.rerun_ms.append((time.perf_counter() - t0) * 1000)
+        self.exceptions.extend(str(e.value) for e in self.at.exception)
+        return self.at
+
+    def button(self, text):
+        return next((b for b in self.at.button if text in b.label and not b.disabled), None)
+
+    def next_page(self):
+        b = self.button("下一頁")
+        if b is not None and self.rng.random() < 0.5: b.click(); self.run()
+
+def borrower_flow(s, name, iterations):
+    s.run()
+    for i in range(iterations):
+        s.next_page()
+        for _ in range(s.rng.randint(1, 3)):
+            boxes = [c for c in s.at.checkbox if c.label == "加入借用清單" and not c.disabled and not c.value]
+            if not boxes: break
+            s.rng.choice(boxes).check(); s.run()
+        if not s.at.session_state.cart: s.stats["empty_cart"] += 1; continue
+        # 對話框：開清單、填姓名、按送出在同一次執行裡 (AppTest 不會單獨重跑 dialog fragment)
+        s.button("借用清單").click(); s.run()
+        next(t for t in s.at.text_input if "借用人姓名" in t.label).set_value(f"{name}-{i}")
+        s.button("借用清單").click(); s.button("確認借用").click(); s.run()
+        if not s.at.session_state.cart: s.stats["checkout_ok"] += 1; s.button("關閉此訊息").click(); s.run()
+        else:
+            s.stats["checkout_rejected"] += 1
+            s.button("借用清單").click(); s.run(); s.button("借用清單").click(); s.button("清空清單").click(); s.run()
+
+def admin_flow(s, name, iterations):
+    s.run(); s.button("管理員登入").click(); s.run()
+    s.at.text_input(key="password_input").set_value(ADMIN_PASSWORD); s.button("登入").click(); s.run()
+    for _ in range(iterations):
+        s.run(); s.next_page()
+        returns = [b for b in s.at.button if "一鍵歸還全部" in b.label]
+        if returns: s.rng.choice(returns).click(); s.run(); s.stats["return_clicks"] += 1
+        time.sleep(0.2)  # 歸還在背景送出；下一輪的 rerun 才對帳
+
+def worker(role, index, secrets, iterations, barrier, results):
+    from local_backend import LocalSupabase
+    s = Session(secrets, random.Random(f"{role}-{index}"))
+    barrier.wait()  # 所有程序都載入完成後才一起開始，量到的是同時操作時的延遲
+    try: (borrower_flow if role == "borrower" else admin_flow)(s, f"{role}{index}", iterations)
+    except Exception as e: s.exceptions.append(f"{type(e).__name__}: {e}")
+    db = LocalSupabase.shared(secrets["LOCAL_DB"])
+    results.put({"role": role, "rerun_ms": s.rerun_ms, "calls": dict(db.calls), "stats": dict(s.stats), "exceptions": s.exceptions})
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--borrowers", type=int, default=8)
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--items", type=int, default=60)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    from local_backend import LocalSupabase
+    db_path = os.path.join(tempfile.mkdtemp(prefix="load_test_"), "app.db")
+    LocalSupabase(db_path).seed_equipment(args.items)
+    secrets = {"DATA_BACKEND": "local", "LOCAL_DB": db_path, "LOCAL_LATENCY_MS": args.latency_ms, "LOCAL_SEED": args.items, "ADMIN_PASSWORD": ADMIN_PASSWORD}
+
+    ctx = multiprocessing.get_context("spawn")
+    roles = [("borrower", i) for i in range(args.borrowers)] + [("admin", i) for i in range(args.admins)]
+    barrier = ctx.Barrier(len(roles)); results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(role, i, secrets, args.iterations, barrier, results)) for role, i in roles]
+    t0 = time.perf_counter()
+    for p in procs: p.start()
+    out = [results.get() for _ in procs]
+    for p in procs: p.join()
+    elapsed = time.perf_counter() - t0
+
+    rerun_ms = [ms for r in out for ms in r["rerun_ms"]]; calls = Counter(); stats = Counter()
+    for r in out: calls.update(r["calls"]); stats.update(r["stats"])
+    exceptions = [e for r in out for e in r["exceptions"]]
+    violations = LocalSupabase(db_path).stock_violations()
+
+    print(f"session：借用者 {args.borrowers}、管理員 {args.admins}，各 {args.iterations} 輪；器材 {args.items} 項；模擬往返 {args.latency_ms:.0f} ms；總耗時 {elapsed:.1f} s")
+    for role in ("borrower", "admin"):
+        ms = [m for r in out if r["role"] == role for m in r["rerun_ms"]]
+        if ms: print(f"{role:>9} rerun {len(ms):>5} 次  p50 {percentile(ms, 50):>7.1f} ms  p99 {percentile(ms, 99):>7.1f} ms  平均 {statistics.mean(ms):>7.1f} ms")
+    total = sum(calls.values())
+    print(f"查詢 {total} 次 (每次 rerun {total / max(len(rerun_ms), 1):.2f})：" + "、".join(f"{k} {v}" for k, v in calls.most_common()))
+    print(f"借用成功 {stats['checkout_ok']}、被拒 (庫存不足) {stats['checkout_rejected']}、空清單略過 {stats['empty_cart']}；管理員一鍵歸還 {stats['return_clicks']} 次")
+    print(f"超借事件：{len(violations)}")
+    for v in violations[:10]: print(f"  {v['uid']}: 總數 {v['quantity']}、同時段最多借出 {v['peak']}、borrowed {v['borrowed']}、未歸還合計 {v['active_qty']}")
+    if exceptions:
+        print(f"script 例外 {len(exceptions)} 次，例如：{exceptions[0]}")
+    sys.exit(1 if violations or exceptions else 0)
+
+if __name__ == "__main__":
+    main()
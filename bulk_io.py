@@ -0,0 +1,121 @@
+import csv
+import io
+import os
+import tempfile
+from itertools import islice
+
+# ==========================================
+# 器材批次匯入 / 匯出
+# ==========================================
+# 匯入：CSV / XLSX 逐塊讀取 (不把整個檔案轉成 DataFrame)，每塊驗證後用一次 RPC 以 uid upsert，
+# 5,000 列約 10 次往返。錯誤以「檔案列號 + 原因」回報，其餘列照常寫入。
+# 匯出：依 id 分頁 (keyset) 逐頁寫成 CSV 暫存檔，記憶體只放一頁資料。
+
+IMPORT_CHUNK_ROWS = 500
+EXPORT_PAGE_ROWS = 1000  # PostgREST 預設單次最多回傳 1000 列
+IMPORT_FIELDS = ("uid", "name", "category", "status", "location", "quantity")
+HEADER_ALIASES = {"編號": "uid", "名稱": "name", "分類": "category", "狀態": "status", "位置": "location", "總數": "quantity", "數量": "quantity"}
+DEFAULT_STATUS = "在庫"
+MAX_QUANTITY = 2147483647  # equipment.quantity 是 int4
+DB_ERRORS = {"quantity_below_borrowed": "總數小於目前借出數量，未更新"}
+
+class ImportFormatError(ValueError):
+    pass
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0; self.inserted = 0; self.updated = 0; self.batches = 0
+        self.errors = []  # [{"row": 檔案列號, "uid": 編號, "error": 原因}]
+
+    @property
+    def written(self): return self.inserted + self.updated
+
+def _cell_text(value):
+    # Excel 的整數常被讀成 1001.0，轉回 "1001"
+    if value is None: return ""
+    if isinstance(value, float) and value.is_integer(): value = int(value)
+    return str(value).strip()
+
+def _iter_csv_rows(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try: yield from csv.reader(text)
+    finally: text.detach()
+
+def _iter_xlsx_rows(file):
+    try: from openpyxl import load_workbook
+    except ImportError: raise ImportFormatError("未安裝 openpyxl，無法讀取 Excel 檔，請改用 CSV")
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try: yield from wb.active.iter_rows(values_only=True)
+    finally: wb.close()
+
+def iter_import_chunks(file, filename, chunk_rows=IMPORT_CHUNK_ROWS):
+    # 每次回傳一塊 [(檔案列號, {欄位: 文字}), ...]；第 1 列為標題，可用英文欄位名或中文 (編號/名稱/分類…)
+    ext = os.path.splitext(filename)[1].lower()
+    rows = _iter_xlsx_rows(file) if ext in (".xlsx", ".xlsm") else _iter_csv_rows(file)
+    header = [HEADER_ALIASES.get(_cell_text(h), _cell_text(h).lower()) for h in next(rows, [])]
+    missing = [f for f in ("uid", "name") if f not in header]
+    if missing: raise ImportFormatError(f"標題列缺少欄位：{', '.join(missing)}")
+    cols = [(i, f) for i, f in enumerate(header) if f in IMPORT_FIELDS]
+    numbered = ((n, r) for n, r in enumerate(rows, start=2) if any(_cell_text(v) for v in r))
+    while True:
+        chunk = [(n, {f: _cell_text(r[i]) if i < len(r) else "" for i, f in cols}) for n, r in islice(numbered, chunk_rows)]
+        if not chunk: return
+        yield chunk
+
+def validate_row(row, categories, statuses):
+    # 回傳 (要寫入的 dict, None) 或 (None, 錯誤原因)
+    uid = row.get("uid", ""); name = row.get("name", "")
+    if not uid: return None, "缺少編號"
+    if not name: return None, "缺少名稱"
+    category = row.get("category", "")
+    if category not in categories: return None, f"分類「{category}」不在選項內"
+    status = row.get("status") or DEFAULT_STATUS
+    if status not in statuses: return None, f"狀態「{status}」不在選項內"
+    qty_text = row.get("quantity") or "1"
+    try: quantity = int(float(qty_text))
+    except (ValueError, OverflowError): return None, f"總數「{qty_text}」不是數字"
+    if quantity < 1 or quantity != float(qty_text): return None, f"總數「{qty_text}」須為正整數"
+    if quantity > MAX_QUANTITY: return None, f"總數「{qty_text}」超過上限 {MAX_QUANTITY}"
+    return {"uid": uid, "name": name, "category": category, "status": status, "location": row.get("location", ""), "quantity": quantity}, None
+
+def import_equipment(file, filename, upsert_batch, categories, statuses, chunk_rows=IMPORT_CHUNK_ROWS, on_progress=None):
+    # upsert_batch(records) -> [{"equipment_uid", "action"}]，action 為 inserted / updated 或 DB_ERRORS 的鍵
+    report = ImportReport(); seen = {}  # uid -> 第一次出現的列號
+    for chunk in iter_import_chunks(file, filename, chunk_rows):
+        records = []; row_of = {}
+        for n, row in chunk:
+            report.rows += 1
+            record, error = validate_row(row, categories, statuses)
+            if record and record["uid"] in seen: error = f"檔案內編號重複 (同第 {seen[record['uid']]} 列)"
+            if error: report.errors.append({"row": n, "uid": row.get("uid", ""), "error": error}); continue
+            seen[record["uid"]] = n; row_of[record["uid"]] = n; records.append(record)
+        if records:
+            report.batches += 1
+            for res in upsert_batch(records):
+                action = res.get("action")
+                if action == "inserted": report.inserted += 1
+                elif action == "updated": report.updated += 1
+                else: report.errors.append({"row": row_of.get(res.get("equipment_uid")), "uid": res.get("equipment_uid"), "error": DB_ERRORS.get(action, action)})
+        if on_progress: on_progress(report)
+    return report
+
+def iter_csv_export(fetch_page, page_rows=EXPORT_PAGE_ROWS):
+    # fetch_page(after_id, limit) -> 依 id 遞增的下一頁 [dict]；逐頁產出 UTF-8 (含 BOM，Excel 直接開不會亂碼) 的 CSV bytes
+    buf = io.StringIO(); writer = None; after_id = 0
+    while True:
+        page = fetch_page(after_id, page_rows)
+        if not page: break
+        if writer is None:
+            writer = csv.DictWriter(buf, fieldnames=list(page[0].keys()), extrasaction="ignore")
+            buf.write("\ufeff"); writer.writeheader()
+        writer.writerows(page)
+        yield buf.getvalue().encode("utf-8"); buf.seek(0); buf.truncate()
+        if len(page) < page_rows: break
+        after_id = page[-1]["id"]
+
+def spool_csv_export(fetch_page, page_rows=EXPORT_PAGE_ROWS):
+    # 逐頁寫進暫存檔，不在記憶體串接整份 CSV；回傳讀取位置在開頭的 FileIO (st.download_button 收得下的檔案型別)
+    out = tempfile.TemporaryFile()
+    for chunk in iter_csv_export(fetch_page, page_rows): out.write(chunk)
+    out.flush(); raw = out.detach(); raw.seek(0)
+    return raw
@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import httpx
+
+# ==========================================
+# 資料存取：共用連線池、並行查詢、逾時與重試
+# ==========================================
+# 所有 Supabase 呼叫共用同一個 httpx.Client (keep-alive 連線池)，彼此獨立的查詢丟進執行緒池同時送出，
+# 一頁的等待時間由最慢的那個查詢決定，而不是全部相加。讀取池依同時在線的 session 數估大小；
+# 背景寫入另用一個小池子，大量歸還 / 編輯排隊時不會佔住讀取的執行緒。
+# 重試只針對傳輸層錯誤：讀取遇到連線/逾時錯誤可重送；寫入只在「連線根本沒建立」時重送，避免重複扣庫存。
+
+REQUEST_TIMEOUT = 15  # 秒；單一 HTTP 請求 (含讀取回應) 的上限
+CONNECT_TIMEOUT = 5
+EXPECTED_SESSIONS = 8  # 同時在線的 session 數估計值
+QUERY_FANOUT = 3  # 一次執行最多同時送出的讀取 (摘要 + 分頁 + 未歸還紀錄)
+WRITE_WORKERS = 4
+QUERY_RETRIES = 2  # 失敗後最多再試幾次
+RETRY_BACKOFF = 0.3  # 秒；第 n 次重試前等 RETRY_BACKOFF * 2**(n-1)
+
+READ_RETRY_ERRORS = (httpx.TransportError,)  # 含 TimeoutException、ConnectError、RemoteProtocolError
+WRITE_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)  # 請求尚未送出
+
+class QueryTimeout(Exception):
+    pass
+
+def query_workers(sessions=EXPECTED_SESSIONS):
+    return max(1, int(sessions)) * QUERY_FANOUT
+
+def pool_connections(sessions=EXPECTED_SESSIONS):
+    # 讀取與寫入的執行緒同時送出時都拿得到連線，不會在 httpx 連線池排隊 (PoolTimeout)
+    return query_workers(sessions) + WRITE_WORKERS
+
+def make_http_client(timeout=REQUEST_TIMEOUT, connections=pool_connections(), event_hooks=None):
+    return httpx.Client(timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+                        limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+                        follow_redirects=True, event_hooks=event_hooks)
+
+def with_retries(fn, retry_on=READ_RETRY_ERRORS, retries=QUERY_RETRIES, backoff=RETRY_BACKOFF):
+    for attempt in range(retries + 1):
+        try: return fn()
+        except retry_on:
+            if attempt == retries: raise
+            time.sleep(backoff * 2 ** attempt)
+
+class LazyClient:
+    # 第一次用到屬性時才呼叫 factory() 建立 client (例如 supabase.table(...))，頁首等不需要資料的元素可以先畫出來
+    def __init__(self, factory): self._factory = factory; self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None: self._client = self._factory()
+        return getattr(self._client, name)
+
+class QueryPool:
+    # capture_context()：在呼叫端執行緒取得環境 (例如 Streamlit 的 ScriptRunContext)，回傳在工作執行緒內套用它的函式
+    def __init__(self, workers=None, timeout=REQUEST_TIMEOUT * (QUERY_RETRIES + 1), capture_context=None, name="query"):
+        self.timeout = timeout; self.capture_context = capture_context
+        self.workers = workers or query_workers(); self.submitted = 0; self.timeouts = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        enter = self.capture_context() if self.capture_context else None
+        def run():
+            if enter: enter()
+            return fn(*args)
+        with self._lock: self.submitted += 1
+        return self._executor.submit(run)
+
+    def result(self, future, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        try: return future.result(timeout=timeout)
+        except FutureTimeout:
+            with self._lock: self.timeouts += 1
+            raise QueryTimeout(f"查詢逾時 (>{timeout:.1f} 秒)")
+
+    def gather(self, calls, timeout=None):
+        # calls: {名稱: 無參數函式}；全部同時送出，回傳 {名稱: 結果}。任一個失敗就丟出它的例外 (其餘照樣等完)
+        futures = {name: self.submit(fn) for name, fn in calls.items()}
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        results = {}; error = None
+        for name, future in futures.items():
+            try: results[name] = self.result(future, max(0, deadline - time.monotonic()))
+            except Exception as e: error = error or e
+        if error is not None: raise error
+        return results
+
+    def stats(self):
+        return {"workers": self.workers, "submitted": self.submitted, "timeouts": self.timeouts}
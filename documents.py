@@ -0,0 +1,117 @@
+import hashlib
+import importlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# 單據入口：快取、去重鍵與分派。PDF 在 pdf_report.py、Word 在 word_report.py，
+# 兩者都只在第一次真的要產生文件時才匯入，只借器材不下載單據的 session 不會載入 fpdf / python-docx。
+
+logger = logging.getLogger(__name__)
+
+def get_taiwan_time_str():
+    return (datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M')
+
+def get_taiwan_date_str():
+    return (datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d')
+
+# ==========================================
+# 單據快取 (按下下載才產生，同內容只產生一次)
+# ==========================================
+DOCUMENT_CACHE_BYTES = 64 * 1024 * 1024
+RENDERERS = {"create_pdf": "pdf_report", "create_pdf_bundle": "pdf_report", "create_word": "word_report", "create_word_zip": "word_report"}
+
+def category_label_rows(cart_data):
+    # 每個分類區塊只在中間那列印出分類名稱 (PDF 合併儲存格的效果)
+    text_map = {}
+    s_idx = 0; t_rows = len(cart_data)
+    for i in range(t_rows + 1):
+        if i == t_rows or cart_data[i]['category'] != cart_data[s_idx]['category']:
+            text_map[s_idx + (i - s_idx)//2] = cart_data[s_idx]['category']
+            s_idx = i
+    return text_map
+
+def document_key(kind, cart_data, meta, printed=None):
+    # 單據內容：印出的欄位 + 借用紀錄 id 與歸還狀態 (同樣的器材清單、不同的借用單不共用)；meta 為 {name, contact, b_date, r_date}。
+    # printed 只到日 (預設今天)：表頭的製表時間在產生當下蓋上、不進鍵，同一天重按下載直接取快取
+    rows = [[str(it['category']), str(it['uid']), str(it['name']), str(it['borrow_qty']), str(it.get('id', '')), bool(it.get('is_returned', False))]
+            for it in cart_data]
+    printed = printed or get_taiwan_date_str()
+    payload = json.dumps([kind, rows, {k: str(v) for k, v in meta.items()}, printed], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def renderer(name):
+    # 產生器在用到時才匯入 (fpdf / python-docx 的匯入時間不算進每個 session 的首次畫面)
+    return getattr(importlib.import_module(RENDERERS[name]), name)
+
+def build_document(kind, cart_data, meta):
+    name = meta.get('name', ''); contact = meta.get('contact', ''); b_date = meta.get('b_date', ''); r_date = meta.get('r_date', '')
+    if kind == 'pdf':
+        return bytes(renderer("create_pdf")(cart_data, category_label_rows(cart_data), name, contact, b_date, r_date))
+    return renderer("create_word")(cart_data, name, contact, b_date, r_date).getvalue()
+
+class DocumentCache:
+    # LRU，以總位元組數為上限；單份超過上限的文件照樣回傳但不留存
+    # timed(名稱, 函式)：可選的量測掛鉤 (例如 metrics.Metrics.call)，只包快取未命中時實際產生文件的那一次
+    # 同一份文件正在產生時，其他要求等它完成 (按鈕的 on_click 與下載請求幾乎同時到，只產生一次)
+    def __init__(self, max_bytes=DOCUMENT_CACHE_BYTES, timed=None):
+        self.max_bytes = max_bytes; self.bytes = 0; self.timed = timed
+        self.hits = 0; self.misses = 0; self.evictions = 0; self.failures = 0
+        self._docs = OrderedDict()  # key -> bytes
+        self._building = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+
+    def _build(self, name, builder):
+        return self.timed(name, builder) if self.timed else builder()
+
+    def get(self, key, builder):
+        while True:
+            with self._lock:
+                data = self._docs.get(key)
+                if data is not None:
+                    self._docs.move_to_end(key); self.hits += 1; return data
+                building = self._building.get(key)
+                if building is None:
+                    self._building[key] = done = threading.Event(); self.misses += 1; break
+            building.wait()  # 別人正在產生：等完再查一次 (對方失敗就自己重試，錯誤照樣拋給呼叫端)
+        # 產生文件不持鎖，避免一份大單據卡住其他人的下載
+        try:
+            data = builder()
+        except Exception:
+            with self._lock: self.failures += 1
+            logger.exception("產生單據失敗")
+            raise
+        else:
+            with self._lock:
+                if key not in self._docs and len(data) <= self.max_bytes:
+                    self._docs[key] = data; self.bytes += len(data)
+                    while self.bytes > self.max_bytes:
+                        _, old = self._docs.popitem(last=False); self.bytes -= len(old); self.evictions += 1
+            return data
+        finally:
+            with self._lock: self._building.pop(key, None)
+            done.set()
+
+    def loader(self, kind, cart_data, meta):
+        # 給 st.download_button(data=...) 用：點擊時才產生；鍵在產生當下才算，含製表日期 (跨日才換一份)
+        items = [dict(it) for it in cart_data]; meta = dict(meta)
+        name = "create_pdf" if kind == 'pdf' else "create_word"
+        return lambda: self.get(document_key(kind, items, meta), lambda: self._build(name, lambda: build_document(kind, items, meta)))
+
+    def bundle_loader(self, kind, sections):
+        # 全部借用人一次匯出：kind 為 'pdf' (合併一份) 或 'zip' (每人一份 DOCX)
+        sections = [(title, [dict(it) for it in cart_data], dict(meta)) for title, cart_data, meta in sections]
+        name = "create_pdf_bundle" if kind == 'pdf' else "create_word_zip"
+
+        def key():
+            printed = get_taiwan_date_str()
+            parts = [f"{title}:{document_key(kind, cart_data, meta, printed)}" for title, cart_data, meta in sections]
+            return hashlib.sha256(f"bundle:{kind}:{'|'.join(parts)}".encode('utf-8')).hexdigest()
+        return lambda: self.get(key(), lambda: self._build(name, lambda: renderer(name)(sections)))
+
+    def stats(self):
+        with self._lock:
+            return {"docs": len(self._docs), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "failures": self.failures}
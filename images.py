@@ -0,0 +1,65 @@
+import hashlib
+import io
+import logging
+import os
+
+from PIL import Image, ImageOps
+
+# ==========================================
+# 器材照片：內容雜湊檔名 + 縮圖
+# ==========================================
+# 原圖與縮圖都用內容雜湊當檔名，同一張照片永遠對應同一個網址，因此可以放心設一年的 cache-control。
+# 縮圖放在同一個 bucket 的 thumbs/ 底下，卡片與編輯視窗只載入縮圖。
+
+THUMB_SIZE = 400  # 最長邊 px
+THUMB_QUALITY = 80
+CACHE_CONTROL = "31536000"  # 秒 (一年)；檔名帶雜湊，內容不會變
+IMAGE_TYPES = ["jpg", "jpeg", "png", "webp"]  # 上傳元件接受的副檔名
+
+logger = logging.getLogger(__name__)
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+def original_path(data, filename):
+    ext = os.path.splitext(filename)[1].lower() or ".jpg"
+    return f"{content_hash(data)}{ext}"
+
+def thumbnail_path(data):
+    return f"thumbs/{content_hash(data)}_{THUMB_SIZE}.webp"
+
+def make_thumbnail(data, size=THUMB_SIZE):
+    # 依 EXIF 轉正 (手機照片常見)，縮到最長邊 size，輸出 WebP bytes
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        img.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO(); img.save(out, format="WEBP", quality=THUMB_QUALITY, method=4)
+        return out.getvalue()
+
+def _upload(bucket, path, data, content_type):
+    bucket.upload(path, data, file_options={"content-type": content_type, "cache-control": CACHE_CONTROL, "upsert": "true"})
+    return bucket.get_public_url(path)
+
+def upload_with_thumbnail(bucket, data, filename, content_type, pool=None):
+    # bucket: supabase.storage.from_(...)；回傳 (原圖網址, 縮圖網址)
+    # pool (data_access.QueryPool)：原圖上傳與縮圖產生 + 上傳同時進行
+    # 縮圖失敗 (不支援的格式等) 不影響原圖：縮圖網址為 None，卡片改顯示原圖
+    upload_original = lambda: _upload(bucket, original_path(data, filename), data, content_type)
+    def upload_thumb():
+        try: thumb = make_thumbnail(data)
+        except Exception as e: logger.warning("thumbnail failed for %s: %s", filename, e); return None
+        return _upload(bucket, thumbnail_path(data), thumb, "image/webp")
+    if pool is None: return upload_original(), upload_thumb()
+    res = pool.gather({"url": upload_original, "thumb_url": upload_thumb})
+    return res["url"], res["thumb_url"]
+
+def upload_thumbnail(bucket, data):
+    # 補建舊照片的縮圖 (原圖維持原檔名不動)
+    return _upload(bucket, thumbnail_path(data), make_thumbnail(data), "image/webp")
+
+def storage_path_from_url(url, bucket_name):
+    # 由 Supabase 公開網址取回 bucket 內的路徑；不是這個 bucket 的網址回傳 None
+    marker = f"/storage/v1/object/public/{bucket_name}/"
+    if not url or marker not in url: return None
+    return url.split(marker, 1)[1].split("?", 1)[0]
@@ -0,0 +1,370 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from availability import DEFAULT_LOAN_DAYS, ReservationIndex, to_epoch_seconds
+
+# ==========================================
+# 本機資料後端 (Supabase 替身)
+# ==========================================
+# 離線開發、CI 與壓力測試用：以 SQLite 實作 app 用到的那一小部分 supabase-py 介面
+# (table().select/insert/update/delete + eq/gt/or_/order/range/limit、rpc()、storage.from_())，
+# 資料表、檢視表與 RPC 的行為對照 supabase/migrations。
+# path=":memory:" 只存在這個程序；指定檔案路徑時多個程序可共用同一份資料 (WAL，寫入以 BEGIN IMMEDIATE 互斥，
+# 等同 RPC 裡的 for update)，壓力測試 (benchmarks/load_test.py) 就是這樣讓多個 session 搶同一批庫存。
+
+SCHEMA = """
+create table if not exists equipment (
+    id integer primary key autoincrement,
+    uid text not null unique,
+    name text, category text, status text default '在庫', location text,
+    quantity integer not null default 1, borrowed integer not null default 0,
+    image_url text, thumbnail_url text, updated_at text,
+    availability text generated always as (
+        case when status in ('維修中', '報廢') then status
+             when quantity - coalesce(borrowed, 0) <= 0 then '已借完'
+             when coalesce(borrowed, 0) > 0 then '部分'
+             else '足額' end) stored
+);
+create table if not exists borrow_records (
+    id integer primary key autoincrement,
+    equipment_uid text, equipment_name text, borrower_name text, contact_info text,
+    borrow_qty integer, is_returned integer not null default 0, borrow_date text, return_date text, due_date text,
+    counted integer not null default 1
+);
+create index if not exists borrow_records_active_idx on borrow_records (borrow_date desc) where is_returned = 0;
+create index if not exists borrow_records_history_idx on borrow_records (borrow_date desc, id desc);
+create index if not exists borrow_records_returned_idx on borrow_records (return_date) where is_returned = 1;
+create index if not exists borrow_records_active_uid_idx on borrow_records (equipment_uid, borrow_date) where is_returned = 0;
+create table if not exists borrow_records_archive (
+    id integer primary key,
+    equipment_uid text, equipment_name text, borrower_name text, contact_info text,
+    borrow_qty integer, is_returned integer not null default 0, borrow_date text, return_date text,
+    archived_at text, due_date text
+);
+create index if not exists borrow_records_archive_history_idx on borrow_records_archive (borrow_date desc, id desc);
+create view if not exists equipment_summary as
+    select category, availability, count(*) as item_count,
+           coalesce(sum(quantity), 0) as quantity, coalesce(sum(borrowed), 0) as borrowed
+    from equipment group by category, availability;
+create view if not exists active_borrow_records as
+    select b.*, coalesce(e.category, '其他') as category
+    from borrow_records b left join equipment e on e.uid = b.equipment_uid
+    where b.is_returned = 0;
+create view if not exists borrow_history as
+    select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, return_date, 0 as archived, due_date
+    from borrow_records
+    union all
+    select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, return_date, 1 as archived, due_date
+    from borrow_records_archive;
+"""
+TABLES = {"equipment", "borrow_records", "borrow_records_archive"}
+VIEWS = {"equipment_summary", "active_borrow_records", "borrow_history"}
+BOOL_COLUMNS = {"is_returned", "archived", "counted"}
+TOUCHED_TABLES = {"equipment"}  # 對照 touch_updated_at trigger：寫入時更新 updated_at
+_IDENT = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+class LocalAPIError(Exception):
+    # 對照 postgrest.APIError：app 讀 .message 判斷 insufficient_stock 等錯誤
+    def __init__(self, message):
+        super().__init__(message); self.message = message
+
+def now_iso():
+    # 固定帶微秒的 ISO 格式，字串比較即時間先後 (updated_at > since)
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+def _ident(name):
+    name = name.strip()
+    if not _IDENT.match(name): raise LocalAPIError(f"invalid identifier: {name!r}")
+    return name
+
+OR_COMPARISONS = {"eq": "=", "neq": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+def _split_or(expr):
+    # PostgREST or= 語法：以逗號分隔的 欄位.運算子.值；值可用雙引號包起來，引號內以反斜線跳脫
+    parts = []; buf = []; quoted = False; escaped = False
+    for ch in expr:
+        if escaped: buf.append(ch); escaped = False
+        elif quoted and ch == "\\": escaped = True
+        elif ch == '"': quoted = not quoted
+        elif ch == "," and not quoted: parts.append("".join(buf)); buf = []
+        else: buf.append(ch)
+    parts.append("".join(buf))
+    return [p.split(".", 2) for p in parts if p]
+
+class LocalResponse:
+    def __init__(self, data, count=None):
+        self.data = data; self.count = count
+
+class LocalQuery:
+    def __init__(self, backend, table):
+        if table not in TABLES | VIEWS: raise LocalAPIError(f"relation {table!r} does not exist")
+        self.backend = backend; self.table = table
+        self.op = "select"; self.columns = "*"; self.payload = None
+        self.where = []; self.params = []; self.orders = []; self.offset = None; self.limit_rows = None
+        self.count_mode = None; self.head = False
+
+    def select(self, columns="*", count=None, head=False):
+        self.columns = columns; self.count_mode = count; self.head = head; return self
+
+    def insert(self, data): self.op = "insert"; self.payload = data; return self
+    def update(self, data): self.op = "update"; self.payload = data; return self
+    def delete(self): self.op = "delete"; return self
+
+    def _filter(self, sql, *params): self.where.append(sql); self.params.extend(params); return self
+    def eq(self, col, value): return self._filter(f"{_ident(col)} = ?", value)
+    def neq(self, col, value): return self._filter(f"{_ident(col)} <> ?", value)
+    def gt(self, col, value): return self._filter(f"{_ident(col)} > ?", value)
+    def gte(self, col, value): return self._filter(f"{_ident(col)} >= ?", value)
+    def lt(self, col, value): return self._filter(f"{_ident(col)} < ?", value)
+    def lte(self, col, value): return self._filter(f"{_ident(col)} <= ?", value)
+    def in_(self, col, values):
+        values = list(values)
+        return self._filter(f"{_ident(col)} in ({', '.join('?' * len(values))})" if values else "0", *values)
+
+    def or_(self, expr):
+        clauses = []; params = []
+        for col, op, value in _split_or(expr):
+            if op in ("ilike", "like"):  # * 為萬用字元；值裡的 \% \_ \\ 是字面字元 (SQLite 的 LIKE 對 ASCII 不分大小寫)
+                clauses.append(f"{_ident(col)} like ? escape '\\'"); params.append(value.replace("*", "%"))
+            elif op in OR_COMPARISONS:  # view 的欄位沒有型別親和性，數字要以數字比較
+                clauses.append(f"{_ident(col)} {OR_COMPARISONS[op]} ?"); params.append(int(value) if re.fullmatch(r"-?\d+", value) else value)
+            else: raise LocalAPIError(f"unsupported or_ operator: {op}")
+        return self._filter("(" + " or ".join(clauses) + ")", *params)
+
+    def order(self, col, desc=False): self.orders.append(f"{_ident(col)} {'desc' if desc else 'asc'}"); return self
+    def range(self, start, end): self.offset = start; self.limit_rows = end - start + 1; return self
+    def limit(self, n): self.limit_rows = n; return self
+
+    def execute(self): return self.backend._run_query(self)
+
+class LocalBucket:
+    def __init__(self, backend, name): self.backend = backend; self.name = name
+
+    def upload(self, path, data, file_options=None):
+        self.backend._count(f"storage upload {self.name}")
+        with self.backend._lock: self.backend.objects[(self.name, path)] = bytes(data)
+        return LocalResponse({"Key": f"{self.name}/{path}"})
+
+    def download(self, path):
+        self.backend._count(f"storage download {self.name}")
+        try: return self.backend.objects[(self.name, path)]
+        except KeyError: raise LocalAPIError(f"object not found: {path}") from None
+
+    def get_public_url(self, path): return f"local://storage/{self.name}/{path}"
+
+class LocalStorage:
+    def __init__(self, backend): self.backend = backend
+    def from_(self, name): return LocalBucket(self.backend, name)
+
+class LocalRpc:
+    def __init__(self, backend, name, params): self.backend = backend; self.name = name; self.params = params
+    def execute(self): return self.backend._run_rpc(self.name, self.params)
+
+class LocalSupabase:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path=":memory:", latency=0.0):
+        # latency：每個請求額外等待的秒數 (模擬網路往返，在鎖外等待，不會讓其他請求排隊)
+        self.path = path; self.latency = latency
+        self.calls = Counter()  # "select equipment" / "rpc checkout_order" ... -> 次數
+        self.objects = {}  # (bucket, path) -> bytes；storage 只存在記憶體
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:": self._conn.execute("pragma journal_mode = wal")
+        self._conn.executescript(SCHEMA)
+        self.storage = LocalStorage(self)
+
+    @classmethod
+    def shared(cls, path=":memory:", latency=0.0):
+        # 每個程序每個 path 一個實例：app 的 init_connection 與壓力測試拿到同一份資料與同一組計數
+        with cls._shared_lock:
+            if path not in cls._shared: cls._shared[path] = cls(path, latency)
+            return cls._shared[path]
+
+    def table(self, name): return LocalQuery(self, name)
+    def rpc(self, name, params=None): return LocalRpc(self, name, params or {})
+
+    # --- 執行 ---
+    def _count(self, key):
+        with self._lock: self.calls[key] += 1
+        if self.latency: time.sleep(self.latency)
+
+    def _rows(self, cursor):
+        return [{k: (bool(r[k]) if k in BOOL_COLUMNS and r[k] is not None else r[k]) for k in r.keys()} for r in cursor.fetchall()]
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _run_query(self, q):
+        self._count(f"{q.op} {q.table}")
+        where = f" where {' and '.join(q.where)}" if q.where else ""
+        if q.op == "select":
+            cols = "*" if q.columns.strip() == "*" else ", ".join(_ident(c) for c in q.columns.split(","))
+            sql = f"select {cols} from {q.table}{where}"
+            if q.orders: sql += " order by " + ", ".join(q.orders)
+            if q.limit_rows is not None: sql += f" limit {int(q.limit_rows)}"
+            if q.offset: sql += f" offset {int(q.offset)}" if q.limit_rows is not None else f" limit -1 offset {int(q.offset)}"
+            with self._lock:
+                count = self._conn.execute(f"select count(*) from {q.table}{where}", q.params).fetchone()[0] if q.count_mode else None
+                data = [] if q.head else self._rows(self._conn.execute(sql, q.params))
+            return LocalResponse(data, count)
+        if q.table not in TABLES: raise LocalAPIError(f"cannot {q.op} view {q.table}")
+        with self._transaction() as conn:
+            if q.op == "insert":
+                rows = q.payload if isinstance(q.payload, list) else [q.payload]
+                out = []
+                for row in rows:
+                    row = {**row, "updated_at": now_iso()} if q.table in TOUCHED_TABLES else dict(row)
+                    cols = [_ident(c) for c in row]
+                    cur = conn.execute(f"insert into {q.table} ({', '.join(cols)}) values ({', '.join('?' * len(cols))}) returning *", list(row.values()))
+                    out.extend(self._rows(cur))
+                return LocalResponse(out)
+            if q.op == "update":
+                row = {**q.payload, "updated_at": now_iso()} if q.table in TOUCHED_TABLES else dict(q.payload)
+                sets = ", ".join(f"{_ident(c)} = ?" for c in row)
+                return LocalResponse(self._rows(conn.execute(f"update {q.table} set {sets}{where} returning *", list(row.values()) + q.params)))
+            return LocalResponse(self._rows(conn.execute(f"delete from {q.table}{where} returning *", q.params)))
+
+    def _run_rpc(self, name, params):
+        self._count(f"rpc {name}")
+        fn = getattr(self, f"_rpc_{name}", None)
+        if fn is None: raise LocalAPIError(f"function {name} does not exist")
+        with self._transaction() as conn: return LocalResponse(fn(conn, **params))
+
+    # --- RPC (對照 supabase/migrations 的同名函式) ---
+    def _rpc_checkout_order(self, conn, p_borrower, p_contact, p_borrow_date, p_items, p_due_date=None):
+        # 期間檢查與 migration 相同，規則由 availability 的時段索引計算
+        due = p_due_date or (datetime.fromisoformat(p_borrow_date) + timedelta(days=DEFAULT_LOAN_DAYS)).isoformat()
+        start, end = to_epoch_seconds([p_borrow_date, due])
+        if end <= start: raise LocalAPIError("invalid period")
+        order = Counter()
+        for it in p_items: order[it["uid"]] += int(it["qty"])
+        if any(q <= 0 for q in order.values()): raise LocalAPIError("invalid quantity")
+        uids = sorted(order); marks = ', '.join('?' * len(uids))
+        stock = {r["uid"]: r for r in conn.execute(f"select * from equipment where uid in ({marks})", uids)}
+        booked = ReservationIndex.from_records(self._rows(conn.execute(
+            f"select equipment_uid, borrow_qty, borrow_date, due_date from borrow_records where is_returned = 0 and equipment_uid in ({marks})", uids)))
+        short = booked.shortages(order, {u: r["quantity"] for u, r in stock.items()}, start, end, {u: r["status"] for u, r in stock.items()})
+        if short: raise LocalAPIError(f"insufficient_stock: {','.join(short)}")
+        out = []; now = now_iso(); counted = start <= time.time()  # 未來的預約等借出時間到了才計入 borrowed
+        for u in uids:
+            if counted: conn.execute("update equipment set borrowed = coalesce(borrowed, 0) + ?, updated_at = ? where uid = ?", (order[u], now, u))
+            cur = conn.execute("insert into borrow_records (equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, due_date, counted) values (?, ?, ?, ?, ?, 0, ?, ?, ?) returning *",
+                               (u, stock[u]["name"], p_borrower, p_contact, order[u], p_borrow_date, due, int(counted)))
+            out.extend(self._rows(cur))
+        return out
+
+    def _rpc_return_borrow_records(self, conn, p_items):
+        out = []; released = Counter(); now = now_iso(); seen = set()
+        for it in p_items:
+            rid = int(it["record_id"])
+            if rid in seen: continue  # 同一筆紀錄只處理第一次出現
+            seen.add(rid)
+            closed = conn.execute("update borrow_records set is_returned = 1, return_date = ? where id = ? and equipment_uid = ? and borrow_qty = ? and is_returned = 0 returning counted",
+                                  (now, rid, it["uid"], int(it["qty"]))).fetchone()
+            if closed is not None:
+                if closed["counted"]: released[it["uid"]] += int(it["qty"])  # 尚未開始的預約沒計入 borrowed
+                out.append({"record_id": rid, "ok": True, "reason": None}); continue
+            b = conn.execute("select is_returned from borrow_records where id = ?", (rid,)).fetchone()
+            out.append({"record_id": rid, "ok": False, "reason": "not_found" if b is None else ("already_returned" if b["is_returned"] else "mismatch")})
+        for uid, qty in released.items():
+            conn.execute("update equipment set borrowed = max(0, coalesce(borrowed, 0) - ?), updated_at = ? where uid = ?", (qty, now, uid))
+        return out
+
+    def _rpc_start_due_borrows(self, conn):
+        # 借出時間已到、尚未計入 borrowed 的預約補計入；回傳補上的筆數
+        due = self._rows(conn.execute("select id, equipment_uid, borrow_qty, borrow_date from borrow_records where is_returned = 0 and counted = 0"))
+        due = [r for r, t in zip(due, to_epoch_seconds(r["borrow_date"] for r in due)) if 0 <= t <= time.time()]
+        started = Counter(); now = now_iso()
+        for r in due:
+            conn.execute("update borrow_records set counted = 1 where id = ?", (r["id"],)); started[r["equipment_uid"]] += int(r["borrow_qty"])
+        for uid, qty in started.items():
+            conn.execute("update equipment set borrowed = coalesce(borrowed, 0) + ?, updated_at = ? where uid = ?", (qty, now, uid))
+        return len(due)
+
+    def _rpc_import_equipment(self, conn, p_rows):
+        out = []; now = now_iso()
+        for r in p_rows:
+            existing = conn.execute("select borrowed from equipment where uid = ?", (r["uid"],)).fetchone()
+            if existing is None:
+                conn.execute("insert into equipment (uid, name, category, status, location, quantity, borrowed, updated_at) values (?, ?, ?, ?, ?, ?, 0, ?)",
+                             (r["uid"], r["name"], r["category"], r["status"], r["location"], int(r["quantity"]), now))
+                out.append({"equipment_uid": r["uid"], "action": "inserted"})
+            elif (existing["borrowed"] or 0) > int(r["quantity"]):
+                out.append({"equipment_uid": r["uid"], "action": "quantity_below_borrowed"})
+            else:
+                conn.execute("update equipment set name = ?, category = ?, status = ?, location = ?, quantity = ?, updated_at = ? where uid = ?",
+                             (r["name"], r["category"], r["status"], r["location"], int(r["quantity"]), now, r["uid"]))
+                out.append({"equipment_uid": r["uid"], "action": "updated"})
+        return out
+
+    def _rpc_archive_borrow_records(self, conn, p_before, p_limit=5000):
+        ids = [r["id"] for r in conn.execute("select id from borrow_records where is_returned = 1 and return_date < ? order by return_date limit ?", (p_before, int(p_limit)))]
+        if not ids: return 0
+        marks = ", ".join("?" * len(ids))
+        cols = "id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, return_date, due_date"
+        conn.execute(f"insert into borrow_records_archive ({cols}, archived_at) select {cols}, ? from borrow_records where id in ({marks})", [now_iso(), *ids])
+        conn.execute(f"delete from borrow_records where id in ({marks})", ids)
+        return len(ids)
+
+    def _rpc_active_reservations(self, conn):
+        rows = conn.execute("select id, equipment_uid, borrow_qty, borrow_date, due_date from borrow_records where is_returned = 0 order by id").fetchall()
+        return {"id": [r[0] for r in rows], "uid": [r[1] for r in rows], "qty": [r[2] for r in rows],
+                "start": to_epoch_seconds([r[3] for r in rows]).tolist(), "due": to_epoch_seconds([r[4] for r in rows]).tolist()}
+
+    def _rpc_borrow_usage_stats(self, conn, p_borrower=None, p_uid=None, p_from=None, p_to=None, p_limit=50):
+        return self._rows(conn.execute("""
+            select equipment_uid, max(equipment_name) as equipment_name, count(*) as borrow_count, sum(borrow_qty) as total_qty,
+                   count(distinct borrower_name) as borrower_count,
+                   coalesce(sum(case when is_returned = 0 then borrow_qty end), 0) as active_qty,
+                   round(avg(case when is_returned = 1 then julianday(return_date) - julianday(borrow_date) end), 1) as avg_days,
+                   max(borrow_date) as last_borrowed
+            from borrow_history
+            where (:b is null or borrower_name = :b) and (:u is null or equipment_uid = :u)
+              and (:f is null or borrow_date >= :f) and (:t is null or borrow_date < :t)
+            group by equipment_uid
+            order by count(*) desc, equipment_uid
+            limit :n""", {"b": p_borrower, "u": p_uid, "f": p_from, "t": p_to, "n": int(p_limit)}))
+
+    # --- 測試輔助 ---
+    def seed_equipment(self, n, categories=("手工具", "一般器材", "廚具", "清潔用品", "文具用品", "其他"), max_quantity=3):
+        # 空資料庫才填：n 筆器材，數量 1..max_quantity 循環 (數量少，搶借時容易撞到庫存上限)
+        with self._transaction() as conn:
+            if conn.execute("select count(*) from equipment").fetchone()[0]: return
+            now = now_iso()
+            conn.executemany("insert into equipment (uid, name, category, status, location, quantity, borrowed, updated_at) values (?, ?, ?, '在庫', ?, ?, 0, ?)",
+                             [(f"T{i:04d}", f"測試器材 {i}", categories[i % len(categories)], f"櫃 {i % 10}", i % max_quantity + 1, now) for i in range(n)])
+
+    def stock_violations(self):
+        # 超借檢查：任何時刻被佔用的數量超過總數 (peak)，或 borrowed 小於 0、大於總數、與已計入的未歸還紀錄合計對不上。
+        # borrowed 只含借出時間已到的紀錄 (未來預約由 start_due_borrows 到時才計入)
+        with self._lock:
+            rows = self._rows(self._conn.execute("""
+                select e.uid, e.quantity, e.borrowed, coalesce(a.qty, 0) as active_qty
+                from equipment e
+                left join (select equipment_uid, sum(borrow_qty) as qty from borrow_records where is_returned = 0 and counted = 1 group by 1) a
+                    on a.equipment_uid = e.uid"""))
+            active = self._rows(self._conn.execute("select equipment_uid, borrow_qty, borrow_date, due_date from borrow_records where is_returned = 0"))
+        peak = ReservationIndex.from_records(active).booked(0, 2**32 - 1)
+        for r in rows: r["peak"] = int(peak.get(r["uid"], 0))
+        return [r for r in rows if r["peak"] > r["quantity"] or r["borrowed"] < 0 or r["borrowed"] > r["quantity"] or r["borrowed"] != r["active_qty"]]
+
+class _Transaction:
+    # 寫入一律 BEGIN IMMEDIATE：同一個資料庫檔案同時只有一個寫入交易 (跨程序也一樣)，檢查庫存到扣減之間不會被插隊
+    def __init__(self, backend): self.backend = backend
+
+    def __enter__(self):
+        self.backend._lock.acquire()
+        try: self.backend._conn.execute("begin immediate")
+        except BaseException: self.backend._lock.release(); raise
+        return self.backend._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try: self.backend._conn.execute("commit" if exc_type is None else "rollback")
+        finally: self.backend._lock.release()
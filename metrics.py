@@ -0,0 +1,167 @@
+import functools
+import io
+import json
+import logging
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==========================================
+# 觀測：每次 rerun 的耗時與各呼叫的次數 / 延遲 / 資料量
+# ==========================================
+# 資料函式與文件產生器用 Metrics.timed() 包起來，Supabase 的每個 HTTP 請求由 httpx event hook 記錄；
+# 同一筆紀錄同時累加到「整個程序」與「目前這次 rerun」(以 run_key() 區分，例如 Streamlit 的 session id)。
+# 匯出：Prometheus 文字格式 (prometheus_text / serve_prometheus)，或每次 rerun 結束時寫一行 JSON log。
+
+RECENT_RUNS = 50
+RUN_OUTCOMES = {"RerunException": "rerun", "StopException": "stop"}  # Streamlit 以例外結束 script 的兩種正常情況
+
+logger = logging.getLogger(__name__)
+
+def payload_size(result):
+    # 回傳 (列數, 位元組數)；(df, 總筆數) 之類的 tuple 看第一個元素，不認得的型別記 0
+    if isinstance(result, tuple) and result: result = result[0]
+    if isinstance(result, (bytes, bytearray)): return 0, len(result)
+    if isinstance(result, io.BytesIO): return 0, result.getbuffer().nbytes
+    if hasattr(result, "__len__") and not isinstance(result, (str, dict)): return len(result), 0
+    return 0, 0
+
+def http_call_name(request):
+    # /rest/v1/equipment -> "GET equipment"，/rest/v1/rpc/checkout_items -> "POST rpc/checkout_items"
+    parts = request.url.path.strip("/").split("/")
+    if parts[:2] == ["rest", "v1"]: return f"{request.method} {'/'.join(parts[2:4])}"
+    return f"{request.method} {'/'.join(parts[:3])}"
+
+class CallStats:
+    __slots__ = ("calls", "errors", "seconds", "max_seconds", "rows", "bytes")
+
+    def __init__(self):
+        self.calls = 0; self.errors = 0; self.seconds = 0.0; self.max_seconds = 0.0; self.rows = 0; self.bytes = 0
+
+    def add(self, seconds, rows=0, nbytes=0, error=False):
+        self.calls += 1; self.errors += int(error); self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds); self.rows += rows; self.bytes += nbytes
+
+    def as_dict(self): return {k: getattr(self, k) for k in self.__slots__}
+
+class RunStats:
+    def __init__(self, key, trigger):
+        self.key = key; self.trigger = trigger; self.started = time.time()
+        self.seconds = None; self.outcome = None; self.calls = {}  # 名稱 -> CallStats
+        self._t0 = time.perf_counter()
+
+    def as_dict(self):
+        return {"session": self.key, "trigger": self.trigger, "started": self.started, "seconds": self.seconds,
+                "outcome": self.outcome, "calls": {n: c.as_dict() for n, c in self.calls.items()}}
+
+class Metrics:
+    def __init__(self, run_key=None, recent_runs=RECENT_RUNS, log_runs=False):
+        self.run_key = run_key or (lambda: None); self.log_runs = log_runs
+        self.totals = {}  # 名稱 -> CallStats (程序啟動以來)
+        self.outcomes = Counter(); self.run_seconds = 0.0
+        self.recent = deque(maxlen=recent_runs)  # 已結束的 RunStats
+        self._open = {}  # run_key -> 進行中的 RunStats
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, rows=0, nbytes=0, error=False):
+        key = self.run_key()
+        with self._lock:
+            self.totals.setdefault(name, CallStats()).add(seconds, rows, nbytes, error)
+            run = self._open.get(key)
+            if run is not None: run.calls.setdefault(name, CallStats()).add(seconds, rows, nbytes, error)
+
+    def call(self, name, fn, *args, size=payload_size, **kwargs):
+        t0 = time.perf_counter()
+        try: result = fn(*args, **kwargs)
+        except Exception: self.record(name, time.perf_counter() - t0, error=True); raise
+        rows, nbytes = size(result) if size else (0, 0)
+        self.record(name, time.perf_counter() - t0, rows, nbytes)
+        return result
+
+    def timed(self, name=None, size=payload_size):
+        def wrap(fn):
+            label = name or fn.__name__
+            @functools.wraps(fn)
+            def inner(*args, **kwargs): return self.call(label, fn, *args, size=size, **kwargs)
+            return inner
+        return wrap
+
+    @contextmanager
+    def span(self, name):
+        # 量一段程式 (例如卡片渲染、pandas 篩選)，不記資料量
+        t0 = time.perf_counter(); error = False
+        try: yield
+        except Exception: error = True; raise
+        finally: self.record(name, time.perf_counter() - t0, error=error)
+
+    @contextmanager
+    def run(self, trigger=""):
+        # 包住一次 script 執行；st.rerun() / st.stop() 以例外離開，記為 rerun / stop 而不是 error
+        key = self.run_key(); run = RunStats(key, trigger)
+        with self._lock: self._open[key] = run
+        try:
+            yield run
+            run.outcome = "ok"
+        except BaseException as e:
+            run.outcome = RUN_OUTCOMES.get(type(e).__name__, "error"); raise
+        finally:
+            run.seconds = time.perf_counter() - run._t0
+            with self._lock:
+                if self._open.get(key) is run: del self._open[key]
+                self.recent.append(run); self.outcomes[run.outcome] += 1; self.run_seconds += run.seconds
+            if self.log_runs: logger.info(json.dumps(run.as_dict(), ensure_ascii=False))
+
+    def http_hooks(self):
+        # 給 httpx.Client(event_hooks=...)：每個 Supabase 請求記一筆，資料量為回應本文的位元組數
+        def on_request(request): request.extensions["metrics_t0"] = time.perf_counter()
+        def on_response(response):
+            response.read()
+            t0 = response.request.extensions.get("metrics_t0")
+            self.record(f"http {http_call_name(response.request)}", time.perf_counter() - t0 if t0 else 0.0,
+                        nbytes=len(response.content), error=response.status_code >= 400)
+        return {"request": [on_request], "response": [on_response]}
+
+    def last_run(self, key):
+        with self._lock: return next((r for r in reversed(self.recent) if r.key == key), None)
+
+    def snapshot(self):
+        with self._lock:
+            return {"totals": {n: c.as_dict() for n, c in self.totals.items()}, "runs": dict(self.outcomes),
+                    "run_seconds": self.run_seconds, "recent": [r.as_dict() for r in self.recent]}
+
+    def prometheus_text(self, prefix="app"):
+        snap = self.snapshot(); lines = []
+        def label(v): return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        def family(name, kind, help_text, samples):
+            lines.extend([f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} {kind}"])
+            lines.extend(f'{prefix}_{name}{{{key}="{label(v)}"}} {value}' for key, v, value in samples)
+        totals = sorted(snap["totals"].items())
+        family("calls_total", "counter", "Instrumented calls", [("name", n, c["calls"]) for n, c in totals])
+        family("call_errors_total", "counter", "Instrumented calls that raised", [("name", n, c["errors"]) for n, c in totals])
+        family("call_seconds_total", "counter", "Time spent in instrumented calls", [("name", n, f"{c['seconds']:.6f}") for n, c in totals])
+        family("call_max_seconds", "gauge", "Slowest single call", [("name", n, f"{c['max_seconds']:.6f}") for n, c in totals])
+        family("payload_rows_total", "counter", "Rows returned", [("name", n, c["rows"]) for n, c in totals])
+        family("payload_bytes_total", "counter", "Bytes returned or generated", [("name", n, c["bytes"]) for n, c in totals])
+        family("script_runs_total", "counter", "Script runs by outcome", [("outcome", o, n) for o, n in sorted(snap["runs"].items())])
+        lines.extend([f"# HELP {prefix}_script_run_seconds_total Time spent in script runs", f"# TYPE {prefix}_script_run_seconds_total counter",
+                      f"{prefix}_script_run_seconds_total {snap['run_seconds']:.6f}"])
+        return "\n".join(lines) + "\n"
+
+def serve_prometheus(metrics, port, host="0.0.0.0"):
+    # 另開一個小 HTTP 伺服器提供 GET /metrics (Streamlit 本身無法加自訂路由)
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics": self.send_error(404); return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body))); self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,147 @@
+import copy
+import io
+import os
+import pickle
+import threading
+
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap
+from fontTools import ttLib
+
+from documents import category_label_rows, get_taiwan_time_str
+
+# 借用 / 清點單 PDF (fpdf2)。由 documents.renderer() 在第一次產生 PDF 時才匯入
+FONT_FILE = "TaipeiSansTCBeta-Regular.ttf"
+
+# ==========================================
+# 中文字型快取
+# ==========================================
+# 解析 CJK 字型 (字寬表、cmap、glyph 名稱) 是產生 PDF 最貴的一步，每個程序只做一次。
+# 每份 PDF 拿到共用解析結果的淺拷貝，只有 subset (這份文件用到的字) 與 fontTools 物件是自己的：
+# fpdf2 輸出時會就地裁切 ttfont，所以不能共用；改存一份已解碼好的 ttfont pickle，每份文件還原一份。
+FONT_FAMILY = 'ChineseFont'
+_PRELOAD_TABLES = ['head', 'hhea', 'maxp', 'OS/2', 'hmtx', 'loca', 'post', 'name', 'cmap']
+_font_cache = None  # (TTFFont 範本, 解碼後 ttfont 的 pickle)；找不到字型為 (None, None)
+_font_lock = threading.Lock()
+
+def get_cjk_font():
+    global _font_cache
+    with _font_lock:
+        if _font_cache is None:
+            _font_cache = (None, None)
+            if os.path.exists(FONT_FILE):
+                try:
+                    loader = FPDF(); loader.add_font(FONT_FAMILY, '', FONT_FILE)
+                    with open(FONT_FILE, 'rb') as f:
+                        ttfont = ttLib.TTFont(io.BytesIO(f.read()), recalcTimestamp=False, recalcBBoxes=False, lazy=True)
+                    for tag in _PRELOAD_TABLES: ttfont[tag]
+                    ttfont.getGlyphOrder(); ttfont['cmap'].getBestCmap()
+                    _font_cache = (loader.fonts[FONT_FAMILY.lower()], pickle.dumps(ttfont, protocol=pickle.HIGHEST_PROTOCOL))
+                except Exception: pass
+        return _font_cache
+
+def attach_cjk_font(pdf):
+    # 把快取的中文字型掛到這份 PDF 上；沒有字型檔時回傳 False (呼叫端改用 Helvetica)
+    template, ttfont_blob = get_cjk_font()
+    if template is None: return False
+    # 淺拷貝後重設的是 TTFFont 每份文件各自累積的私有欄位，依 fpdf2 2.8.9 的實作 (requirements.txt 固定此版本，升級時需重新核對)
+    font = copy.copy(template)
+    font.i = len(pdf.fonts) + 1
+    font.ttfont = pickle.loads(ttfont_blob)
+    font.subset = SubsetMap(font); font.missing_glyphs = []; font.biggest_size_pt = 0; font._hbfont = None
+    pdf.fonts[template.fontkey] = font
+    return True
+
+# ==========================================
+# PDF 生成模組
+# ==========================================
+class PDFReport(FPDF):
+    def __init__(self):
+        super().__init__(orientation='L', unit='mm', format='A4')
+        self.set_auto_page_break(auto=False) 
+        self.has_cjk_font = attach_cjk_font(self)
+    
+    def set_meta_info(self, borrower, contact, b_date, r_date):
+        self.meta_borrower = borrower
+        self.meta_contact = contact
+        self.meta_b_date = b_date
+        self.meta_r_date = r_date
+
+    def header(self):
+        if self.has_cjk_font: self.set_font(FONT_FAMILY, '', 12)
+        else: self.set_font("Helvetica", size=12)
+        
+        self.set_font_size(24); self.cell(0, 15, txt="團隊器材借用 / 清點單", ln=1, align='C')
+        self.set_font_size(10); self.cell(0, 8, txt=f"製表日期: {get_taiwan_time_str()}", ln=1, align='R')
+        
+        if hasattr(self, 'meta_borrower'):
+            self.set_font_size(12)
+            info_text = f"借用人：{self.meta_borrower}   |   聯絡方式：{self.meta_contact}   |   租借期間：{self.meta_b_date} 至 {self.meta_r_date}"
+            self.cell(0, 8, txt=info_text, ln=1, align='L')
+        
+        self.line(10, self.get_y(), 287, self.get_y()); self.ln(2)
+        
+        self.set_font_size(12); self.set_fill_color(232, 139, 0); self.set_text_color(255, 255, 255); self.set_line_width(0.3)
+        headers = ["分類項目", "編號", "器材名稱", "借用數量", "營前清點", "離營清點", "營後清點"]
+        col_w = [35, 30, 80, 20, 37, 37, 37] 
+        for i, h in enumerate(headers): self.cell(col_w[i], 10, h, border=1, align='C', fill=True)
+        self.ln(); self.set_text_color(0, 0, 0) 
+
+    # 表格列用 rect/line + text() 直接畫：cell() 每格都要跑完整的文字排版，是大表格的主要成本
+    def table_cell(self, w, h, txt="", border='LTRB', fill=False):
+        x, y = self.get_x(), self.get_y()
+        if fill: self.rect(x, y, w, h, style='F')
+        if border == 'LTRB': self.rect(x, y, w, h)
+        else:
+            if 'L' in border: self.line(x, y, x, y + h)
+            if 'R' in border: self.line(x + w, y, x + w, y + h)
+            if 'T' in border: self.line(x, y, x + w, y)
+            if 'B' in border: self.line(x, y + h, x + w, y + h)
+        if txt: self.text(x + (w - self.get_string_width(txt)) / 2, y + h / 2 + 0.3 * self.font_size, txt)
+        self.set_x(x + w)
+
+    def footer(self):
+        self.set_y(-25)
+        if self.has_cjk_font: self.set_font(FONT_FAMILY, '', 12)
+        self.cell(90, 10, "器材負責人：__________________", align='L')
+        self.cell(90, 10, "活動負責人：__________________", align='C')
+        self.cell(90, 10, "指導老師：__________________", align='R')
+
+def add_checklist_pages(pdf, cart_data, text_display_map, borrower, contact, b_date, r_date, bookmark=None):
+    # 一位借用人的清點表 (從新的一頁開始)；同一份 PDF 可連續呼叫，字型只載入一次
+    pdf.set_meta_info(borrower, contact, str(b_date), str(r_date))
+    pdf.add_page()
+    if bookmark: pdf.start_section(bookmark)
+    
+    if pdf.has_cjk_font: pdf.set_font(FONT_FAMILY, '', 11)
+    else: pdf.set_font("Helvetica", size=11)
+    col_w = [35, 30, 80, 20, 37, 37, 37] 
+    total_rows = len(cart_data); fill = False; pdf.set_fill_color(245, 245, 245)
+    for i in range(total_rows):
+        if pdf.get_y() > 170: pdf.add_page(); force_new = True 
+        else: force_new = False
+        item = cart_data[i]; cat = item['category']
+        draw_top = (i == 0 or cart_data[i-1]['category'] != cat or force_new)
+        draw_bottom = (i == total_rows - 1 or cart_data[i+1]['category'] != cat or (pdf.get_y() + 10 > 170))
+        cat_border = 'LR' + ('T' if draw_top else '') + ('B' if draw_bottom else '')
+        cat_disp = cat if (text_display_map.get(i) or force_new) else ""
+        pdf.table_cell(col_w[0], 10, cat_disp, border=cat_border)
+        pdf.table_cell(col_w[1], 10, str(item['uid']), fill=fill)
+        name = str(item['name']); 
+        if pdf.get_string_width(name) > col_w[2]-2: name = name[:14]+"..."
+        pdf.table_cell(col_w[2], 10, name, fill=fill)
+        pdf.table_cell(col_w[3], 10, str(item['borrow_qty']), fill=fill)
+        for _ in range(3): pdf.table_cell(col_w[4], 10, fill=fill)
+        pdf.ln(10); fill = not fill 
+
+def create_pdf(cart_data, text_display_map, borrower, contact, b_date, r_date):
+    pdf = PDFReport()
+    add_checklist_pages(pdf, cart_data, text_display_map, borrower, contact, b_date, r_date)
+    return pdf.output()
+
+def create_pdf_bundle(sections):
+    # sections: [(檔名, cart_data, meta)]；全部借用人合併成一份 PDF，每人一個書籤
+    pdf = PDFReport()
+    for title, cart_data, meta in sections:
+        add_checklist_pages(pdf, cart_data, category_label_rows(cart_data), meta.get('name', ''), meta.get('contact', ''), meta.get('b_date', ''), meta.get('r_date', ''), bookmark=title)
+    return bytes(pdf.output())
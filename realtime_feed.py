@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import threading
+
+# ==========================================
+# Realtime 庫存推播
+# ==========================================
+# 背景執行緒跑自己的 asyncio loop，訂閱 Supabase Realtime 的 postgres_changes (資料表需在 supabase_realtime publication 內)。
+# 每筆異動交給 on_change(table, event, record, old_record)；連線狀態交給 on_live(bool)。
+# 斷線時 on_live(False)，指數退避後重連；重新訂閱成功時 on_live(True)，呼叫端應視為中間可能漏接而整批作廢快取。
+# realtime 套件 (約 0.2 秒) 在背景執行緒裡才匯入，不佔用第一次 script 執行的時間。
+
+FEED_TABLES = ("equipment", "borrow_records")  # borrow_records：未來的預約不會動到 equipment，期間索引靠它更新
+RECONNECT_MAX_SECONDS = 60
+HEALTH_CHECK_SECONDS = 2
+
+logger = logging.getLogger(__name__)
+
+def _connection_alive(client):
+    # auto_reconnect 關閉時 client 不會清掉斷掉的連線，改看接收迴圈 (_listen_task) 是否已結束
+    task = getattr(client, "_listen_task", None)
+    return client.is_connected and not (task is not None and task.done())
+
+class InventoryFeed:
+    def __init__(self, url, key, on_change, on_live, tables=FEED_TABLES):
+        self.endpoint = f"{url.rstrip('/')}/realtime/v1"; self.key = key
+        self.on_change = on_change; self.on_live = on_live; self.tables = tables
+        self.live = False; self.events = 0; self.reconnects = 0; self.last_error = None
+        self._thread = None; self._channel_failed = False; self._subscribed = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="inventory-feed", daemon=True)
+            self._thread.start()
+        return self
+
+    def _set_live(self, live):
+        if live != self.live:
+            self.live = live; self.on_live(live)
+
+    def _dispatch(self, payload):
+        data = payload.get("data", {})
+        self.events += 1
+        try: self.on_change(data.get("table"), data.get("type"), data.get("record"), data.get("old_record") or {})
+        except Exception as e: logger.exception("inventory feed callback failed: %s", e)
+
+    def _on_status(self, status, err):
+        if status == self._subscribed: self._set_live(True)
+        else:
+            if err: self.last_error = str(err)
+            self._channel_failed = True; self._set_live(False)
+
+    async def _run(self):
+        from realtime import AsyncRealtimeClient, RealtimeSubscribeStates
+        self._subscribed = RealtimeSubscribeStates.SUBSCRIBED
+        backoff = 1
+        while True:
+            client = None; self._channel_failed = False
+            try:
+                client = AsyncRealtimeClient(self.endpoint, self.key, auto_reconnect=False)
+                await client.connect()
+                channel = client.channel("inventory-feed")
+                for table in self.tables:
+                    channel.on_postgres_changes("*", callback=self._dispatch, table=table, schema="public")
+                await channel.subscribe(self._on_status)
+                while _connection_alive(client) and not self._channel_failed:
+                    if self.live: backoff = 1
+                    await asyncio.sleep(HEALTH_CHECK_SECONDS)
+            except Exception as e:
+                self.last_error = str(e); logger.warning("inventory feed disconnected: %s", e)
+            finally:
+                self._set_live(False)
+                try:
+                    if client is not None: await client.close()
+                except Exception: pass
+            self.reconnects += 1
+            await asyncio.sleep(backoff); backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+
+    def stats(self):
+        return {"live": self.live, "events": self.events, "reconnects": self.reconnects, "last_error": self.last_error}
@@ -0,0 +1,51 @@
+"""把歸還已久的借用紀錄搬到 borrow_records_archive，讓 borrow_records 維持小而快。
+
+每批呼叫一次 archive_borrow_records RPC (刪除與寫入歸檔在同一個交易)，重複到沒有可搬的紀錄為止；
+中途中斷再跑一次即可接續。歷史頁與使用統計讀 borrow_history 檢視表，歸檔後照樣查得到。
+連線設定沿用 .streamlit/secrets.toml 的 [SUPABASE] 區段 (URL / KEY)；--local 改用本機 SQLite 資料庫 (local_backend)。
+
+用法：python scripts/archive_borrow_records.py [--days 180] [--batch 5000] [--dry-run] [--local 路徑]
+"""
+import argparse
+import os
+import sys
+import tomllib
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+
+def connect(local_path):
+    if local_path:
+        from local_backend import LocalSupabase
+        return LocalSupabase(local_path)
+    from supabase import create_client
+    with open(SECRETS_FILE, "rb") as f: cfg = tomllib.load(f)["SUPABASE"]
+    return create_client(cfg["URL"], cfg["KEY"])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=180, help="歸還超過幾天的紀錄才歸檔")
+    parser.add_argument("--batch", type=int, default=5000, help="每次 RPC 最多搬幾筆")
+    parser.add_argument("--dry-run", action="store_true", help="只計算符合條件的筆數，不搬移")
+    parser.add_argument("--local", default=None, help="本機 SQLite 資料庫路徑 (DATA_BACKEND=local 用的 LOCAL_DB)")
+    args = parser.parse_args()
+
+    client = connect(args.local)
+    before = (datetime.now(timezone.utc) - timedelta(days=args.days)).isoformat()
+    if args.dry_run:
+        res = client.table("borrow_records").select("id", count="exact", head=True).eq("is_returned", True).lt("return_date", before).execute()
+        print(f"{res.count or 0} 筆歸還早於 {before[:10]} 的紀錄可歸檔"); return 0
+
+    total = 0
+    while True:
+        moved = client.rpc("archive_borrow_records", {"p_before": before, "p_limit": args.batch}).execute().data or 0
+        total += moved
+        if moved: print(f"  已搬 {total} 筆")
+        if moved < args.batch: break
+    print(f"完成：歸檔 {total} 筆 (歸還早於 {before[:10]})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""為已上傳、還沒有縮圖的器材照片補建縮圖，並寫回 equipment.thumbnail_url。
+
+連線設定沿用 .streamlit/secrets.toml 的 [SUPABASE] 區段 (URL / KEY / BUCKET)。
+
+用法：python scripts/backfill_thumbnails.py [--dry-run] [--limit N]
+"""
+import argparse
+import os
+import sys
+import tomllib
+import urllib.request
+
+from supabase import create_client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from images import storage_path_from_url, upload_thumbnail  # noqa: E402
+
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+PAGE_ROWS = 1000  # PostgREST 預設單次最多回傳 1000 列
+
+def load_config():
+    with open(SECRETS_FILE, "rb") as f: return tomllib.load(f)["SUPABASE"]
+
+def fetch_original(bucket, bucket_name, url):
+    path = storage_path_from_url(url, bucket_name)
+    if path: return bucket.download(path)
+    with urllib.request.urlopen(url, timeout=30) as resp: return resp.read()
+
+def fetch_pending(client, limit=None):
+    # 依 id keyset 分頁：PostgREST 單次最多回傳 PAGE_ROWS 列，一次 select 會漏掉之後的器材
+    rows = []; after_id = 0
+    while limit is None or len(rows) < limit:
+        n = PAGE_ROWS if limit is None else min(PAGE_ROWS, limit - len(rows))
+        page = (client.table("equipment").select("id, uid, image_url").is_("thumbnail_url", "null").not_.is_("image_url", "null")
+                .gt("id", after_id).order("id").limit(n).execute().data)
+        rows.extend(page)
+        if len(page) < n: break
+        after_id = page[-1]['id']
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="只列出要處理的器材，不上傳也不寫入")
+    parser.add_argument("--limit", type=int, default=None, help="最多處理幾筆")
+    args = parser.parse_args()
+
+    cfg = load_config()
+    client = create_client(cfg["URL"], cfg["KEY"])
+    bucket = client.storage.from_(cfg["BUCKET"])
+
+    rows = fetch_pending(client, args.limit)
+    print(f"{len(rows)} 筆需要補縮圖")
+
+    done = failed = 0
+    for row in rows:
+        if args.dry_run: print(f"  {row['uid']}: {row['image_url']}"); continue
+        try:
+            thumb_url = upload_thumbnail(bucket, fetch_original(bucket, cfg["BUCKET"], row['image_url']))
+            client.table("equipment").update({"thumbnail_url": thumb_url}).eq("uid", row['uid']).execute()
+            done += 1
+        except Exception as e:
+            failed += 1; print(f"  ✗ {row['uid']}: {e}")
+    if not args.dry_run: print(f"完成 {done} 筆，失敗 {failed} 筆")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
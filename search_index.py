@@ -0,0 +1,83 @@
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+
+# ==========================================
+# 器材搜尋索引 (本機快取模式用)
+# ==========================================
+# 對 uid / name / location 各自建單字 + 雙字 (bigram) 反向索引與前綴索引，中文不需斷詞也能查。
+# 查詢取 bigram posting 的交集當候選 (全在 C 層的 set 運算)，長度 > 2 的查詢再用字面 `in` 確認，
+# 不會把使用者輸入當正規表示式。索引建好後唯讀，可以跨 session 共用。
+
+SEARCH_FIELDS = ("uid", "name", "location")
+_EMPTY = frozenset()
+
+def normalize_text(value):
+    # 全形轉半形、忽略大小寫；None / NaN 視為空字串
+    if value is None or value != value: return ""
+    return unicodedata.normalize("NFKC", str(value)).casefold()
+
+def _grams(text):
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+def _freeze(d): return {k: frozenset(v) for k, v in d.items()}
+
+class InventorySearchIndex:
+    def __init__(self, df):
+        self.size = len(df)
+        self._cols = {f: [normalize_text(v) for v in df[f]] if f in df.columns else [""] * self.size for f in SEARCH_FIELDS}
+        postings = {f: defaultdict(set) for f in SEARCH_FIELDS}
+        prefixes = {f: defaultdict(set) for f in SEARCH_FIELDS}
+        uid_exact = defaultdict(set)
+        for f in SEARCH_FIELDS:
+            col, post, pre = self._cols[f], postings[f], prefixes[f]
+            for i, text in enumerate(col):
+                for g in _grams(text): post[g].add(i)
+                if text: pre[text[:1]].add(i); pre[text[:2]].add(i)
+        for i, uid in enumerate(self._cols["uid"]): uid_exact[uid].add(i)
+        self._postings = {f: _freeze(d) for f, d in postings.items()}
+        self._prefixes = {f: _freeze(d) for f, d in prefixes.items()}
+        self._uid_exact = _freeze(uid_exact)
+        self.search = lru_cache(maxsize=256)(self._search)
+
+    def _contains(self, field, q, grams):
+        post = self._postings[field]
+        lists = sorted((post.get(g, _EMPTY) for g in grams), key=len)
+        hits = lists[0]
+        for p in lists[1:]:
+            if not hits: return _EMPTY
+            hits = hits & p
+        if len(q) > 2:  # bigram 交集可能有偽陽性，逐筆確認
+            col = self._cols[field]
+            hits = frozenset(i for i in hits if q in col[i])
+        return hits
+
+    def _startswith(self, field, q, contains):
+        hits = self._prefixes[field].get(q[:2], _EMPTY)
+        if len(q) > 2:
+            col = self._cols[field]
+            hits = frozenset(i for i in hits & contains if col[i].startswith(q))
+        return hits
+
+    def _search(self, query):
+        # 回傳依相關度排序的列位置 (tuple，對應建索引時 df 的 iloc)
+        # 排序：uid 完全相符 > uid 開頭 > 名稱開頭 > 名稱包含 > uid 包含 > 位置包含，同級維持原順序
+        q = normalize_text(query).strip()
+        if not q: return tuple(range(self.size))
+        grams = {q} if len(q) <= 2 else {q[i:i + 2] for i in range(len(q) - 1)}
+        in_uid = self._contains("uid", q, grams)
+        in_name = self._contains("name", q, grams)
+        in_loc = self._contains("location", q, grams)
+        buckets = [
+            self._uid_exact.get(q, _EMPTY),
+            self._startswith("uid", q, in_uid),
+            self._startswith("name", q, in_name),
+            in_name, in_uid, in_loc,
+        ]
+        result = []; seen = set()
+        for b in buckets:
+            b = b - seen
+            if b: result.extend(sorted(b)); seen |= b
+        return tuple(result)
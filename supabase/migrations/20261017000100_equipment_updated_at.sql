@@ -0,0 +1,26 @@
+-- equipment.updated_at 改為精確到微秒的 timestamptz，並由資料庫在每次寫入時自動更新，
+-- 讓 app 端可以用 updated_at >= 上次同步點 做增量同步 (見 app.py fetch_equipment_delta)。
+
+alter table public.equipment
+    alter column updated_at type timestamptz using updated_at::timestamptz,
+    alter column updated_at set default now();
+
+update public.equipment set updated_at = now() where updated_at is null;
+alter table public.equipment alter column updated_at set not null;
+
+create or replace function public.touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := clock_timestamp();
+    return new;
+end;
+$$;
+
+drop trigger if exists equipment_touch_updated_at on public.equipment;
+create trigger equipment_touch_updated_at
+    before insert or update on public.equipment
+    for each row execute function public.touch_updated_at();
+
+create index if not exists equipment_updated_at_idx on public.equipment (updated_at);
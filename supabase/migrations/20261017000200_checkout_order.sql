@@ -0,0 +1,56 @@
+-- 借用結帳：整張借用單在同一個交易內完成，任一項庫存不足就整張取消。
+-- p_items 格式：[{"uid": "A001", "qty": 2}, ...]
+-- 庫存不足時丟出 'insufficient_stock: uid1,uid2'，app 端據此轉成 CheckoutError。
+
+create or replace function public.checkout_order(
+    p_borrower text,
+    p_contact text,
+    p_borrow_date timestamp,
+    p_items jsonb
+)
+returns setof public.borrow_records
+language plpgsql
+as $$
+declare
+    v_short text;
+begin
+    create temp table _order on commit drop as
+        select x->>'uid' as uid, sum((x->>'qty')::int) as qty
+        from jsonb_array_elements(p_items) as x
+        group by 1;
+
+    if exists (select 1 from _order where qty <= 0) then
+        raise exception 'invalid quantity';
+    end if;
+
+    -- 依 uid 排序上鎖，兩張同時送出的單不會互相死結
+    perform 1 from public.equipment e
+        where e.uid in (select uid from _order)
+        order by e.uid
+        for update;
+
+    select string_agg(o.uid, ',' order by o.uid) into v_short
+    from _order o
+    left join public.equipment e on e.uid = o.uid
+    where e.uid is null
+       or e.status in ('維修中', '報廢')
+       or e.quantity - coalesce(e.borrowed, 0) < o.qty;
+
+    if v_short is not null then
+        raise exception 'insufficient_stock: %', v_short;
+    end if;
+
+    update public.equipment e
+        set borrowed = coalesce(e.borrowed, 0) + o.qty
+        from _order o
+        where e.uid = o.uid;
+
+    return query
+        insert into public.borrow_records
+            (equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date)
+        select e.uid, e.name, p_borrower, p_contact, o.qty, false, p_borrow_date
+        from _order o
+        join public.equipment e on e.uid = o.uid
+        returning *;
+end;
+$$;
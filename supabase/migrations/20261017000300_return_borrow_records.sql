@@ -0,0 +1,50 @@
+-- 批次歸還：一次呼叫結案多筆借用紀錄並扣回 equipment.borrowed，全部在同一個交易內完成。
+-- p_items 格式：[{"record_id": 12, "uid": "A001", "qty": 2}, ...]
+-- uid / qty 必須與紀錄相符才會結案 (避免畫面資料過期時扣錯)，不符的回報 mismatch。
+-- 同一個 record_id 重複出現時只處理第一筆 (每筆紀錄回報一列)，不會重複扣回 borrowed。
+
+create or replace function public.return_borrow_records(p_items jsonb)
+returns table (record_id bigint, ok boolean, reason text)
+language plpgsql
+as $$
+begin
+    return query
+    with req as (
+        select distinct on ((x->>'record_id')::bigint)
+               (x->>'record_id')::bigint as record_id,
+               x->>'uid' as uid,
+               (x->>'qty')::int as qty
+        from jsonb_array_elements(p_items) with ordinality as t(x, n)
+        order by (x->>'record_id')::bigint, n
+    ),
+    closed as (
+        update public.borrow_records b
+            set is_returned = true, return_date = now()
+            from req
+            where b.id = req.record_id
+              and b.equipment_uid = req.uid
+              and b.borrow_qty = req.qty
+              and b.is_returned = false
+            returning b.id, b.equipment_uid, b.borrow_qty
+    ),
+    released as (
+        -- 同一器材的多筆紀錄先加總，避免同一列在一個語句內被更新兩次
+        update public.equipment e
+            set borrowed = greatest(0, coalesce(e.borrowed, 0) - c.qty)
+            from (select equipment_uid, sum(borrow_qty)::int as qty from closed group by 1) c
+            where e.uid = c.equipment_uid
+            returning e.uid
+    )
+    select req.record_id,
+           closed.id is not null,
+           case
+               when closed.id is not null then null
+               when b.id is null then 'not_found'
+               when b.is_returned then 'already_returned'
+               else 'mismatch'
+           end
+    from req
+    left join closed on closed.id = req.record_id
+    left join public.borrow_records b on b.id = req.record_id;
+end;
+$$;
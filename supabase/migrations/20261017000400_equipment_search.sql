@@ -0,0 +1,20 @@
+-- 搜尋與分類篩選下推到資料庫：
+--   * name / uid / location 的 ilike '%關鍵字%' 走 pg_trgm GIN 索引 (搜尋欄位與本機模式的搜尋索引相同)；
+--     關鍵字至少要 3 個字才抽得出三字組，1~2 個字 (例如單一中文字) 的查詢用不到索引，會掃過整張表。
+--     器材表只有數千列，掃表仍在毫秒等級；表變大時再考慮為短查詢另建 bigram 索引
+--   * 分類篩選與排序走 (category, id) 索引
+--   * 分類數量由 equipment_category_counts 檢視表一次聚合，不必把整張表拉回 app
+
+create extension if not exists pg_trgm;
+
+create index if not exists equipment_name_trgm_idx on public.equipment using gin (name gin_trgm_ops);
+create index if not exists equipment_uid_trgm_idx on public.equipment using gin (uid gin_trgm_ops);
+create index if not exists equipment_location_trgm_idx on public.equipment using gin (location gin_trgm_ops);
+create index if not exists equipment_category_id_idx on public.equipment (category, id desc);
+
+create or replace view public.equipment_category_counts
+with (security_invoker = true)
+as
+select category, count(*)::int as item_count
+from public.equipment
+group by category;
@@ -0,0 +1,30 @@
+-- 庫存摘要：每筆器材的狀態分組存成產生欄位，指標列、分類/狀態篩選都直接讀它，不必在 app 端掃整張表。
+-- 分組規則與 app.py compute_status_buckets / get_status_display 相同：
+--   維修中 / 報廢 (手動狀態優先) > 已借完 (可用 <= 0) > 部分 (有借出) > 足額
+
+alter table public.equipment
+    add column if not exists availability text
+    generated always as (
+        case
+            when status in ('維修中', '報廢') then status
+            when quantity - coalesce(borrowed, 0) <= 0 then '已借完'
+            when coalesce(borrowed, 0) > 0 then '部分'
+            else '足額'
+        end
+    ) stored;
+
+create index if not exists equipment_availability_id_idx on public.equipment (availability, id desc);
+
+-- 取代 equipment_category_counts：同一個查詢同時提供分類與狀態的筆數和數量總計
+drop view if exists public.equipment_category_counts;
+
+create or replace view public.equipment_summary
+with (security_invoker = true)
+as
+select category,
+       availability,
+       count(*)::int as item_count,
+       coalesce(sum(quantity), 0)::int as quantity,
+       coalesce(sum(borrowed), 0)::int as borrowed
+from public.equipment
+group by category, availability;
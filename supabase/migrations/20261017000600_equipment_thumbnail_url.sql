@@ -0,0 +1,2 @@
+-- 卡片與編輯視窗改用縮圖 (見 images.py)；舊資料由 scripts/backfill_thumbnails.py 補上。
+alter table public.equipment add column if not exists thumbnail_url text;
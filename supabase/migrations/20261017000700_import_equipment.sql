@@ -0,0 +1,50 @@
+-- 批次匯入器材：以 uid 為鍵 upsert，一次呼叫處理一整塊 (app 端每塊 500 列)。
+-- p_rows 格式：[{"uid": "A001", "name": "...", "category": "...", "status": "在庫", "location": "...", "quantity": 3}, ...]
+-- 既有器材只更新基本資料，不動 borrowed 與照片；新總數小於目前借出數量的列不寫入，回報 quantity_below_borrowed。
+
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'equipment_uid_key') then
+        alter table public.equipment add constraint equipment_uid_key unique (uid);
+    end if;
+end;
+$$;
+
+create or replace function public.import_equipment(p_rows jsonb)
+returns table (equipment_uid text, action text)
+language plpgsql
+as $$
+begin
+    return query
+    with req as (
+        select x->>'uid' as uid,
+               x->>'name' as name,
+               x->>'category' as category,
+               x->>'status' as status,
+               x->>'location' as location,
+               (x->>'quantity')::int as quantity
+        from jsonb_array_elements(p_rows) as x
+    ),
+    written as (
+        insert into public.equipment as e (uid, name, category, status, location, quantity, borrowed)
+        select req.uid, req.name, req.category, req.status, req.location, req.quantity, 0
+        from req
+        on conflict on constraint equipment_uid_key do update
+            set name = excluded.name,
+                category = excluded.category,
+                status = excluded.status,
+                location = excluded.location,
+                quantity = excluded.quantity
+            where coalesce(e.borrowed, 0) <= excluded.quantity
+        returning e.uid, (e.xmax = 0) as inserted
+    )
+    select req.uid,
+           case
+               when w.uid is null then 'quantity_below_borrowed'
+               when w.inserted then 'inserted'
+               else 'updated'
+           end
+    from req
+    left join written w on w.uid = req.uid;
+end;
+$$;
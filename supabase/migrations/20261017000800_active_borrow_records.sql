@@ -0,0 +1,15 @@
+-- 歸還頁用：未歸還的借用紀錄直接帶上器材分類，app 端不必再下載整張 equipment 表逐筆比對 uid。
+-- join 走 equipment_uid_key (uid 唯一索引)；器材已刪除或沒有分類的紀錄歸到「其他」，與補印單據的既有行為相同。
+
+create index if not exists borrow_records_active_idx
+    on public.borrow_records (borrow_date desc)
+    where is_returned = false;
+
+create or replace view public.active_borrow_records
+with (security_invoker = true)
+as
+select b.*,
+       coalesce(e.category, '其他') as category
+from public.borrow_records b
+left join public.equipment e on e.uid = b.equipment_uid
+where b.is_returned = false;
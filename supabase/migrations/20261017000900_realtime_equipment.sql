@@ -0,0 +1,13 @@
+-- 庫存即時推播：把 equipment 加進 Supabase Realtime 的 publication，app 端 (realtime_feed.py) 訂閱後直接修補快取。
+-- 預設 replica identity 下 UPDATE / INSERT 帶完整新列，DELETE 只帶主鍵 id，app 端依 id 移除。
+
+do $$
+begin
+    if not exists (
+        select 1 from pg_publication_tables
+        where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'equipment'
+    ) then
+        alter publication supabase_realtime add table public.equipment;
+    end if;
+end;
+$$;
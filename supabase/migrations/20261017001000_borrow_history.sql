@@ -0,0 +1,100 @@
+-- 借用歷史：已歸還的紀錄定期搬到 borrow_records_archive，borrow_records 只留未歸還與近期紀錄；
+-- 歸還頁的查詢走 borrow_records_active_idx (部分索引，只含 is_returned = false)，不受歷史筆數影響。
+-- 歷史頁讀 borrow_history (兩張表 union all)，篩選條件會推進兩邊各自走索引；分頁依 (borrow_date, id) 排序。
+
+create index if not exists borrow_records_history_idx on public.borrow_records (borrow_date desc, id desc);
+create index if not exists borrow_records_borrower_idx on public.borrow_records (borrower_name, borrow_date desc);
+create index if not exists borrow_records_uid_idx on public.borrow_records (equipment_uid, borrow_date desc);
+create index if not exists borrow_records_returned_idx on public.borrow_records (return_date) where is_returned = true;
+
+-- 欄位與 borrow_records 相同 (like 不複製預設值與序號，id 沿用原紀錄)，多一欄歸檔時間
+create table if not exists public.borrow_records_archive (
+    like public.borrow_records,
+    archived_at timestamptz not null default now(),
+    primary key (id)
+);
+
+create index if not exists borrow_records_archive_history_idx on public.borrow_records_archive (borrow_date desc, id desc);
+create index if not exists borrow_records_archive_borrower_idx on public.borrow_records_archive (borrower_name, borrow_date desc);
+create index if not exists borrow_records_archive_uid_idx on public.borrow_records_archive (equipment_uid, borrow_date desc);
+
+alter table public.borrow_records_archive enable row level security;
+
+-- 歸檔：歸還時間早於 p_before 的紀錄，每次最多搬 p_limit 筆 (刪除與寫入在同一個語句，中途失敗不會遺失)；
+-- 回傳這次搬了幾筆，呼叫端重複呼叫到 0 為止 (scripts/archive_borrow_records.py)。
+-- 也可以交給 pg_cron：select cron.schedule('archive-borrows', '0 3 * * *', $$select public.archive_borrow_records(now() - interval '180 days')$$);
+create or replace function public.archive_borrow_records(p_before timestamptz, p_limit int default 5000)
+returns int
+language plpgsql
+as $$
+declare
+    v_moved int;
+begin
+    with moved as (
+        delete from public.borrow_records b
+        where b.id in (
+            select id from public.borrow_records
+            where is_returned = true and return_date < p_before
+            order by return_date
+            limit p_limit
+            for update skip locked
+        )
+        returning b.*
+    )
+    insert into public.borrow_records_archive
+    select m.*, now() from moved m;
+    get diagnostics v_moved = row_count;
+    return v_moved;
+end;
+$$;
+
+create or replace view public.borrow_history
+with (security_invoker = true)
+as
+select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty,
+       is_returned, borrow_date, return_date, false as archived
+from public.borrow_records
+union all
+select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty,
+       is_returned, borrow_date, return_date, true as archived
+from public.borrow_records_archive;
+
+-- 每項器材的使用統計 (含已歸檔)，篩選條件同歷史頁；在資料庫端聚合，app 只拿到每項器材一列
+create or replace function public.borrow_usage_stats(
+    p_borrower text default null,
+    p_uid text default null,
+    p_from timestamp default null,
+    p_to timestamp default null,
+    p_limit int default 50
+)
+returns table (
+    equipment_uid text,
+    equipment_name text,
+    borrow_count bigint,
+    total_qty bigint,
+    borrower_count bigint,
+    active_qty bigint,
+    avg_days numeric,
+    last_borrowed timestamp
+)
+language sql
+stable
+as $$
+    select h.equipment_uid,
+           max(h.equipment_name),
+           count(*),
+           sum(h.borrow_qty),
+           count(distinct h.borrower_name),
+           coalesce(sum(h.borrow_qty) filter (where not h.is_returned), 0),
+           round((avg(extract(epoch from (h.return_date::timestamp - h.borrow_date::timestamp)))
+                  filter (where h.is_returned) / 86400)::numeric, 1),
+           max(h.borrow_date)::timestamp
+    from public.borrow_history h
+    where (p_borrower is null or h.borrower_name = p_borrower)
+      and (p_uid is null or h.equipment_uid = p_uid)
+      and (p_from is null or h.borrow_date >= p_from)
+      and (p_to is null or h.borrow_date < p_to)
+    group by h.equipment_uid
+    order by count(*) desc, h.equipment_uid
+    limit p_limit;
+$$;
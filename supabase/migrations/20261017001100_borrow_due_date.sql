@@ -0,0 +1,151 @@
+-- 預約 / 借期：借用紀錄多一欄預計歸還時間 due_date，一筆未歸還的紀錄佔用 [borrow_date, due_date) 這段期間。
+-- checkout_order 改以期間檢查庫存：要借的期間內，同一時刻已被佔用的最大數量 + 這次的數量不得超過總數；
+-- 所以下個月的營隊可以先預約目前借出中、但屆時已歸還的器材。規則與 app 端 availability.py 相同：
+--   沒有 due_date 的舊紀錄視為借 7 天；逾期未還的視為至少佔用到明天。
+-- equipment.borrowed 仍是所有未歸還紀錄 (含未來預約) 的數量合計。
+
+alter table public.borrow_records add column if not exists due_date timestamp;
+alter table public.borrow_records_archive add column if not exists due_date timestamp;
+
+-- 依 uid 讀未歸還紀錄的期間 (結帳檢查、app 建索引)，不必回表
+create index if not exists borrow_records_active_uid_idx
+    on public.borrow_records (equipment_uid, borrow_date)
+    include (borrow_qty, due_date)
+    where is_returned = false;
+
+-- 兩張表的欄位順序已不同 (archived_at 在 due_date 前)，歸檔改用明確欄位清單
+create or replace function public.archive_borrow_records(p_before timestamptz, p_limit int default 5000)
+returns int
+language plpgsql
+as $$
+declare
+    v_moved int;
+begin
+    with moved as (
+        delete from public.borrow_records b
+        where b.id in (
+            select id from public.borrow_records
+            where is_returned = true and return_date < p_before
+            order by return_date
+            limit p_limit
+            for update skip locked
+        )
+        returning b.*
+    )
+    insert into public.borrow_records_archive
+        (id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty,
+         is_returned, borrow_date, return_date, due_date, archived_at)
+    select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty,
+           is_returned, borrow_date, return_date, due_date, now()
+    from moved;
+    get diagnostics v_moved = row_count;
+    return v_moved;
+end;
+$$;
+
+create or replace view public.borrow_history
+with (security_invoker = true)
+as
+select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty,
+       is_returned, borrow_date, return_date, false as archived, due_date
+from public.borrow_records
+union all
+select id, equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty,
+       is_returned, borrow_date, return_date, true as archived, due_date
+from public.borrow_records_archive;
+
+-- b.* 在建立檢視表時就展開了，重建一次才會帶上 due_date (欄位順序改變，不能 create or replace)
+drop view if exists public.active_borrow_records;
+
+create view public.active_borrow_records
+with (security_invoker = true)
+as
+select b.*,
+       coalesce(e.category, '其他') as category
+from public.borrow_records b
+left join public.equipment e on e.uid = b.equipment_uid
+where b.is_returned = false;
+
+drop function if exists public.checkout_order(text, text, timestamp, jsonb);
+
+create or replace function public.checkout_order(
+    p_borrower text,
+    p_contact text,
+    p_borrow_date timestamp,
+    p_items jsonb,
+    p_due_date timestamp default null
+)
+returns setof public.borrow_records
+language plpgsql
+as $$
+declare
+    v_short text;
+    v_due timestamp := coalesce(p_due_date, p_borrow_date + interval '7 days');
+begin
+    if v_due <= p_borrow_date then
+        raise exception 'invalid period';
+    end if;
+
+    create temp table _order on commit drop as
+        select x->>'uid' as uid, sum((x->>'qty')::int) as qty
+        from jsonb_array_elements(p_items) as x
+        group by 1;
+
+    if exists (select 1 from _order where qty <= 0) then
+        raise exception 'invalid quantity';
+    end if;
+
+    -- 依 uid 排序上鎖，兩張同時送出的單不會互相死結 (也擋住同一器材的並行結帳)
+    perform 1 from public.equipment e
+        where e.uid in (select uid from _order)
+        order by e.uid
+        for update;
+
+    -- 期間內的最大佔用量一定出現在某個起點：要借的開始時間，或期間內其他紀錄的開始時間
+    with overlapping as (
+        select b.equipment_uid as uid, b.borrow_qty as qty, b.borrow_date as s,
+               greatest(coalesce(b.due_date, b.borrow_date + interval '7 days'),
+                        now()::timestamp + interval '1 day') as e
+        from public.borrow_records b
+        where b.is_returned = false
+          and b.equipment_uid in (select uid from _order)
+          and b.borrow_date < v_due
+    ),
+    points as (
+        select uid, p_borrow_date as t from _order
+        union
+        select uid, s from overlapping where s > p_borrow_date
+    ),
+    peak as (
+        select p.uid,
+               max((select coalesce(sum(o.qty), 0) from overlapping o
+                    where o.uid = p.uid and o.s <= p.t and o.e > p.t)) as qty
+        from points p
+        group by p.uid
+    )
+    select string_agg(o.uid, ',' order by o.uid) into v_short
+    from _order o
+    left join public.equipment e on e.uid = o.uid
+    left join peak on peak.uid = o.uid
+    where e.uid is null
+       or e.status in ('維修中', '報廢')
+       or e.quantity - coalesce(peak.qty, 0) < o.qty;
+
+    if v_short is not null then
+        raise exception 'insufficient_stock: %', v_short;
+    end if;
+
+    update public.equipment e
+        set borrowed = coalesce(e.borrowed, 0) + o.qty
+        from _order o
+        where e.uid = o.uid;
+
+    return query
+        insert into public.borrow_records
+            (equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, due_date)
+        select e.uid, e.name, p_borrower, p_contact, o.qty, false, p_borrow_date, v_due
+        from _order o
+        join public.equipment e on e.uid = o.uid
+        returning *;
+end;
+$$;
@@ -0,0 +1,210 @@
+-- equipment.borrowed 改回「目前借出中」的數量：只計借出時間已到的未歸還紀錄。
+-- 未來的預約先不計入 (否則 borrowed 可能大於 quantity：編輯畫面、剩餘可用、availability 與匯入檢查都會出錯)，
+-- 期間可借數量一律由 checkout_order 的期間檢查 / app 的 availability.py 計算。
+-- borrow_records.counted 標記這筆紀錄是否已計入 borrowed；預約的借出時間到了由 start_due_borrows() 補上
+-- (有 pg_cron 時每分鐘自動執行，app 同步庫存時也會呼叫)。
+
+alter table public.borrow_records add column if not exists counted boolean not null default true;
+
+-- 已經建立的未來預約：從 borrowed 扣掉，改為尚未計入
+with future as (
+    update public.borrow_records
+        set counted = false
+        where is_returned = false and borrow_date > now()::timestamp
+        returning equipment_uid, borrow_qty
+)
+update public.equipment e
+    set borrowed = greatest(0, coalesce(e.borrowed, 0) - f.qty)
+    from (select equipment_uid, sum(borrow_qty)::int as qty from future group by 1) f
+    where e.uid = f.equipment_uid;
+
+create index if not exists borrow_records_uncounted_idx
+    on public.borrow_records (borrow_date)
+    where is_returned = false and counted = false;
+
+-- b.* 要重新展開才會帶上 counted (歸還頁用它決定樂觀更新要不要扣回 borrowed)
+drop view if exists public.active_borrow_records;
+
+create view public.active_borrow_records
+with (security_invoker = true)
+as
+select b.*,
+       coalesce(e.category, '其他') as category
+from public.borrow_records b
+left join public.equipment e on e.uid = b.equipment_uid
+where b.is_returned = false;
+
+create or replace function public.start_due_borrows()
+returns int
+language plpgsql
+as $$
+declare
+    v_started int;
+begin
+    -- 與 checkout_order 相同，依 uid 排序上鎖
+    perform 1 from public.equipment e
+        where e.uid in (
+            select equipment_uid from public.borrow_records
+            where is_returned = false and counted = false and borrow_date <= now()::timestamp
+        )
+        order by e.uid
+        for update;
+
+    with due as (
+        update public.borrow_records b
+            set counted = true
+            where b.is_returned = false and b.counted = false and b.borrow_date <= now()::timestamp
+            returning b.equipment_uid, b.borrow_qty
+    ),
+    started as (
+        update public.equipment e
+            set borrowed = coalesce(e.borrowed, 0) + d.qty
+            from (select equipment_uid, sum(borrow_qty)::int as qty from due group by 1) d
+            where e.uid = d.equipment_uid
+            returning e.uid
+    )
+    select count(*) into v_started from due;
+    return v_started;
+end;
+$$;
+
+create or replace function public.checkout_order(
+    p_borrower text,
+    p_contact text,
+    p_borrow_date timestamp,
+    p_items jsonb,
+    p_due_date timestamp default null
+)
+returns setof public.borrow_records
+language plpgsql
+as $$
+declare
+    v_short text;
+    v_due timestamp := coalesce(p_due_date, p_borrow_date + interval '7 days');
+    v_counted boolean := p_borrow_date <= now()::timestamp;  -- 未來的預約等借出時間到了才計入 borrowed
+begin
+    if v_due <= p_borrow_date then
+        raise exception 'invalid period';
+    end if;
+
+    create temp table _order on commit drop as
+        select x->>'uid' as uid, sum((x->>'qty')::int) as qty
+        from jsonb_array_elements(p_items) as x
+        group by 1;
+
+    if exists (select 1 from _order where qty <= 0) then
+        raise exception 'invalid quantity';
+    end if;
+
+    -- 依 uid 排序上鎖，兩張同時送出的單不會互相死結 (也擋住同一器材的並行結帳)
+    perform 1 from public.equipment e
+        where e.uid in (select uid from _order)
+        order by e.uid
+        for update;
+
+    -- 期間內的最大佔用量一定出現在某個起點：要借的開始時間，或期間內其他紀錄的開始時間
+    with overlapping as (
+        select b.equipment_uid as uid, b.borrow_qty as qty, b.borrow_date as s,
+               greatest(coalesce(b.due_date, b.borrow_date + interval '7 days'),
+                        now()::timestamp + interval '1 day') as e
+        from public.borrow_records b
+        where b.is_returned = false
+          and b.equipment_uid in (select uid from _order)
+          and b.borrow_date < v_due
+    ),
+    points as (
+        select uid, p_borrow_date as t from _order
+        union
+        select uid, s from overlapping where s > p_borrow_date
+    ),
+    peak as (
+        select p.uid,
+               max((select coalesce(sum(o.qty), 0) from overlapping o
+                    where o.uid = p.uid and o.s <= p.t and o.e > p.t)) as qty
+        from points p
+        group by p.uid
+    )
+    select string_agg(o.uid, ',' order by o.uid) into v_short
+    from _order o
+    left join public.equipment e on e.uid = o.uid
+    left join peak on peak.uid = o.uid
+    where e.uid is null
+       or e.status in ('維修中', '報廢')
+       or e.quantity - coalesce(peak.qty, 0) < o.qty;
+
+    if v_short is not null then
+        raise exception 'insufficient_stock: %', v_short;
+    end if;
+
+    if v_counted then
+        update public.equipment e
+            set borrowed = coalesce(e.borrowed, 0) + o.qty
+            from _order o
+            where e.uid = o.uid;
+    end if;
+
+    return query
+        insert into public.borrow_records
+            (equipment_uid, equipment_name, borrower_name, contact_info, borrow_qty, is_returned, borrow_date, due_date, counted)
+        select e.uid, e.name, p_borrower, p_contact, o.qty, false, p_borrow_date, v_due, v_counted
+        from _order o
+        join public.equipment e on e.uid = o.uid
+        returning *;
+end;
+$$;
+
+-- 歸還 (或取消尚未開始的預約)：只有已計入的紀錄才扣回 borrowed
+create or replace function public.return_borrow_records(p_items jsonb)
+returns table (record_id bigint, ok boolean, reason text)
+language plpgsql
+as $$
+begin
+    return query
+    with req as (
+        select distinct on ((x->>'record_id')::bigint)
+               (x->>'record_id')::bigint as record_id,
+               x->>'uid' as uid,
+               (x->>'qty')::int as qty
+        from jsonb_array_elements(p_items) with ordinality as t(x, n)
+        order by (x->>'record_id')::bigint, n
+    ),
+    closed as (
+        update public.borrow_records b
+            set is_returned = true, return_date = now()
+            from req
+            where b.id = req.record_id
+              and b.equipment_uid = req.uid
+              and b.borrow_qty = req.qty
+              and b.is_returned = false
+            returning b.id, b.equipment_uid, b.borrow_qty, b.counted
+    ),
+    released as (
+        -- 同一器材的多筆紀錄先加總，避免同一列在一個語句內被更新兩次
+        update public.equipment e
+            set borrowed = greatest(0, coalesce(e.borrowed, 0) - c.qty)
+            from (select equipment_uid, sum(borrow_qty)::int as qty from closed where counted group by 1) c
+            where e.uid = c.equipment_uid
+            returning e.uid
+    )
+    select req.record_id,
+           closed.id is not null,
+           case
+               when closed.id is not null then null
+               when b.id is null then 'not_found'
+               when b.is_returned then 'already_returned'
+               else 'mismatch'
+           end
+    from req
+    left join closed on closed.id = req.record_id
+    left join public.borrow_records b on b.id = req.record_id;
+end;
+$$;
+
+-- 有 pg_cron 時每分鐘把到期的預約計入 borrowed
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule('start_due_borrows', '* * * * *', 'select public.start_due_borrows()');
+    end if;
+end;
+$$;
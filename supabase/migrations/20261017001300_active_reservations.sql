@@ -0,0 +1,20 @@
+-- 日期區間可借數量的索引 (app 端 availability.ReservationStore) 一次讀完所有未歸還紀錄的期間：
+-- 回傳欄位陣列 {"id", "uid", "start", "due", "qty"}，時間換成 epoch 秒 (timestamp 沒有時區，視為 UTC，與 app 端相同)，
+-- 沒有 due_date 的為 -1。一個請求取代原本每 1000 列一頁的 keyset 分頁，app 端也不必逐列解析日期字串。
+-- 之後的異動由 app 端依借還結果與 borrow_records 推播直接修補，只有第一次載入、過期或重連時才呼叫。
+
+create or replace function public.active_reservations()
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'id', coalesce(jsonb_agg(id order by id), '[]'::jsonb),
+        'uid', coalesce(jsonb_agg(equipment_uid order by id), '[]'::jsonb),
+        'start', coalesce(jsonb_agg(extract(epoch from borrow_date)::bigint order by id), '[]'::jsonb),
+        'due', coalesce(jsonb_agg(coalesce(extract(epoch from due_date)::bigint, -1) order by id), '[]'::jsonb),
+        'qty', coalesce(jsonb_agg(borrow_qty order by id), '[]'::jsonb)
+    )
+    from public.borrow_records
+    where is_returned = false;
+$$;
@@ -0,0 +1,14 @@
+-- 期間索引即時推播：把 borrow_records 加進 Supabase Realtime 的 publication。未來的預約不會改 equipment.borrowed，
+-- 其他程序只能靠這裡的推播知道期間被佔用；app 端 (realtime_feed.py) 依推來的整列修補 ReservationStore，
+-- DELETE (預設 replica identity 只帶主鍵 id) 依 id 移除，is_returned 變成 true 的 UPDATE 視同移除。
+
+do $$
+begin
+    if not exists (
+        select 1 from pg_publication_tables
+        where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'borrow_records'
+    ) then
+        alter publication supabase_realtime add table public.borrow_records;
+    end if;
+end;
+$$;
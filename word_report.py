@@ -0,0 +1,133 @@
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.shared import Mm, Pt, RGBColor
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.section import WD_ORIENT
+from docx.oxml.ns import qn, nsdecls
+from docx.oxml import OxmlElement, parse_xml
+
+from documents import build_document, get_taiwan_time_str
+
+# 借用 / 清點單 Word (python-docx) 與批次 ZIP。由 documents.renderer() 在第一次產生 Word 時才匯入
+# ==========================================
+# Word 生成模組
+# ==========================================
+def set_cell_bg(cell, color_hex):
+    shading_elm = OxmlElement('w:shd')
+    shading_elm.set(qn('w:val'), 'clear'); shading_elm.set(qn('w:color'), 'auto'); shading_elm.set(qn('w:fill'), color_hex)
+    cell._tc.get_or_add_tcPr().append(shading_elm)
+
+WORD_FONT = "Microsoft JhengHei"
+WORD_WIDTHS = [12, 10, 30, 8, 13, 13, 13]; WORD_TABLE_MM = 273
+
+def set_default_font(doc, font_name):
+    # 字型設在 Normal 樣式上 (含東亞字型)，各段落/儲存格不必再逐一設定 run
+    style = doc.styles['Normal']; style.font.name = font_name
+    style.element.get_or_add_rPr().get_or_add_rFonts().set(qn('w:eastAsia'), font_name)
+
+def _word_cell(width, text="", merge=None):
+    # merge: None / "restart" (合併區塊第一格) / "continue"
+    v_merge = '' if merge is None else ('<w:vMerge w:val="restart"/>' if merge == "restart" else '<w:vMerge/>')
+    run = f'<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r>' if text else ''
+    return (f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/>{v_merge}<w:vAlign w:val="center"/></w:tcPr>'
+            f'<w:p><w:pPr><w:jc w:val="center"/></w:pPr>{run}</w:p></w:tc>')
+
+def _word_rows_xml(cart_data, widths):
+    # 一次組出所有資料列；分類欄的合併範圍直接由 cart_data 算出 (相鄰同分類為一塊)
+    rows = []; n = len(cart_data)
+    for idx, item in enumerate(cart_data):
+        cat = item['category']
+        first = idx == 0 or cart_data[idx - 1]['category'] != cat
+        last = idx == n - 1 or cart_data[idx + 1]['category'] != cat
+        merge = None if (first and last) else ("restart" if first else "continue")
+        cells = [_word_cell(widths[0], str(cat) if first else "", merge),
+                 _word_cell(widths[1], str(item['uid'])), _word_cell(widths[2], str(item['name'])),
+                 _word_cell(widths[3], str(item['borrow_qty']))]
+        cells += [_word_cell(w) for w in widths[4:]]
+        rows.append('<w:tr>' + ''.join(cells) + '</w:tr>')
+    return parse_xml(f'<w:tbl {nsdecls("w")}>' + ''.join(rows) + '</w:tbl>')
+
+def create_word(cart_data, borrower, contact, b_date, r_date):
+    doc = Document(); section = doc.sections[0]; section.orientation = WD_ORIENT.LANDSCAPE
+    section.page_width = Mm(297); section.page_height = Mm(210)
+    section.left_margin = Mm(12); section.right_margin = Mm(12)
+    set_default_font(doc, WORD_FONT)
+    
+    heading = doc.add_paragraph("團隊器材借用 / 清點單"); heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    run = heading.runs[0]; run.font.size = Pt(24); run.bold = True
+    
+    info_para = doc.add_paragraph()
+    info_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
+    info_run = info_para.add_run(f"借用人：{borrower}    聯絡方式：{contact}    租借期間：{b_date} ~ {r_date}")
+    info_run.font.size = Pt(12)
+
+    date_para = doc.add_paragraph(f"製表日期: {get_taiwan_time_str()}"); date_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    
+    table = doc.add_table(rows=1, cols=7); table.style = 'Table Grid'; table.autofit = False 
+    headers = ["分類項目", "編號", "器材名稱", "借用數量", "營前清點", "離營清點", "營後清點"]
+    col_widths = [Mm(WORD_TABLE_MM * w / 100) for w in WORD_WIDTHS]
+    hdr_row = table.rows[0]
+    for i, text in enumerate(headers):
+        cell = hdr_row.cells[i]; cell.text = text; set_cell_bg(cell, "E88B00")
+        para = cell.paragraphs[0]; para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        run = para.runs[0]; run.font.color.rgb = RGBColor(255, 255, 255); run.font.bold = True
+        run.font.size = Pt(12)
+        cell.width = col_widths[i]
+    table._tbl.extend(list(_word_rows_xml(cart_data, [w.twips for w in col_widths])))
+    doc.add_paragraph("\n"); sig_table = doc.add_table(rows=1, cols=3); sig_table.autofit = True; sig_table.width = Mm(273)
+    sig_cells = sig_table.rows[0].cells
+    sig_cells[0].text = "器材負責人：__________________"; sig_cells[1].text = "活動負責人：__________________"
+    sig_cells[2].text = "指導老師：__________________"
+    for cell in sig_cells: cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+    sig_cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.LEFT; sig_cells[2].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    f = io.BytesIO(); doc.save(f); f.seek(0); return f
+
+# ==========================================
+# 批次 DOCX (ZIP)
+# ==========================================
+# python-docx 組表是純 Python 的 CPU 工作，多執行緒受 GIL 限制，所以多核心時交給常駐子行程池。
+# 子行程用 spawn 啟動 (Streamlit 伺服器本身有多條執行緒，fork 可能複製到被鎖住的鎖)；單核心直接依序產生。
+# 子行程異常結束 (OOM 被砍等) 時池子會永久 broken：關掉丟棄，這次改在本行程依序產生，下次呼叫再建新的池子。
+BUNDLE_POOL_MIN_SECTIONS = 4
+_worker_pool = None
+_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    global _worker_pool
+    workers = os.cpu_count() or 1
+    if workers < 2: return None
+    with _pool_lock:
+        if _worker_pool is None:
+            _worker_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _worker_pool
+
+def discard_worker_pool(pool):
+    global _worker_pool
+    with _pool_lock:
+        if _worker_pool is pool: _worker_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _word_section(section):
+    _, cart_data, meta = section
+    return build_document('docx', cart_data, meta)
+
+def create_word_zip(sections):
+    # sections: [(檔名, cart_data, meta)]；每位借用人一份 DOCX，打包成一個 ZIP
+    pool = get_worker_pool() if len(sections) >= BUNDLE_POOL_MIN_SECTIONS else None
+    files = None
+    if pool:
+        try: files = list(pool.map(_word_section, sections, chunksize=max(1, len(sections) // (4 * os.cpu_count()))))
+        except BrokenProcessPool: discard_worker_pool(pool)
+    if files is None: files = map(_word_section, sections)
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for (title, _, _), data in zip(sections, files): zf.writestr(f"{title}.docx", data)
+    return out.getvalue()